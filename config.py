@@ -41,6 +41,21 @@ def load_parameters():
     BEAM_SEARCH = True                            # Switches on-off the beam search procedure.
     BEAM_SIZE = 6                                 # Beam size (in case of BEAM_SEARCH == True).
     OPTIMIZED_SEARCH = True                       # Compute annotations only a single time per sample.
+    INCREMENTAL_DECODING = False                  # Transformer: Cache the decoder self-attention inputs and process
+                                                  # only the last word at each timestep (requires OPTIMIZED_SEARCH).
+    SEARCH_BATCH_SIZE = 1                         # Number of sentences decoded at once by the beam search (sorted by
+                                                  # length). If > 1, it requires OPTIMIZED_SEARCH and PAD_ON_BATCH.
+    FOLD_EMBEDDING_PROJECTIONS = False            # AttentionRNNEncoderDecoder: Precompute the projection of the target
+                                                  # embeddings to the output layer (logit_emb) as a lookup table.
+    TRANSLATION_CACHE = None                      # Directory of the on-disk translation cache used by sample_ensemble.
+                                                  # Only sentences not found in the cache are translated. None: no cache.
+    TRANSLATION_CACHE_SIZE = 100000               # Maximum number of entries of the translation cache (LRU eviction).
+    VOCABULARY_SHORTLIST = False                  # Compute the output layer only for a shortlist of target words for each
+                                                  # sentence (batch): translations of the source words (from MAPPING),
+                                                  # glossary entries and the most frequent words. Requires OPTIMIZED_SEARCH.
+    SHORTLIST_SIZE = 2000                         # Number of target words of each shortlist.
+    SHORTLIST_TRANSLATIONS = 10                   # Max. number of candidate translations per source word taken from MAPPING.
+    SCORING_BATCH_SIZE = 256                      # Number of pairs scored at once (with teacher forcing) by score.py.
     SEARCH_PRUNING = False                        # Apply pruning strategies to the beam search method.
                                                   # It will likely increase decoding speed, but decrease quality.
     MAXLEN_GIVEN_X = True                         # Generate translations of similar length to the source sentences.
@@ -313,6 +328,12 @@ def load_parameters():
     RELOAD_EPOCH = True                                # Select whether we reload epoch or update number.
 
     REBUILD_DATASET = True                             # Build again or use stored instance.
+    DATASET_CACHE_PATH = None                          # If REBUILD_DATASET, reuse the dataset built with the same
+                                                       # files and parameters, cached in this directory. None: no cache.
+    MEMMAP_SPLITS = []                                 # Splits stored on disk as memory-mapped word indices, instead
+                                                       # of inside the Dataset instance (e.g. ['train']).
+    PREPROCESSING_WORKERS = 1                          # Processes that tokenize the text files when building the
+                                                       # dataset (tokenize_none, tokenize_bpe or tokenize_moses).
     MODE = 'training'                                  # 'training' or 'sampling' (if 'sampling' then RELOAD must
                                                        # be greater than 0 and EVAL_ON_SETS will be used).
 
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import functools
+import json
+import logging
+import os
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+VOCABULARY_FILE = 'vocabulary.json'
+
+# Vocabularies already read, shared by the splits of the same corpus: path -> {data id: idx2words list}
+_vocabularies = dict()
+
+
+def _read_vocabularies(path):
+    if path not in _vocabularies:
+        with open(os.path.join(path, VOCABULARY_FILE), 'r') as f:
+            _vocabularies[path] = json.load(f)
+    return _vocabularies[path]
+
+
+class MemmapTextSplit:
+    """
+    Text data of a split of a Dataset (e.g. ds.X_train['source_text']), stored on disk as the indices of its words:
+    a flat int32 array with the words of every sentence and an int64 array with the offset of each sentence
+    (<split>.<data id>.tokens.npy and <split>.<data id>.offsets.npy). Both are memory-mapped, so loading the Dataset
+    takes no time and several processes share the same pages.
+
+    It behaves as the list of sentences that it replaces: indexing or slicing it returns the tokenized sentences
+    (words separated by spaces). Words out of the vocabulary are returned as the unknown word.
+    """
+
+    def __init__(self, path, split, data_id):
+        """
+        :param str path: Directory of the corpus (see write_memmap_corpus).
+        :param str split: Name of the split.
+        :param str data_id: Identifier of the input/output of the Dataset.
+        """
+        self.path = path
+        self.split = split
+        self.data_id = data_id
+        self.open()
+
+    def open(self):
+        prefix = os.path.join(self.path, self.split + '.' + self.data_id)
+        self.tokens = np.load(prefix + '.tokens.npy', mmap_mode='r')
+        self.offsets = np.load(prefix + '.offsets.npy', mmap_mode='r')
+        self.idx2words = _read_vocabularies(self.path)[self.data_id]
+        # Order in which the sentences are returned (None: corpus order)
+        self.order = None
+
+    def __getstate__(self):
+        # Only the location of the corpus is pickled
+        return {'path': self.path, 'split': self.split, 'data_id': self.data_id}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.sentence(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Sentence index out of range')
+        return self.sentence(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sentence(i)
+
+    def sentence(self, index):
+        """
+        :param int index: Position of the sentence (in the current order).
+        :return: Tokenized sentence.
+        """
+        if self.order is not None:
+            index = self.order[index]
+        return u' '.join([self.idx2words[idx] for idx in self.tokens[self.offsets[index]:self.offsets[index + 1]]])
+
+    def word_indices(self, index):
+        """
+        :param int index: Position of the sentence (in the current order).
+        :return: Array with the indices of the words of the sentence.
+        """
+        if self.order is not None:
+            index = self.order[index]
+        return np.asarray(self.tokens[self.offsets[index]:self.offsets[index + 1]])
+
+
+def write_memmap_corpus(ds, path, splits=None):
+    """
+    Stores the text data of some splits of a Dataset as memory-mapped word indices (see MemmapTextSplit) and replaces
+    them in the Dataset, so the Dataset pickle no longer contains them. Only data with a vocabulary is stored.
+
+    :param ds: Dataset instance.
+    :param str path: Directory where the corpus is stored. It must be kept along with the Dataset.
+    :param list splits: Splits to store.
+    :return: Dataset object with the memory-mapped splits.
+    """
+    if splits is None:
+        splits = ['train']
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    vocabularies = dict()
+    for split in splits:
+        for set_name in ['X_', 'Y_']:
+            split_data = getattr(ds, set_name + split, None) or dict()
+            for data_id, sentences in split_data.items():
+                if data_id not in ds.vocabulary or not isinstance(sentences, list):
+                    continue
+                words2idx = ds.vocabulary[data_id]['words2idx']
+                unk_idx = words2idx[ds.unk_symbol if hasattr(ds, 'unk_symbol') else '<unk>']
+                offsets = np.zeros(len(sentences) + 1, dtype='int64')
+                offsets[1:] = np.cumsum([len(sentence.split()) for sentence in sentences])
+                prefix = os.path.join(path, split + '.' + data_id)
+                tokens = np.lib.format.open_memmap(prefix + '.tokens.npy', mode='w+', dtype='int32',
+                                                   shape=(int(offsets[-1]),))
+                for i, sentence in enumerate(sentences):
+                    tokens[offsets[i]:offsets[i + 1]] = [words2idx.get(word, unk_idx) for word in sentence.split()]
+                tokens.flush()
+                del tokens
+                np.save(prefix + '.offsets.npy', offsets)
+                vocabularies[data_id] = [ds.vocabulary[data_id]['idx2words'][i]
+                                         for i in range(len(ds.vocabulary[data_id]['idx2words']))]
+                logger.info('Stored %d sentences (%d words) of %s%s[%s] in %s' %
+                            (len(sentences), offsets[-1], set_name, split, data_id, path))
+    with open(os.path.join(path, VOCABULARY_FILE), 'w') as f:
+        json.dump(vocabularies, f)
+    _vocabularies.pop(path, None)
+
+    for split in splits:
+        for set_name in ['X_', 'Y_']:
+            split_data = getattr(ds, set_name + split, None) or dict()
+            for data_id in list(split_data):
+                if data_id in vocabularies:
+                    split_data[data_id] = MemmapTextSplit(path, split, data_id)
+    if memmap_splits(ds, 'train'):
+        # The data generators call ds.shuffleTraining() at the beginning of each epoch. The replacement is an
+        # attribute of the instance, so it is pickled along with it
+        ds.shuffleTraining = functools.partial(shuffle_memmap_splits, ds, 'train')
+    return ds
+
+
+def memmap_splits(ds, split):
+    """
+    Memory-mapped data of a split of a Dataset.
+    :param ds: Dataset instance.
+    :param str split: Name of the split.
+    :return: List of MemmapTextSplit.
+    """
+    return [data for set_name in ['X_', 'Y_'] for data in (getattr(ds, set_name + split, None) or dict()).values()
+            if isinstance(data, MemmapTextSplit)]
+
+
+def shuffle_memmap_splits(ds, split='train'):
+    """
+    Shuffles the sentences of a split with memory-mapped data, without reading them (Dataset.shuffleTraining would
+    load every sentence in memory). The rest of data of the split (e.g. raw inputs) is shuffled in the same way.
+    It replaces Dataset.shuffleTraining in the Datasets with memory-mapped training data (see write_memmap_corpus).
+    :param ds: Dataset instance.
+    :param str split: Name of the split.
+    """
+    if not memmap_splits(ds, split):
+        return
+    permutation = np.random.permutation(getattr(ds, 'len_' + split))
+    for set_name in ['X_', 'Y_']:
+        split_data = getattr(ds, set_name + split, None) or dict()
+        for data_id, data in list(split_data.items()):
+            if isinstance(data, MemmapTextSplit):
+                data.order = permutation if data.order is None else data.order[permutation]
+            elif data is not None and len(data) == len(permutation):
+                split_data[data_id] = [data[i] for i in permutation]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import codecs
+import logging
+import multiprocessing
+import time
+
+from keras_wrapper.dataset import Dataset
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Tokenization methods whose outputs are already stripped: tokenizing the sentences beforehand and loading them with
+# 'tokenize_none' is equivalent to loading the raw sentences with the method
+PARALLEL_TOKENIZATIONS = ['tokenize_none', 'tokenize_bpe', 'tokenize_moses']
+
+# Tokenization function of each worker process
+_tokenize_f = None
+
+
+def _init_worker(tokenization, bpe_codes):
+    """
+    Builds the tokenizer of a worker. It is kept for all the chunks processed by the worker, so the word-level cache
+    of the BPE encoder is shared by them.
+    """
+    global _tokenize_f
+    ds = Dataset('tokenizer', '', silence=True)
+    if 'bpe' in tokenization.lower():
+        ds.build_bpe(bpe_codes)
+    _tokenize_f = getattr(ds, tokenization)
+
+
+def _tokenize_chunk(sentences):
+    return [_tokenize_f(sentence) for sentence in sentences]
+
+
+def _read_chunks(filename, chunk_size):
+    """
+    Reads a text file (as Dataset.preprocessText) in chunks of chunk_size sentences.
+    """
+    chunk = []
+    with codecs.open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            chunk.append(line.rstrip('\n'))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def tokenize_file(filename, tokenization, bpe_codes=None, n_workers=None, chunk_size=10000):
+    """
+    Tokenizes a text file with a pool of processes. The file is split into chunks of sentences, which are tokenized
+    by the workers; the results are gathered in the original order, so they are the same as the ones of
+    Dataset.preprocessText.
+
+    :param str filename: Text file, with a sentence per line.
+    :param str tokenization: Tokenization method of the Dataset (one of PARALLEL_TOKENIZATIONS).
+    :param str bpe_codes: BPE codes, for the BPE tokenization.
+    :param int n_workers: Number of processes. If None, the number of CPUs.
+    :param int chunk_size: Number of sentences sent to a worker at once.
+    :return: List of tokenized sentences.
+    """
+    if tokenization not in PARALLEL_TOKENIZATIONS:
+        raise AssertionError('The tokenization "%s" cannot be applied in parallel. Available: %s' %
+                             (tokenization, str(PARALLEL_TOKENIZATIONS)))
+    if 'bpe' in tokenization.lower() and bpe_codes is None:
+        raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
+    start_time = time.time()
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(tokenization, bpe_codes))
+    try:
+        sentences = []
+        for tokenized_chunk in pool.imap(_tokenize_chunk, _read_chunks(filename, chunk_size)):
+            sentences.extend(tokenized_chunk)
+    finally:
+        pool.close()
+        pool.join()
+    logger.info('Applied "%s" to %d sentences of %s in %.2f secs' %
+                (tokenization, len(sentences), filename, time.time() - start_time))
+    return sentences
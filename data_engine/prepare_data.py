@@ -1,10 +1,56 @@
+import hashlib
 import logging
 import os
+import shutil
 from keras_wrapper.dataset import Dataset, saveDataset, loadDataset
+from data_engine.memmap_corpus import write_memmap_corpus
+from data_engine.parallel_tokenization import PARALLEL_TOKENIZATIONS, tokenize_file
+from utils.utils import update_hash_from_file
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger(__name__)
 
+# Parameters which change the Dataset built by build_dataset (besides the contents of the input files)
+DATASET_PARAMS = ['DATASET_NAME', 'SRC_LAN', 'TRG_LAN', 'TEXT_FILES', 'INPUTS_IDS_DATASET', 'OUTPUTS_IDS_DATASET',
+                  'INPUTS_TYPES_DATASET', 'OUTPUTS_TYPES_DATASET', 'LOSS', 'TOKENIZATION_METHOD', 'BPE_CODES_PATH',
+                  'INPUT_VOCABULARY_SIZE', 'OUTPUT_VOCABULARY_SIZE', 'MIN_OCCURRENCES_INPUT_VOCAB',
+                  'MIN_OCCURRENCES_OUTPUT_VOCAB', 'MAX_INPUT_TEXT_LEN', 'MAX_OUTPUT_TEXT_LEN', 'FILL', 'PAD_ON_BATCH',
+                  'SAMPLE_WEIGHTS', 'LABEL_SMOOTHING', 'TIE_EMBEDDINGS', 'ALIGN_FROM_RAW', 'HOMOGENEOUS_BATCHES',
+                  'POS_UNK', 'HEURISTIC', 'MAPPING', 'EVAL_ON_SETS', 'MEMMAP_SPLITS']
+
+
+def _text_data(ds, text_filename, params, tokenized_files, reused=False):
+    """
+    Text data for Dataset.setInput/setOutput. With params['PREPROCESSING_WORKERS'] > 1, text files are tokenized by
+    a pool of processes (see tokenize_file) and the tokenized sentences are loaded with 'tokenize_none'. Otherwise,
+    the file is tokenized by the Dataset.
+    :param ds: Dataset instance.
+    :param text_filename: Path to a text file or list of sentences.
+    :param params: Parameters for building the dataset.
+    :param dict tokenized_files: Sentences of the files kept for a later use (file name -> sentences). Updated.
+    :param bool reused: Whether the file is used again afterwards. If not, its sentences are removed from
+                        tokenized_files and returned without copying them.
+    :return: Tuple (file name or list of sentences, tokenization method).
+    """
+    tokenization = params.get('TOKENIZATION_METHOD', 'tokenize_none')
+    if params.get('PREPROCESSING_WORKERS', 1) <= 1 or not isinstance(text_filename, str) or \
+            tokenization not in PARALLEL_TOKENIZATIONS:
+        return text_filename, tokenization
+    if text_filename in tokenized_files:
+        sentences = tokenized_files.pop(text_filename)
+    else:
+        sentences = tokenize_file(text_filename, tokenization,
+                                  bpe_codes=params.get('BPE_CODES_PATH', None),
+                                  n_workers=params['PREPROCESSING_WORKERS'])
+    if reused:
+        tokenized_files[text_filename] = sentences
+        # The Dataset stores (and may modify) the list
+        sentences = list(sentences)
+    if 'bpe' in tokenization.lower() and not getattr(ds, 'BPE_built', False):
+        # The Dataset still tokenizes new data (e.g. at sampling time)
+        ds.build_bpe(params['BPE_CODES_PATH'])
+    return sentences, 'tokenize_none'
+
 
 def update_dataset_from_file(ds,
                              input_text_filename,
@@ -19,7 +65,7 @@ def update_dataset_from_file(ds,
     Used for sampling
 
     :param ds: Dataset instance
-    :param input_text_filename: Source language sentences
+    :param input_text_filename: Source language sentences (path to a text file or list of sentences)
     :param params: Parameters for building the dataset
     :param splits: Splits to sample
     :param output_text_filename: Target language sentences
@@ -31,11 +77,14 @@ def update_dataset_from_file(ds,
     """
     if splits is None:
         splits = ['val']
+    tokenized_files = dict()
 
     if output_text_filename is None:
         recompute_references = False
 
     for split in splits:
+        # The text files are loaded again for each split
+        last_split = split == splits[-1]
         if split == 'train':
             output_type = params.get('OUTPUTS_TYPES_DATASET', ['dense-text'] if 'sparse' in params['LOSS'] else ['text'])[0]
         else:
@@ -48,11 +97,13 @@ def update_dataset_from_file(ds,
             recompute_references = False
 
         elif output_text_filename is not None:
-            ds.setOutput(output_text_filename,
+            text_data, tokenization = _text_data(ds, output_text_filename, params, tokenized_files,
+                                                 reused=compute_state_below or not last_split)
+            ds.setOutput(text_data,
                          split,
                          type=output_type,
                          id=params['OUTPUTS_IDS_DATASET'][0],
-                         tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                         tokenization=tokenization,
                          build_vocabulary=False,
                          pad_on_batch=params.get('PAD_ON_BATCH', True),
                          fill=params.get('FILL', 'end'),
@@ -65,11 +116,13 @@ def update_dataset_from_file(ds,
                          overwrite_split=True)
 
         # INPUT DATA
-        ds.setInput(input_text_filename,
+        text_data, tokenization = _text_data(ds, input_text_filename, params, tokenized_files,
+                                             reused=not last_split)
+        ds.setInput(text_data,
                     split,
                     type=params.get('INPUTS_TYPES_DATASET', ['text', 'text'])[0],
                     id=params['INPUTS_IDS_DATASET'][0],
-                    tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                    tokenization=tokenization,
                     build_vocabulary=False,
                     pad_on_batch=params.get('PAD_ON_BATCH', True),
                     fill=params.get('FILL', 'end'),
@@ -81,12 +134,14 @@ def update_dataset_from_file(ds,
 
         if compute_state_below and output_text_filename is not None:
             # INPUT DATA
-            ds.setInput(output_text_filename,
+            text_data, tokenization = _text_data(ds, output_text_filename, params, tokenized_files,
+                                                 reused=not last_split)
+            ds.setInput(text_data,
                         split,
                         type=params.get('INPUTS_TYPES_DATASET', ['text', 'text'])[1],
                         id=params['INPUTS_IDS_DATASET'][1],
                         pad_on_batch=params.get('PAD_ON_BATCH', True),
-                        tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                        tokenization=tokenization,
                         build_vocabulary=False,
                         offset=1,
                         fill=params.get('FILL', 'end'),
@@ -117,12 +172,53 @@ def update_dataset_from_file(ds,
     return ds
 
 
+def dataset_fingerprint(params):
+    """
+    Computes a fingerprint of everything that determines the Dataset built by build_dataset: the contents of the
+    text files (and of the BPE codes and mapping files, if used) and the vocabulary and tokenization parameters.
+    :param params: Parameters specifying Dataset options
+    :return: Hexadecimal digest.
+    """
+    fingerprint = hashlib.sha1()
+    fingerprint.update(repr([(k, params.get(k)) for k in DATASET_PARAMS]).encode('utf-8'))
+    input_files = []
+    for split in sorted(params['TEXT_FILES']):
+        for lang in [params['SRC_LAN'], params['TRG_LAN']]:
+            input_files.append(os.path.join(params['DATA_ROOT_PATH'], params['TEXT_FILES'][split] + lang))
+    if 'bpe' in params.get('TOKENIZATION_METHOD', 'tokenize_none').lower() and params.get('BPE_CODES_PATH'):
+        input_files.append(params['BPE_CODES_PATH'])
+    if params.get('POS_UNK', False) and params.get('HEURISTIC', 0) > 0:
+        input_files.append(params['MAPPING'])
+    for input_file in input_files:
+        fingerprint.update(input_file.encode('utf-8'))
+        if os.path.isfile(input_file):
+            update_hash_from_file(fingerprint, input_file)
+    return fingerprint.hexdigest()
+
+
 def build_dataset(params):
     """
     Builds (or loads) a Dataset instance.
+    If params['DATASET_CACHE_PATH'] is set, built datasets are also stored there, indexed by their fingerprint (see
+    dataset_fingerprint). When rebuilding, a cached dataset with the same fingerprint is loaded instead.
     :param params: Parameters specifying Dataset options
     :return: Dataset object
     """
+    name = params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
+    dataset_file = 'Dataset_' + name + '.pkl'
+    cached_dataset_path = None
+    if params['REBUILD_DATASET'] and params.get('DATASET_CACHE_PATH') is not None:
+        cached_dataset_path = os.path.join(params['DATASET_CACHE_PATH'], dataset_fingerprint(params))
+        if os.path.isfile(os.path.join(cached_dataset_path, dataset_file)):
+            logger.info('Dataset found in the cache (%s)' % cached_dataset_path)
+            if not os.path.isdir(params['DATASET_STORE_PATH']):
+                os.makedirs(params['DATASET_STORE_PATH'])
+            # The stored instance must be the one in use (e.g. for a later REBUILD_DATASET = False)
+            # The dataset is copied, as it may be modified and stored again (e.g. when reloading a model)
+            shutil.copyfile(os.path.join(cached_dataset_path, dataset_file),
+                            os.path.join(params['DATASET_STORE_PATH'], dataset_file))
+            params = dict(params, REBUILD_DATASET=False)
+            cached_dataset_path = None
 
     if params['REBUILD_DATASET']:  # We build a new dataset instance
         if params['VERBOSE'] > 0:
@@ -132,17 +228,21 @@ def build_dataset(params):
             silence = True
 
         base_path = params['DATA_ROOT_PATH']
-        name = params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
         ds = Dataset(name, base_path, silence=silence)
+        tokenized_files = dict()
 
         # OUTPUT DATA
         # Load the train, val and test splits of the target language sentences (outputs). The files include a sentence per line.
-        ds.setOutput(os.path.join(base_path, params['TEXT_FILES']['train'] + params['TRG_LAN']),
+        text_data, tokenization = _text_data(ds,
+                                             os.path.join(base_path, params['TEXT_FILES']['train'] + params['TRG_LAN']),
+                                             params, tokenized_files,
+                                             reused=len(params['INPUTS_IDS_DATASET']) > 1)
+        ds.setOutput(text_data,
                      'train',
                      type=params.get('OUTPUTS_TYPES_DATASET',
                                      ['dense-text'] if 'sparse' in params['LOSS'] else ['text'])[0],
                      id=params['OUTPUTS_IDS_DATASET'][0],
-                     tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                     tokenization=tokenization,
                      build_vocabulary=True,
                      pad_on_batch=params.get('PAD_ON_BATCH', True),
                      sample_weights=params.get('SAMPLE_WEIGHTS', True),
@@ -155,12 +255,15 @@ def build_dataset(params):
 
         for split in ['val', 'test']:
             if params['TEXT_FILES'].get(split) is not None:
-                ds.setOutput(os.path.join(base_path, params['TEXT_FILES'][split] + params['TRG_LAN']),
+                text_data, tokenization = _text_data(ds,
+                                                     os.path.join(base_path, params['TEXT_FILES'][split] + params['TRG_LAN']),
+                                                     params, tokenized_files)
+                ds.setOutput(text_data,
                              split,
                              type='text',  # The type of the references should be always 'text'
                              id=params['OUTPUTS_IDS_DATASET'][0],
                              pad_on_batch=params.get('PAD_ON_BATCH', True),
-                             tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                             tokenization=tokenization,
                              sample_weights=params.get('SAMPLE_WEIGHTS', True),
                              max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
                              max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
@@ -171,12 +274,15 @@ def build_dataset(params):
         # We must ensure that the 'train' split is the first (for building the vocabulary)
         for split in params['TEXT_FILES']:
             build_vocabulary = split == 'train'
-            ds.setInput(os.path.join(base_path, params['TEXT_FILES'][split] + params['SRC_LAN']),
+            text_data, tokenization = _text_data(ds,
+                                                 os.path.join(base_path, params['TEXT_FILES'][split] + params['SRC_LAN']),
+                                                 params, tokenized_files)
+            ds.setInput(text_data,
                         split,
                         type=params.get('INPUTS_TYPES_DATASET', ['text', 'text'])[0],
                         id=params['INPUTS_IDS_DATASET'][0],
                         pad_on_batch=params.get('PAD_ON_BATCH', True),
-                        tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                        tokenization=tokenization,
                         build_vocabulary=build_vocabulary,
                         fill=params.get('FILL', 'end'),
                         max_text_len=params.get('MAX_INPUT_TEXT_LEN', 70),
@@ -186,12 +292,15 @@ def build_dataset(params):
 
             if len(params['INPUTS_IDS_DATASET']) > 1:
                 if 'train' in split:
-                    ds.setInput(os.path.join(base_path, params['TEXT_FILES'][split] + params['TRG_LAN']),
+                    text_data, tokenization = _text_data(ds,
+                                                         os.path.join(base_path, params['TEXT_FILES'][split] + params['TRG_LAN']),
+                                                         params, tokenized_files)
+                    ds.setInput(text_data,
                                 split,
                                 type=params.get('INPUTS_TYPES_DATASET', ['text', 'text'])[1],
                                 id=params['INPUTS_IDS_DATASET'][1],
                                 required=False,
-                                tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                                tokenization=tokenization,
                                 pad_on_batch=params.get('PAD_ON_BATCH', True),
                                 build_vocabulary=params['OUTPUTS_IDS_DATASET'][0],
                                 offset=1,
@@ -221,14 +330,25 @@ def build_dataset(params):
                            n=1,
                            set_names=params['EVAL_ON_SETS'])
 
+        if params.get('MEMMAP_SPLITS'):
+            # Keep these splits on disk, as memory-mapped word indices
+            write_memmap_corpus(ds,
+                                os.path.join(cached_dataset_path or params['DATASET_STORE_PATH'],
+                                             'Dataset_' + name + '_memmap'),
+                                splits=params['MEMMAP_SPLITS'])
+
         # We have finished loading the dataset, now we can store it for using it in the future
         saveDataset(ds, params['DATASET_STORE_PATH'])
+        if cached_dataset_path is not None:
+            if not os.path.isdir(cached_dataset_path):
+                os.makedirs(cached_dataset_path)
+            shutil.copyfile(os.path.join(params['DATASET_STORE_PATH'], dataset_file),
+                            os.path.join(cached_dataset_path, dataset_file))
+            logger.info('Dataset stored in the cache (%s)' % cached_dataset_path)
 
     else:
         # We can easily recover it with a single line
-        ds = loadDataset(
-            os.path.join(params['DATASET_STORE_PATH'],
-                         'Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl'))
+        ds = loadDataset(os.path.join(params['DATASET_STORE_PATH'], dataset_file))
 
         # Prepare references
         prepare_references(ds,
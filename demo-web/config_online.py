@@ -6,7 +6,8 @@ def load_parameters():
     """
     # Optimizer parameters (see model.compile() function)
     CLASSIFIER_ACTIVATION = 'softmax'
-    LOSS = 'categorical_crossentropy'
+    LOSS = 'categorical_crossentropy'             # Sparse losses (e.g. 'sparse_categorical_crossentropy') are trained
+                                                  # with the indices of the target words instead of one-hot vectors
     OPTIMIZER = 'adadelta'                        # Optimizer
     LR = 0.1                                      # Learning rate.
     # PAS-like params
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    LRU cache of the translations of the requests, bounded by the (approximate) size of its entries. Post-editors
+    often send the same request twice (e.g. when they reopen a segment). The key is the source sentence (with
+    normalized whitespace), the validated prefix, the search parameters of the request and the size of its n-best
+    list. Must be cleared each time the weights of the models change. The methods are thread-safe.
+    """
+
+    # Search parameters which change the translation of a request (see REQUEST_SEARCH_PARAMS in sample_server)
+    KEY_PARAMS = ('beam_size', 'length_norm_factor', 'coverage_norm_factor', 'alpha_factor')
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, log_every=1000):
+        """
+        :param int max_bytes: Maximum size (in bytes) of the cached entries. 0 disables the cache.
+        :param int log_every: Log the hit and miss counts each log_every lookups.
+        """
+        self.max_bytes = max_bytes
+        self.log_every = log_every
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Incremented on each clear: translations started before it are not stored
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def key(self, request, default_params):
+        """
+        Key of a translation request.
+        :param TranslationRequest request: Request.
+        :param dict default_params: Search parameters used if the request has none.
+        :return: Hashable key.
+        """
+        params_prediction = request.params_prediction or default_params
+        return (u' '.join(request.source_sentence.split()), request.validated_prefix,
+                tuple(params_prediction.get(param) for param in self.KEY_PARAMS), request.n_best)
+
+    def get(self, key):
+        """
+        Looks up a translation.
+        :param key: Key of the request.
+        :return: The cached translation, or None.
+        """
+        if self.max_bytes <= 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            else:
+                self.misses += 1
+            if self.log_every > 0 and (self.hits + self.misses) % self.log_every == 0:
+                logger.info('Result cache: %d hits, %d misses (%d entries, %d bytes)' %
+                            (self.hits, self.misses, len(self.entries), self.n_bytes))
+        return entry[0] if entry is not None else None
+
+    def put(self, key, translation, generation):
+        """
+        Stores a translation, evicting the least recently used ones if the cache is full.
+        :param key: Key of the request.
+        :param dict translation: Translation, as returned by NMTSampler.generate_samples. It must not be modified.
+        :param int generation: Value of self.generation when the translation was requested.
+        """
+        size = _estimate_size(key) + _estimate_size(translation)
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (translation, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                self.n_bytes -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """
+        Removes all the translations (and discards the ones in progress).
+        """
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+            self.generation += 1
+
+    def hit_ratio(self):
+        return self.hits / float(max(1, self.hits + self.misses))
+
+
+def _estimate_size(obj):
+    """
+    Approximate memory usage of an object made of strings, numbers, lists, tuples and dictionaries.
+    :param obj: Object.
+    :return: Size in bytes.
+    """
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_estimate_size(k) + _estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_estimate_size(item) for item in obj)
+    return sys.getsizeof(obj)
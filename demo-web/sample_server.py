@@ -10,37 +10,402 @@ import time
 import sys
 import os
 import copy
+import json
+import queue
+import threading
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 import urllib
 from collections import OrderedDict
+import numpy as np
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+from keras import backend as K
 from keras_wrapper.model_ensemble import InteractiveBeamSearchSampler
-from keras_wrapper.cnn_model import loadModel, updateModel
+from keras_wrapper.cnn_model import loadModel, saveModel, updateModel
 from keras_wrapper.dataset import loadDataset
 from keras_wrapper.extra.isles_utils import *
 from keras_wrapper.extra.read_write import pkl2dict
 from keras_wrapper.online_trainer import OnlineTrainer
 from keras_wrapper.utils import decode_predictions_beam_search
 from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.search import BatchedBeamSearchEnsemble, apply_penalties
 # from online_models import build_online_models
 from utils.utils import update_parameters
 from config_online import load_parameters as load_parameters_online
+from result_cache import ResultCache
+from server_metrics import ServerMetrics
+from vocabulary_prefix_index import VocabularyPrefixIndex
 from config import load_parameters
 logger = logging.getLogger(__name__)
 
 
+metrics = ServerMetrics()
+
+
+def log_time(stage, start_time, end_time):
+    """
+    Logs the duration of a processing stage (logging level 2) and records it in the metrics of the server.
+    :param str stage: Name of the stage.
+    :param float start_time: Start time of the stage.
+    :param float end_time: End time of the stage.
+    """
+    logger.log(2, '%s time: %.6f' % (stage, end_time - start_time))
+    metrics.observe(stage, end_time - start_time)
+
+
+# Search parameters that can be set in the requests: request option -> (params_prediction key, type)
+REQUEST_SEARCH_PARAMS = OrderedDict([('beam_size', ('beam_size', int)),
+                                     ('length_norm', ('length_norm_factor', float)),
+                                     ('coverage_norm', ('coverage_norm_factor', float)),
+                                     ('alpha_norm', ('alpha_factor', float))])
+
+
+class RequestDropped(Exception):
+    """
+    Raised for the translation requests which are not decoded: the server is saturated, their deadline passed or a
+    newer request of the same session superseded them.
+    """
+
+    def __init__(self, message, status=503):
+        """
+        :param str message: Reason.
+        :param int status: HTTP status code of the response.
+        """
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTPServer which handles each request in its own thread. The models are only used by the thread of the
+    BatchScheduler.
+    """
+    daemon_threads = True
+
+
+class SchedulerJob:
+    """
+    Job executed by the thread of the BatchScheduler. The thread which submitted it waits for its result.
+    """
+
+    def __init__(self, function=None, *args):
+        """
+        :param function: Function to execute.
+        :param args: Arguments of the function.
+        """
+        self.function = function
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.submit_time = time.time()
+        # Queue where the job is put when finished (e.g. shared by the requests of a batch, to answer them in
+        # completion order)
+        self.completion_queue = None
+
+    def execute(self):
+        try:
+            self.finish(result=self.function(*self.args))
+        except Exception as e:
+            self.finish(error=e)
+
+    def finish(self, result=None, error=None):
+        """
+        Sets the result of the job. Only the first call has effect (e.g. a cancelled request is not finished again).
+        :param result: Result of the job.
+        :param error: Exception raised by the job.
+        :return: False if the job was already finished.
+        """
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.result = result
+            self.error = error
+            self.done.set()
+        if self.completion_queue is not None:
+            self.completion_queue.put(self)
+        return True
+
+    def wait(self):
+        """
+        Waits until the job is executed.
+        :return: The result of the job. If the job failed, its exception is raised.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class TranslationRequest(SchedulerJob):
+    """
+    Translation request. Requests which wait at the same time are translated together.
+    """
+
+    def __init__(self, source_sentence, validated_prefix=None, params_prediction=None, n_best=0, deadline=None,
+                 session=None):
+        """
+        :param source_sentence: Source sentence.
+        :param validated_prefix: Prefix to keep in the output.
+        :param dict params_prediction: Search parameters of the request (None for using the default ones).
+        :param int n_best: Size of the n-best list (0 for no n-best list).
+        :param float deadline: Time (as returned by time.time) after which the translation is no longer needed.
+        :param session: Identifier of the user session. A new request of the session cancels this one.
+        """
+        SchedulerJob.__init__(self)
+        self.source_sentence = source_sentence
+        self.validated_prefix = validated_prefix
+        self.params_prediction = params_prediction
+        self.n_best = n_best
+        self.deadline = deadline
+        self.session = session
+        # Where the translation is stored when finished (set by the BatchScheduler)
+        self.result_cache = None
+        self.cache_key = None
+        self.cache_generation = None
+
+
+class BatchScheduler:
+    """
+    Serves the requests of the HTTP threads with a single thread, which owns the models. Translation requests which
+    arrive within max_wait seconds from the first one are decoded together (see NMTSampler.generate_samples), up to
+    max_batch_size requests. The rest of jobs (e.g. online learning) are executed alone, in arrival order.
+
+    Admission control: at most max_queue_size translation requests wait in the queue (further ones are rejected),
+    requests whose deadline passed are dropped before decoding them and each new request of a session cancels the
+    pending one of the same session (e.g. the previous keystroke).
+    """
+
+    def __init__(self, sampler, max_batch_size=8, max_wait=0.005, max_queue_size=256):
+        """
+        :param NMTSampler sampler: Sampler used for translating.
+        :param int max_batch_size: Maximum number of requests decoded together.
+        :param float max_wait: Maximum time (in seconds) that a request waits for other requests to be batched with.
+        :param int max_queue_size: Maximum number of translation requests waiting (0 for no limit).
+        """
+        self.sampler = sampler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        # Internal jobs (see run) are never rejected, nor count for the admission control
+        self.queue = queue.Queue()
+        self.max_queue_size = max_queue_size
+        self.queued_requests = 0
+        self.queued_requests_lock = threading.Lock()
+        # session -> last request of the session
+        self.sessions = dict()
+        self.sessions_lock = threading.Lock()
+        # With TensorFlow, the default graph is local to each thread: the models must be run in their own graph
+        if K.backend() == 'tensorflow':
+            import tensorflow as tf
+            self.graph = tf.get_default_graph()
+        else:
+            self.graph = None
+        self.thread = threading.Thread(target=self.serve, name='BatchScheduler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def translate(self, source_sentence, validated_prefix=None, params_prediction=None, n_best=0, deadline=None,
+                  session=None):
+        """
+        Translates a sentence. Blocks until the translation is finished.
+        :param source_sentence: Source sentence.
+        :param validated_prefix: Prefix to keep in the output.
+        :param dict params_prediction: Search parameters of the request (None for using the default ones).
+        :param int n_best: Size of the n-best list (0 for no n-best list).
+        :param float deadline: Time after which the translation is no longer needed (None for no deadline).
+        :param session: Identifier of the user session (None for not cancelling the request).
+        :return: Translation, as returned by NMTSampler.generate_samples. Raises RequestDropped if the request is not
+                 translated.
+        """
+        return self.submit(TranslationRequest(source_sentence, validated_prefix, params_prediction, n_best,
+                                              deadline=deadline, session=session)).wait()
+
+    def submit(self, request):
+        """
+        Queues a translation request, without waiting for it. If the translation is in the result cache of the
+        sampler, the request is finished right away. If the queue is full, the request fails with RequestDropped.
+        :param TranslationRequest request: Request to translate.
+        :return: The request.
+        """
+        if request.session is not None:
+            with self.sessions_lock:
+                superseded_request = self.sessions.get(request.session)
+                self.sessions[request.session] = request
+            if superseded_request is not None:
+                self.drop(superseded_request, 'superseded',
+                          RequestDropped('Superseded by a newer request of the session', status=409))
+        result_cache = self.sampler.result_cache
+        cache_key = result_cache.key(request, self.sampler.params_prediction)
+        translation = result_cache.get(cache_key)
+        if translation is not None:
+            self.release_session(request)
+            request.finish(result=translation)
+            return request
+        request.result_cache = result_cache
+        request.cache_key = cache_key
+        request.cache_generation = result_cache.generation
+        with self.queued_requests_lock:
+            saturated = 0 < self.max_queue_size <= self.queued_requests
+            if not saturated:
+                self.queued_requests += 1
+        if saturated:
+            self.release_session(request)
+            self.drop(request, 'saturated', RequestDropped('The server is saturated'))
+        else:
+            self.queue.put(request)
+        return request
+
+    def release_session(self, request):
+        """
+        Forgets the session of a request which is no longer pending (unless a newer request of the session replaced
+        it).
+        :param TranslationRequest request: Request.
+        """
+        if request.session is not None:
+            with self.sessions_lock:
+                if self.sessions.get(request.session) is request:
+                    del self.sessions[request.session]
+
+    def has_room(self, n_requests):
+        """
+        Whether the queue can take n_requests more requests.
+        :param int n_requests: Number of requests.
+        :return: bool.
+        """
+        with self.queued_requests_lock:
+            return self.max_queue_size <= 0 or self.queued_requests + n_requests <= self.max_queue_size
+
+    def drop(self, request, reason, error):
+        """
+        Finishes a request without translating it.
+        :param TranslationRequest request: Request.
+        :param str reason: Reason, for the metrics.
+        :param RequestDropped error: Error raised to the thread which waits for the request.
+        """
+        if request.finish(error=error):
+            metrics.increment('dropped_requests_total', 'Number of translation requests not decoded, by reason.',
+                              labels={'reason': reason})
+
+    def run(self, function, *args):
+        """
+        Executes a function in the thread of the scheduler. Blocks until it is finished. The job is queued even if
+        the server is saturated.
+        :param function: Function to execute.
+        :param args: Arguments of the function.
+        :return: Result of the function.
+        """
+        job = SchedulerJob(function, *args)
+        self.queue.put(job)
+        return job.wait()
+
+    def serve(self):
+        if self.graph is not None:
+            with self.graph.as_default():
+                self.serve_jobs()
+        else:
+            self.serve_jobs()
+
+    def serve_jobs(self):
+        """
+        Main loop: waits for jobs and executes them. Translation requests are batched.
+        """
+        pending_job = None
+        while True:
+            job = pending_job if pending_job is not None else self.queue.get()
+            pending_job = None
+            if not isinstance(job, TranslationRequest):
+                job.execute()
+                continue
+            batch = [job]
+            batch_deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    job = self.queue.get(timeout=max(0., batch_deadline - time.time()))
+                except queue.Empty:
+                    break
+                if not isinstance(job, TranslationRequest):
+                    pending_job = job
+                    break
+                batch.append(job)
+            self.translate_batch(batch)
+
+    def translate_batch(self, batch):
+        """
+        Translates a batch of requests. Requests are grouped by beam size, which must be shared by the sentences
+        decoded together. A request which cannot be translated fails alone; only an error of the search itself fails
+        its whole group.
+        :param list batch: TranslationRequest instances.
+        """
+        batch_start_time = time.time()
+        with self.queued_requests_lock:
+            self.queued_requests -= len(batch)
+        for request in batch:
+            log_time('queue_wait', request.submit_time, batch_start_time)
+            self.release_session(request)
+            if request.deadline is not None and request.deadline < batch_start_time:
+                self.drop(request, 'deadline', RequestDropped('The deadline of the request passed'))
+        # Cancelled and expired requests are not decoded
+        batch = [request for request in batch if not request.done.is_set()]
+        logger.log(2, 'Translating a batch of %d requests' % len(batch))
+        groups = OrderedDict()
+        for request in batch:
+            params_prediction = request.params_prediction or self.sampler.params_prediction
+            groups.setdefault(params_prediction['beam_size'], []).append(request)
+        for requests in groups.values():
+            try:
+                translations = self.sampler.generate_samples([request.source_sentence for request in requests],
+                                                             [request.validated_prefix for request in requests],
+                                                             [request.params_prediction for request in requests],
+                                                             n_best=[request.n_best for request in requests])
+            except Exception as e:
+                logger.error('Error translating a batch of %d requests: %s' % (len(requests), str(e)))
+                for request in requests:
+                    request.finish(error=e)
+            else:
+                for request, translation in zip(requests, translations):
+                    if isinstance(translation, Exception):
+                        request.finish(error=translation)
+                        continue
+                    if request.result_cache is not None:
+                        request.result_cache.put(request.cache_key, translation, request.cache_generation)
+                    request.finish(result=translation)
+
+
 class NMTHandler(BaseHTTPRequestHandler):
+    def send_response(self, code, message=None):
+        metrics.increment('requests_total', 'Number of HTTP requests, by method and status code.',
+                          labels={'method': self.command, 'status': code})
+        BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def send_metrics(self):
+        """
+        Sends the metrics of the server, in the Prometheus text format.
+        """
+        response = metrics.render()
+        self.send_response(200)  # 200: ('OK', 'Request fulfilled, document follows')
+        self.send_header("Content-type", "text/plain; version=0.0.4")
+        self.end_headers()
+        self.wfile.write(response.encode('utf-8'))
+
     def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            self.send_metrics()
+            return
         do_GET_start_time = time.time()
         args = self.path.split('?')[1]
         args = args.split('&')
         source_sentence = None
         validated_prefix = None
         learn = False
+        session = None
+        deadline_ms = self.server.default_deadline_ms
         beam_size = 6
         length_norm = 0.
         coverage_norm = 0.
         alpha_norm = 1.
+        # Search parameters of this request
+        params_prediction = dict(self.server.sampler.params_prediction)
         args_processing_start_time = time.time()
         print (args)
         for aa in args:
@@ -57,55 +422,197 @@ class NMTHandler(BaseHTTPRequestHandler):
                 learn = urllib.parse.unquote_plus(learn)
                 learn = eval(learn)
 
+            if cc[0] == 'session':
+                session = urllib.parse.unquote_plus(cc[1])
+
+            if cc[0] == 'deadline_ms':
+                deadline_ms = float(urllib.parse.unquote_plus(cc[1]))
+
             if cc[0] == 'beam_size':
                 beam_size = cc[1]
                 beam_size = urllib.parse.unquote_plus(beam_size)
                 beam_size = int(beam_size)
-                self.server.sampler.params_prediction['beam_size'] = beam_size
+                params_prediction['beam_size'] = beam_size
 
             if cc[0] == 'length_norm':
                 length_norm = cc[1]
                 length_norm = urllib.parse.unquote_plus(length_norm)
                 length_norm = float(length_norm)
-                self.server.sampler.params_prediction['length_norm_factor'] = length_norm
+                params_prediction['length_norm_factor'] = length_norm
 
             if cc[0] == 'coverage_norm':
                 coverage_norm = cc[1]
                 coverage_norm = urllib.parse.unquote_plus(coverage_norm)
                 coverage_norm = float(coverage_norm)
-                self.server.sampler.params_prediction['coverage_norm_factor'] = coverage_norm
+                params_prediction['coverage_norm_factor'] = coverage_norm
 
             if cc[0] == 'alpha_norm':
                 alpha_norm = cc[1]
                 alpha_norm = urllib.parse.unquote_plus(alpha_norm)
                 alpha_norm = float(alpha_norm)
-                self.server.sampler.params_prediction['alpha_factor'] = alpha_norm
+                params_prediction['alpha_factor'] = alpha_norm
 
         if source_sentence is None:
             self.send_response(400)  # 400: ('Bad Request', 'Bad request syntax or unsupported method')
             return
         source_sentence = urllib.parse.unquote_plus(source_sentence)
         args_processing_end_time = time.time()
-        logger.log(2, 'args_processing time: %.6f' % (args_processing_end_time - args_processing_start_time))
+        log_time('args_processing', args_processing_start_time, args_processing_end_time)
 
         generate_sample_start_time = time.time()
         if learn and validated_prefix is not None and source_sentence is not None:
-            self.server.sampler.learn_from_sample(source_sentence, validated_prefix)
+            if self.server.learner is not None:
+                self.server.learner.push(source_sentence, validated_prefix)
+            else:
+                logger.warning('Online learning is disabled.')
             self.send_response(200)  # 200: ('OK', 'Request fulfilled, document follows')
         else:
-            hypothesis = self.server.sampler.generate_sample(source_sentence, validated_prefix=validated_prefix)
+            try:
+                hypothesis = self.server.scheduler.translate(source_sentence, validated_prefix=validated_prefix,
+                                                             params_prediction=params_prediction,
+                                                             deadline=do_GET_start_time + deadline_ms / 1000.
+                                                             if deadline_ms > 0 else None,
+                                                             session=session)['hypothesis']
+            except RequestDropped as e:
+                self.send_dropped(e)
+                return
+            except Exception as e:
+                logger.error('Error translating "%s": %s' % (source_sentence, str(e)))
+                self.send_error(500, 'Error translating the sentence: %s' % str(e))  # 500: ('Internal Server Error', 'Server got itself in trouble')
+                return
             response = hypothesis + u'\n'
             generate_sample_end_time = time.time()
-            logger.log(2, 'args_processing time: %.6f' % (generate_sample_end_time - generate_sample_start_time))
+            log_time('translation', generate_sample_start_time, generate_sample_end_time)
             send_response_start_time = time.time()
             self.send_response(200)  # 200: ('OK', 'Request fulfilled, document follows')
             self.send_header("Content-type", "text/html")
             self.end_headers()
             self.wfile.write(response.encode('utf-8'))
             send_response_end_time = time.time()
-            logger.log(2, 'send_response time: %.6f' % (send_response_end_time - send_response_start_time))
+            log_time('send_response', send_response_start_time, send_response_end_time)
             do_GET_end_time = time.time()
-            logger.log(2, 'do_GET time: %.6f' % (do_GET_end_time - do_GET_start_time))
+            log_time('do_GET', do_GET_start_time, do_GET_end_time)
+
+    def do_POST(self):
+        """
+        Batch translation (path /translate). The body is a JSON array of segments, or a JSON object with the
+        segments ("segments") and default options for all of them. Each segment is either a source sentence or an
+        object with the "source" sentence and, optionally, its validated "prefix", its search parameters (see
+        REQUEST_SEARCH_PARAMS) and the size of its n-best list ("n_best").
+        The segments are decoded in batches by the scheduler. The response is a JSON object with the "translations"
+        ("index", "hypothesis", "score" and "n_best" of each segment). With "stream": true, each translation is sent
+        as a JSON line as soon as it is finished, so the lines are in completion order.
+        """
+        if self.path.split('?')[0] == '/admin/reload':
+            self.reload_models()
+            return
+        if self.path.split('?')[0] != '/translate':
+            self.send_error(404)  # 404: ('Not Found', 'Nothing matches the given URI')
+            return
+        do_POST_start_time = time.time()
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            if isinstance(body, list):
+                body = {'segments': body}
+            deadline_ms = float(body.get('deadline_ms', self.server.default_deadline_ms))
+            deadline = do_POST_start_time + deadline_ms / 1000. if deadline_ms > 0 else None
+            requests = [self.parse_segment(segment, body, deadline=deadline) for segment in body['segments']]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_error(400, 'Bad request: %s' % str(e))  # 400: ('Bad Request', 'Bad request syntax or unsupported method')
+            return
+        if not self.server.scheduler.has_room(len(requests)):
+            self.send_dropped(RequestDropped('The server is saturated'))
+            return
+        completion_queue = queue.Queue()
+        indices = dict()
+        for index, request in enumerate(requests):
+            indices[request] = index
+            request.completion_queue = completion_queue
+            self.server.scheduler.submit(request)
+
+        stream = bool(body.get('stream', False))
+        self.send_response(200)  # 200: ('OK', 'Request fulfilled, document follows')
+        self.send_header("Content-type", "application/x-ndjson" if stream else "application/json")
+        self.end_headers()
+        translations = []
+        for _ in range(len(requests)):
+            request = completion_queue.get()
+            index = indices[request]
+            try:
+                translation = dict(request.wait(), index=index)
+                if translation['n_best'] is not None:
+                    translation['n_best'] = [{'hypothesis': hypothesis, 'score': score}
+                                             for hypothesis, score in translation['n_best']]
+            except Exception as e:
+                translation = {'index': index, 'error': str(e)}
+            if stream:
+                self.wfile.write((json.dumps(translation, ensure_ascii=False) + u'\n').encode('utf-8'))
+                self.wfile.flush()
+            else:
+                translations.append(translation)
+        if not stream:
+            translations.sort(key=lambda translation: translation['index'])
+            self.wfile.write(json.dumps({'translations': translations}, ensure_ascii=False).encode('utf-8'))
+        log_time('do_POST', do_POST_start_time, time.time())
+
+    def reload_models(self):
+        """
+        Administration endpoint (/admin/reload): replaces the models without stopping the server. The body may be a
+        JSON object with the paths to the new "models"; by default, the current paths are reloaded (e.g. after
+        overwriting the model files). Answers 202 as soon as the reload starts (see ModelReloader).
+        """
+        if self.server.admin_token is None or self.headers.get('X-Admin-Token') != self.server.admin_token:
+            self.send_error(403)  # 403: ('Forbidden', 'Request forbidden -- authorization will not help')
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length > 0 else {}
+            model_paths = body.get('models', self.server.model_paths)
+            if not isinstance(model_paths, list) or not model_paths:
+                raise ValueError('"models" must be a non-empty list of paths')
+        except (ValueError, AttributeError) as e:
+            self.send_error(400, 'Bad request: %s' % str(e))  # 400: ('Bad Request', 'Bad request syntax or unsupported method')
+            return
+        if not self.server.reloader.reload(model_paths):
+            self.send_error(409, 'Another reload is in progress')  # 409: ('Conflict', 'Request conflict')
+            return
+        self.send_response(202)  # 202: ('Accepted', 'Request accepted, processing continues off-line')
+        self.end_headers()
+
+    def send_dropped(self, error):
+        """
+        Answers a request which was not translated. With 503 (saturation), the client is told when to retry.
+        :param RequestDropped error: Reason.
+        """
+        self.send_response(error.status, str(error))
+        if error.status == 503:
+            self.send_header('Retry-After', str(self.server.retry_after))
+        self.end_headers()
+
+    def parse_segment(self, segment, options, deadline=None):
+        """
+        Builds the translation request of a segment of a batch.
+        :param segment: Source sentence or dictionary with the "source" sentence and its options.
+        :param dict options: Default options of the segments.
+        :param float deadline: Time after which the translation is no longer needed (None for no deadline).
+        :return: TranslationRequest.
+        """
+        if not isinstance(segment, dict):
+            segment = {'source': segment}
+        source_sentence = segment['source']
+        if not isinstance(source_sentence, str) or not source_sentence.strip():
+            raise ValueError('"source" must be a non-empty string')
+        params_prediction = dict(self.server.sampler.params_prediction)
+        for option, (param, param_type) in REQUEST_SEARCH_PARAMS.items():
+            value = segment.get(option, options.get(option))
+            if value is not None:
+                params_prediction[param] = param_type(value)
+        return TranslationRequest(source_sentence,
+                                  validated_prefix=segment.get('prefix') or None,
+                                  params_prediction=params_prediction,
+                                  n_best=int(segment.get('n_best', options.get('n_best', 0))),
+                                  deadline=deadline)
 
 
 def parse_args():
@@ -121,20 +628,156 @@ def parse_args():
     parser.add_argument("-o", "--online",
                         action='store_true', default=False, required=False,
                         help="Online training mode after postedition. ")
+    parser.add_argument("--online-batch-size", help="Number of post-edited samples of each online learning update",
+                        type=int, default=8)
+    parser.add_argument("--online-flush-interval", help="Maximum time (in seconds) that a post-edited sample waits "
+                                                        "for completing an online learning batch", type=float, default=5.)
+    parser.add_argument("--snapshot-interval", help="Store the online models each N updates (0: never)",
+                        type=int, default=100)
+    parser.add_argument("--no-shadow", action='store_true', default=False, required=False,
+                        help="Train the serving models instead of a shadow copy (less memory, but the translations "
+                             "wait for the online updates)")
+    parser.add_argument("--admin-token", help="Token required by the administration endpoints (e.g. /admin/reload), "
+                                              "in the X-Admin-Token header. If not set, these endpoints are disabled",
+                        type=str, default=None)
+    parser.add_argument("--reload-warmup-size", help="Number of recent source sentences translated by the new models "
+                                                     "before swapping them in", type=int, default=10)
+    parser.add_argument("--warmup-lengths", nargs="+", type=int, default=[1, 10, 25, 50],
+                        help="Lengths (in words) of the synthetic sentences translated before starting the server")
+    parser.add_argument("--warmup-beam-sizes", nargs="*", type=int, default=None,
+                        help="Beam sizes used in the warmup (by default, the one of the config)")
+    parser.add_argument("--no-warmup-prefix", action='store_true', default=False, required=False,
+                        help="Do not warm up the search with a validated prefix")
+    parser.add_argument("--max-queue-size", help="Maximum number of requests waiting to be translated. Further "
+                                                 "requests are answered with 503 (0 for no limit)",
+                        type=int, default=256)
+    parser.add_argument("--deadline", help="Default deadline (in ms) of the translation requests, which can be set in "
+                                           "each request with deadline_ms. Expired requests are not translated "
+                                           "(0 for no deadline)", type=float, default=0)
+    parser.add_argument("--retry-after", help="Seconds that the clients are asked to wait (Retry-After header) when "
+                                              "the server is saturated", type=int, default=1)
     parser.add_argument("-a", "--address", help="Server address", type=str, default='')
     parser.add_argument("-p", "--port", help="Port to use", type=int, default=6542)
     parser.add_argument("-l", "--logging-level", help="Logging level: \t 0: Only info messages."
                                                       "\t 1: Debug messages."
                                                       "\t 2: Time monitoring messages.", type=int, default=0)
     parser.add_argument("-eos", "--eos-symbol", help="End-of-sentence symbol", type=str, default='/')
+    parser.add_argument("-bs", "--max-batch-size", help="Maximum number of concurrent requests decoded together",
+                        type=int, default=8)
+    parser.add_argument("-w", "--max-wait", help="Maximum time (in ms) that a request waits for other requests to be "
+                                                 "decoded together", type=float, default=5.)
+    parser.add_argument("-cs", "--cache-size", help="Number of source sentences whose tokenization and encoder states "
+                                                    "are kept in memory (0 disables the cache)", type=int, default=100)
+    parser.add_argument("-rcs", "--result-cache-size", help="Size (in MB) of the cache of translations of the requests "
+                                                           "(0 disables the cache)", type=int, default=16)
 
     return parser.parse_args()
 
 
+class CachedInteractiveBeamSearchSampler(InteractiveBeamSearchSampler):
+    """
+    InteractiveBeamSearchSampler which caches the decoder states of the last translated source sentences.
+    In the interactive-predictive framework, the same source sentence is translated after each keystroke of the user:
+
+        * The encoder outputs and the initial decoder states (first decoding step, model_init) only depend on the
+          source sentence. Hence, they are computed once and reused by the following searches.
+        * The validated prefix is forced, one hypothesis at a time. The states reached after each of its words are
+          kept, so a search whose prefix extends the previous one only advances the new words.
+    """
+
+    def __init__(self, models, dataset, params_prediction, excluded_words=None, cache_size=100, verbose=0):
+        """
+        :param models: Models used for the search.
+        :param dataset: Dataset instance.
+        :param dict params_prediction: Hyperparameters regarding prediction and search.
+        :param excluded_words: Words that won't be generated in the middle of two isles.
+        :param int cache_size: Number of source sentences stored in the cache (LRU). 0 disables the cache.
+        :param int verbose: Verbosity level.
+        """
+        InteractiveBeamSearchSampler.__init__(self, models, dataset, params_prediction,
+                                              excluded_words=excluded_words, verbose=verbose)
+        self.cache_size = cache_size
+        # Source sentence -> {'prefix': validated prefix, 'steps': outputs after each word of the prefix}
+        self.states_cache = OrderedDict()
+        self.validated_prefix = []
+        self.hits = 0
+        self.misses = 0
+        self.reused_steps = 0
+
+    def clear_cache(self):
+        """
+        Empties the cache. Must be called each time the weights of the models change.
+        """
+        self.states_cache.clear()
+
+    def set_validated_prefix(self, validated_prefix):
+        """
+        Sets the word indices validated by the user for the next search. The decoder states reached after these words
+        are stored in the cache.
+        :param list validated_prefix: Indices of the validated words (from the first position, without gaps).
+        """
+        self.validated_prefix = list(validated_prefix)
+
+    def predict_cond_optimized(self, X, states_below, params, ii, prev_outs):
+        """
+        Call the prediction functions of all models (see InteractiveBeamSearchSampler.predict_cond_optimized).
+        The outputs of the first time-step and of the time-steps of the validated prefix are retrieved from the cache
+        if they were computed in a previous search.
+        :param X: Input data
+        :param states_below: Previously generated words
+        :param params: Model parameters
+        :param ii: Decoding time-step
+        :param prev_outs: Outputs from the previous time-step.
+        :return: Combined outputs from the ensemble
+        """
+        if self.cache_size <= 0 or ii > len(self.validated_prefix) or states_below.shape[0] > 1:
+            return InteractiveBeamSearchSampler.predict_cond_optimized(self, X, states_below, params, ii, prev_outs)
+        source = X[params['model_inputs'][0]]
+        key = (source.shape, source.tobytes())
+        entry = self.states_cache.get(key)
+        if ii == 0:
+            if entry is None:
+                self.misses += 1
+                entry = {'prefix': [], 'steps': []}
+                self.states_cache[key] = entry
+                if len(self.states_cache) > self.cache_size:
+                    self.states_cache.popitem(last=False)
+            else:
+                self.hits += 1
+                self.states_cache.move_to_end(key)
+                # Keep the states of the words shared by the new and the old prefixes
+                n_shared = 0
+                for old_word, new_word in zip(entry['prefix'], self.validated_prefix):
+                    if old_word != new_word:
+                        break
+                    n_shared += 1
+                del entry['steps'][n_shared + 1:]
+            entry['prefix'] = list(self.validated_prefix)
+            logger.log(2, 'encoder states cache hits: %d, misses: %d, reused prefix steps: %d' %
+                       (self.hits, self.misses, self.reused_steps))
+        elif entry is None or not params.get('pad_on_batch', True) or \
+                list(states_below[0][1:]) != self.validated_prefix[:ii]:
+            # Not following the validated prefix
+            return InteractiveBeamSearchSampler.predict_cond_optimized(self, X, states_below, params, ii, prev_outs)
+
+        if ii < len(entry['steps']):
+            outputs = entry['steps'][ii]
+            if ii > 0:
+                self.reused_steps += 1
+        else:
+            outputs = InteractiveBeamSearchSampler.predict_cond_optimized(self, X, states_below, params, ii, prev_outs)
+            if ii == len(entry['steps']):
+                entry['steps'].append(outputs)
+        # The search modifies the lists of states in place: return copies of the cached outputs
+        probs, prev_outs_list = outputs[0], outputs[1]
+        return (probs.copy(), [list(model_outs) for model_outs in prev_outs_list]) + tuple(outputs[2:])
+
+
 class NMTSampler:
     def __init__(self, models, dataset, params, params_prediction, params_training, model_tokenize_f, model_detokenize_f, general_tokenize_f,
                  general_detokenize_f, mapping=None, word2index_x=None, word2index_y=None, index2word_y=None,
-                 excluded_words=None, unk_id=1, eos_symbol='/', online=False, verbose=0):
+                 excluded_words=None, unk_id=1, eos_symbol='/', online=False, cache_size=100, training_models=None,
+                 result_cache_bytes=16 * 1024 * 1024, verbose=0):
         """
         Builds an NMTSampler: An object containing models and dataset, for the interactive-predictive and adaptive framework.
         :param models:
@@ -154,10 +797,15 @@ class NMTSampler:
         :param int unk_id: Unknown word index.
         :param str eos_symbol: End-of-sentence symbol.
         :param bool online: Whether apply online learning after accepting each hypothesis.
+        :param int cache_size: Number of source sentences whose tokenization and encoder states are cached.
+        :param training_models: Models trained by online learning (shadow copies of the models). If None, the
+                                serving models are trained.
+        :param int result_cache_bytes: Size (in bytes) of the cache of translations of the requests (0 disables it).
         :param int verbose: Verbosity level.
         """
 
         self.models = models
+        self.training_models = training_models if training_models is not None else models
         self.dataset = dataset
         self.params = params
         self.params_prediction = params_prediction
@@ -177,26 +825,36 @@ class NMTSampler:
         self.word2index_y = word2index_y if word2index_y is not None else \
             dataset.vocabulary[params_prediction['OUTPUTS_IDS_DATASET'][0]]['words2idx']
         self.unk_id = unk_id
+        self.vocabulary_index_y = VocabularyPrefixIndex(self.word2index_y)
+        self.cache_size = cache_size
+        self.source_cache = OrderedDict()
+        self.source_cache_hits = 0
+        self.source_cache_misses = 0
+        self.result_cache = ResultCache(max_bytes=result_cache_bytes)
 
-        self.interactive_beam_searcher = InteractiveBeamSearchSampler(self.models,
-                                                                      self.dataset,
-                                                                      self.params_prediction,
-                                                                      excluded_words=self.excluded_words,
-                                                                      verbose=self.verbose)
-
-        # Compile sampling function by generating a fake sample.
-        # TODO: Find a better way of doing this
-        logger.info('Compiling sampler...')
-        self.generate_sample('i')
-        logger.info('Done.')
+        self.interactive_beam_searcher = CachedInteractiveBeamSearchSampler(self.models,
+                                                                            self.dataset,
+                                                                            self.params_prediction,
+                                                                            excluded_words=self.excluded_words,
+                                                                            cache_size=self.cache_size,
+                                                                            verbose=self.verbose)
+        if self.params_prediction['optimized_search']:
+            self.batched_beam_searcher = BatchedBeamSearchEnsemble(self.models,
+                                                                   self.dataset,
+                                                                   self.params_prediction,
+                                                                   verbose=self.verbose)
+        else:
+            self.batched_beam_searcher = None
 
+        # Train with the indices of the target words (instead of one-hot vectors) if the loss is sparse
+        self.sparse_targets = 'sparse' in params_training.get('loss', params.get('LOSS', 'categorical_crossentropy'))
         self.online = online
         if self.online:
-            self.online_trainer = OnlineTrainer(self.models, self.dataset, None,  # Sampler
+            self.online_trainer = OnlineTrainer(self.training_models, self.dataset, None,  # Sampler
                                                 None,  # Params prediction
                                                 params_training,
                                                 verbose=self.verbose)
-            for i, nmt_model in enumerate(self.models):
+            for i, nmt_model in enumerate(self.training_models):
                 logger.info('Compiling model %d...' % i)
                 nmt_model.model._make_train_function()
             logger.info('Done.')
@@ -204,33 +862,127 @@ class NMTSampler:
         else:
             self.online_trainer = None
 
-    def generate_sample(self, source_sentence, validated_prefix=None, max_N=5, isle_indices=None,
-                        filtered_idx2word=None, unk_indices=None, unk_words=None):
+    def clone(self, models, training_models=None):
         """
-        Generate sample via constrained search. Options labeled with <<isles>> are untested
-        and likely require some modifications to correctly work.
-        :param source_sentence: Source sentence.
-        :param validated_prefix: Prefix to keep in the output.
-        :param max_N: Maximum number of words to generate between validated segments. <<isles>>
-        :param isle_indices: Indices of the validated segments. <<isles>>
-        :param filtered_idx2word: List of candidate words to be the next one to generate (after generating fixed_words).
-        :param unk_indices: Positions of the unknown words.
-        :param unk_words: Unknown words.
-        :return:
+        Builds a sampler with the same configuration than this one, but other models. The caches are not copied.
+        :param models: Models used by the new sampler.
+        :param training_models: Models trained by online learning (None for training the serving models).
+        :return: NMTSampler.
         """
-        logger.log(2, 'Beam size: %d' % (self.params_prediction['beam_size']))
-        generate_sample_start_time = time.time()
-        if unk_indices is None:
-            unk_indices = []
-        if unk_words is None:
-            unk_words = []
+        return NMTSampler(models, self.dataset, self.params, self.params_prediction, self.params_training,
+                          self.model_tokenize_f, self.model_detokenize_f,
+                          self.general_tokenize_f, self.general_detokenize_f,
+                          mapping=self.mapping, word2index_x=self.word2index_x, word2index_y=self.word2index_y,
+                          index2word_y=self.index2word_y, excluded_words=self.excluded_words, unk_id=self.unk_id,
+                          eos_symbol=self.eos_symbol, online=self.online, cache_size=self.cache_size,
+                          training_models=training_models, result_cache_bytes=self.result_cache.max_bytes,
+                          verbose=self.verbose)
+
+    def recent_sources(self, n_sentences):
+        """
+        Source sentences recently translated.
+        :param int n_sentences: Maximum number of sentences.
+        :return: List with the last n_sentences source sentences (the most recent one, the last).
+        """
+        return list(self.source_cache)[-n_sentences:] if n_sentences > 0 else []
+
+    def warmup_sentence(self, length):
+        """
+        Builds a synthetic source sentence, made of in-vocabulary words.
+        :param int length: Number of words of the sentence.
+        :return: Source sentence.
+        """
+        if not hasattr(self, 'warmup_words'):
+            extra_words = set(self.dataset.extra_words)
+            # Most frequent words first: they are also whole words for the subword tokenizers
+            self.warmup_words = [word for word, _ in sorted(self.word2index_x.items(), key=lambda item: item[1])
+                                 if word not in extra_words and word.isalpha()][:100] or ['i']
+        return u' '.join(self.warmup_words[i % len(self.warmup_words)] for i in range(length))
+
+    def warmup(self, lengths=(1,), beam_sizes=None, prefix=True, batch_size=1, online=True):
+        """
+        Runs every search function of the sampler once per input shape, so the first requests do not wait for the
+        compilation of the functions (or the allocation of their buffers). The time spent on each case is logged and
+        exposed in the nmt_warmup_seconds gauge. The caches are emptied afterwards.
+        :param lengths: Lengths (in words) of the synthetic source sentences.
+        :param beam_sizes: Beam sizes to warm up. If None, only the default one.
+        :param bool prefix: Whether to also translate with a validated prefix (half of the hypothesis).
+        :param int batch_size: If > 1, the batched search is also warmed up with batches of this size.
+        :param bool online: Whether to run an online update (which is undone) for compiling the train function.
+        """
+        warmup_start_time = time.time()
+        beam_sizes = beam_sizes or [self.params_prediction['beam_size']]
+
+        def run_case(case, function, *args):
+            case_start_time = time.time()
+            result = function(*args)
+            case_time = time.time() - case_start_time
+            metrics.set_gauge('warmup_seconds', 'Time spent on each warmup case.', case_time, labels={'case': case})
+            logger.info('Warmup %s: %.3f secs' % (case, case_time))
+            return result
+
+        hypothesis = u''
+        for beam_size in beam_sizes:
+            params_prediction = copy.copy(self.params_prediction)
+            params_prediction['beam_size'] = beam_size
+            for length in lengths:
+                source_sentence = self.warmup_sentence(length)
+                hypothesis = run_case('beam_size=%d,length=%d' % (beam_size, length),
+                                      lambda: self.generate_sample(source_sentence, params_prediction=params_prediction))
+                hypothesis_words = hypothesis.split()
+                # An empty hypothesis has no prefix to validate
+                if prefix and hypothesis_words:
+                    validated_prefix = u' '.join(hypothesis_words[:(len(hypothesis_words) + 1) // 2]) + u' '
+                    run_case('beam_size=%d,length=%d,prefix' % (beam_size, length),
+                             lambda: self.generate_sample(source_sentence, validated_prefix=validated_prefix,
+                                                          params_prediction=params_prediction))
+                if batch_size > 1 and self.batched_beam_searcher is not None:
+                    run_case('beam_size=%d,length=%d,batch=%d' % (beam_size, length, batch_size),
+                             lambda: self.generate_samples([source_sentence] * batch_size,
+                                                           params_prediction=params_prediction))
+        if online and self.online_trainer is not None:
+            # Compile the train function with an update, and undo it
+            weights = [(nmt_model.model.get_weights(), nmt_model.model.optimizer.get_weights())
+                       for nmt_model in self.training_models]
+            run_case('online_update', lambda: self.learn_from_samples([(self.warmup_sentence(max(lengths)),
+                                                                        hypothesis or u'i')]))
+            for nmt_model, (model_weights, optimizer_weights) in zip(self.training_models, weights):
+                nmt_model.model.set_weights(model_weights)
+                if optimizer_weights:
+                    nmt_model.model.optimizer.set_weights(optimizer_weights)
+
+        # Do not keep the synthetic sentences in the caches, nor count them in the hit ratios
+        self.source_cache.clear()
+        self.source_cache_hits = self.source_cache_misses = 0
+        self.interactive_beam_searcher.clear_cache()
+        self.interactive_beam_searcher.hits = self.interactive_beam_searcher.misses = 0
+        self.interactive_beam_searcher.reused_steps = 0
+        logger.info('Warmup finished in %.2f secs' % (time.time() - warmup_start_time))
 
-        tokenization_start_time = time.time()
+    def cache_hit_ratios(self):
+        """
+        Hit ratios of the caches of the source sentences, of the encoder states and of the translations.
+        :return: List of ({'cache': name}, hit ratio) tuples.
+        """
+        searcher = self.interactive_beam_searcher
+        return [({'cache': 'source'}, self.source_cache_hits / float(max(1, self.source_cache_hits + self.source_cache_misses))),
+                ({'cache': 'encoder_states'}, searcher.hits / float(max(1, searcher.hits + searcher.misses))),
+                ({'cache': 'results'}, self.result_cache.hit_ratio())]
+
+    def process_source(self, source_sentence):
+        """
+        Tokenizes a source sentence and maps it to indices. The results of the last cache_size sentences are cached,
+        because the same sentence is processed once per keystroke of the user.
+        :param source_sentence: Source sentence.
+        :return: Tuple (tokenized sentence, sequence of indices).
+        """
+        if source_sentence in self.source_cache:
+            self.source_cache_hits += 1
+            self.source_cache.move_to_end(source_sentence)
+            return self.source_cache[source_sentence]
+        self.source_cache_misses += 1
         tokenized_input = self.general_tokenize_f(source_sentence, escape=False)
         tokenized_input = self.model_tokenize_f(tokenized_input)
-        tokenization_end_time = time.time()
-        logger.log(2, 'tokenization time: %.6f' % (tokenization_end_time - tokenization_start_time))
-        parse_input_start_time = time.time()
         # Go from text to indices
         src_seq = self.dataset.loadText([tokenized_input],
                                         vocabularies=self.dataset.vocabulary[self.params['INPUTS_IDS_DATASET'][0]],
@@ -240,17 +992,36 @@ class NMTSampler:
                                         pad_on_batch=self.dataset.pad_on_batch[self.params['INPUTS_IDS_DATASET'][0]],
                                         words_so_far=False,
                                         loading_X=True)[0][0]
+        if self.cache_size > 0:
+            self.source_cache[source_sentence] = (tokenized_input, src_seq)
+            if len(self.source_cache) > self.cache_size:
+                self.source_cache.popitem(last=False)
+        return tokenized_input, src_seq
 
+    def prepare_sample(self, source_sentence, validated_prefix=None, filtered_idx2word=None):
+        """
+        Processes the source sentence and the feedback of the user: tokenizes them and builds the constraints of the
+        search.
+        :param source_sentence: Source sentence.
+        :param validated_prefix: Prefix to keep in the output.
+        :param filtered_idx2word: List of candidate words to be the next one to generate (after generating fixed_words).
+        :return: Dictionary with the tokenized source ('tokenized_input'), its indices ('src_seq'), the validated
+                 words ('fixed_words'), the unknown validated words ('unk_words') and the candidates for the next word
+                 ('filtered_idx2word'). If the user validated the whole sentence, 'hypothesis' is the final
+                 translation and there is nothing to search.
+        """
+        parse_input_start_time = time.time()
+        tokenized_input, src_seq = self.process_source(source_sentence)
         parse_input_end_time = time.time()
-        logger.log(2, 'parse_input time: %.6f' % (parse_input_end_time - parse_input_start_time))
+        log_time('parse_input', parse_input_start_time, parse_input_end_time)
 
         fixed_words_user = OrderedDict()
         unk_words_dict = OrderedDict()
         # If the user provided some feedback...
-        if validated_prefix is not None:
+        if validated_prefix:
             next_correction = validated_prefix[-1]
             if next_correction == self.eos_symbol:
-                return validated_prefix[:-1].decode('utf-8')
+                return {'hypothesis': validated_prefix[:-1]}
 
             # 2.2.4 Tokenize the prefix properly (possibly applying BPE)
             #  TODO: Here we are tokenizing the target language with the source language tokenizer
@@ -258,7 +1029,7 @@ class NMTSampler:
             tokenized_validated_prefix = self.general_tokenize_f(validated_prefix, escape=False)
             tokenized_validated_prefix = self.model_tokenize_f(tokenized_validated_prefix)
             prefix_tokenization_end_time = time.time()
-            logger.log(2, 'prefix_tokenization time: %.6f' % (prefix_tokenization_end_time - prefix_tokenization_start_time))
+            log_time('prefix_tokenization', prefix_tokenization_start_time, prefix_tokenization_end_time)
 
             # 2.2.5 Validate words
             word_validation_start_time = time.time()
@@ -267,15 +1038,17 @@ class NMTSampler:
                 if self.word2index_y.get(word) is None:
                     unk_words_dict[pos] = word
             word_validation_end_time = time.time()
-            logger.log(2, 'word_validation time: %.6f' % (word_validation_end_time - word_validation_start_time))
+            log_time('word_validation', word_validation_start_time, word_validation_end_time)
 
             # 2.2.6 Constrain search for the last word
             constrain_search_start_time = time.time()
-            last_user_word_pos = list(fixed_words_user.keys())[-1]
-            if next_correction != u' ':
+            if not fixed_words_user:
+                # E.g. a prefix made of whitespace: there are no validated words
+                filtered_idx2word = dict()
+            elif next_correction != u' ':
+                last_user_word_pos = list(fixed_words_user.keys())[-1]
                 last_user_word = tokenized_validated_prefix.split()[-1]
-                filtered_idx2word = dict((self.word2index_y[candidate_word], candidate_word)
-                                         for candidate_word in self.word2index_y if candidate_word[:len(last_user_word)] == last_user_word)
+                filtered_idx2word = self.vocabulary_index_y.idx2word_with_prefix(last_user_word)
 
                 if filtered_idx2word != dict():
                     del fixed_words_user[last_user_word_pos]
@@ -284,23 +1057,29 @@ class NMTSampler:
             else:
                 filtered_idx2word = dict()
             constrain_search_end_time = time.time()
-            logger.log(2, 'constrain_search_end_time time: %.6f' % (constrain_search_end_time - constrain_search_start_time))
+            log_time('constrain_search', constrain_search_start_time, constrain_search_end_time)
 
-        sample_beam_search_start_time = time.time()
-        trans_indices, costs, alphas = \
-            self.interactive_beam_searcher.sample_beam_search_interactive(src_seq,
-                                                                          fixed_words=copy.copy(fixed_words_user),
-                                                                          max_N=max_N,
-                                                                          isles=isle_indices,
-                                                                          valid_next_words=filtered_idx2word,
-                                                                          idx2word=self.index2word_y)
-        sample_beam_search_end_time = time.time()
-        logger.log(2, 'sample_beam_search time: %.6f' % (sample_beam_search_end_time - sample_beam_search_start_time))
+        return {'tokenized_input': tokenized_input,
+                'src_seq': src_seq,
+                'fixed_words': fixed_words_user,
+                'unk_words': unk_words_dict,
+                'filtered_idx2word': filtered_idx2word}
 
-        if self.params_prediction['pos_unk']:
+    def finish_sample(self, sample, trans_indices, alphas, params_prediction=None):
+        """
+        Converts the indices of a hypothesis into a detokenized sentence, including the unknown words validated by
+        the user.
+        :param dict sample: Sample, as returned by prepare_sample.
+        :param trans_indices: Indices of the hypothesis.
+        :param alphas: Attention weights of the hypothesis.
+        :param dict params_prediction: Search parameters of the request (None for using the default ones).
+        :return: Hypothesis.
+        """
+        params_prediction = params_prediction or self.params_prediction
+        if params_prediction['pos_unk']:
             alphas = [alphas]
-            sources = [tokenized_input]
-            heuristic = self.params_prediction['heuristic']
+            sources = [sample['tokenized_input']]
+            heuristic = params_prediction['heuristic']
         else:
             alphas = None
             heuristic = None
@@ -317,12 +1096,12 @@ class NMTSampler:
                                                     pad_sequences=True,
                                                     verbose=0)[0]
         decoding_predictions_end_time = time.time()
-        logger.log(2, 'decoding_predictions time: %.6f' % (decoding_predictions_end_time - decoding_predictions_start_time))
+        log_time('decoding_predictions', decoding_predictions_start_time, decoding_predictions_end_time)
 
         # UNK words management
         unk_management_start_time = time.time()
-        unk_indices = list(unk_words_dict)
-        unk_words = list(unk_words_dict.values())
+        unk_indices = list(sample['unk_words'])
+        unk_words = list(sample['unk_words'].values())
         if len(unk_indices) > 0:  # If we added some UNK word
             hypothesis = hypothesis.split()
             if len(hypothesis) < len(unk_indices):  # The full hypothesis will be made up UNK words:
@@ -338,17 +1117,178 @@ class NMTSampler:
                         hypothesis.append(unk_words[i])
             hypothesis = u' '.join(hypothesis)
         unk_management_end_time = time.time()
-        logger.log(2, 'unk_management time: %.6f' % (unk_management_end_time - unk_management_start_time))
+        log_time('unk_management', unk_management_start_time, unk_management_end_time)
 
         hypothesis_detokenization_start_time = time.time()
         hypothesis = self.model_detokenize_f(hypothesis)
         hypothesis = self.general_detokenize_f(hypothesis, unescape=False)
         hypothesis_detokenization_end_time = time.time()
-        logger.log(2, 'hypothesis_detokenization time: %.6f' % (hypothesis_detokenization_end_time - hypothesis_detokenization_start_time))
+        log_time('hypothesis_detokenization', hypothesis_detokenization_start_time, hypothesis_detokenization_end_time)
+        return hypothesis
+
+    def interactive_search(self, sample, params_prediction=None, max_N=5, isle_indices=None):
+        """
+        Searches the best hypothesis for a sample, constrained by the feedback of the user, with the interactive
+        sampler (which reuses the cached states of the source sentence and of the validated prefix).
+        :param dict sample: Sample, as returned by prepare_sample.
+        :param dict params_prediction: Search parameters of the request (None for using the default ones).
+        :param max_N: Maximum number of words to generate between validated segments. <<isles>>
+        :param isle_indices: Indices of the validated segments. <<isles>>
+        :return: Tuple (indices of the hypothesis, cost, attention weights).
+        """
+        params_prediction = params_prediction or self.params_prediction
+        # Contiguous validated words, from the beginning of the sentence
+        validated_words = []
+        while len(validated_words) in sample['fixed_words']:
+            validated_words.append(sample['fixed_words'][len(validated_words)])
+        self.interactive_beam_searcher.set_validated_prefix(validated_words)
+
+        sample_beam_search_start_time = time.time()
+        # The search parameters are only changed for this request
+        self.interactive_beam_searcher.params = params_prediction
+        try:
+            trans_indices, costs, alphas = \
+                self.interactive_beam_searcher.sample_beam_search_interactive(sample['src_seq'],
+                                                                              fixed_words=copy.copy(sample['fixed_words']),
+                                                                              max_N=max_N,
+                                                                              isles=isle_indices,
+                                                                              valid_next_words=sample['filtered_idx2word'],
+                                                                              idx2word=self.index2word_y)
+        finally:
+            self.interactive_beam_searcher.params = self.params_prediction
+        sample_beam_search_end_time = time.time()
+        log_time('sample_beam_search', sample_beam_search_start_time, sample_beam_search_end_time)
+        return trans_indices, costs, alphas
+
+    def generate_sample(self, source_sentence, validated_prefix=None, max_N=5, isle_indices=None,
+                        filtered_idx2word=None, unk_indices=None, unk_words=None, params_prediction=None):
+        """
+        Generate sample via constrained search. Options labeled with <<isles>> are untested
+        and likely require some modifications to correctly work.
+        :param source_sentence: Source sentence.
+        :param validated_prefix: Prefix to keep in the output.
+        :param max_N: Maximum number of words to generate between validated segments. <<isles>>
+        :param isle_indices: Indices of the validated segments. <<isles>>
+        :param filtered_idx2word: List of candidate words to be the next one to generate (after generating fixed_words).
+        :param unk_indices: Positions of the unknown words.
+        :param unk_words: Unknown words.
+        :param dict params_prediction: Search parameters of the request (None for using the default ones).
+        :return:
+        """
+        params_prediction = params_prediction or self.params_prediction
+        logger.log(2, 'Beam size: %d' % (params_prediction['beam_size']))
+        generate_sample_start_time = time.time()
+        sample = self.prepare_sample(source_sentence, validated_prefix=validated_prefix,
+                                     filtered_idx2word=filtered_idx2word)
+        if 'hypothesis' in sample:
+            return sample['hypothesis']
+        trans_indices, _, alphas = self.interactive_search(sample, params_prediction=params_prediction,
+                                                           max_N=max_N, isle_indices=isle_indices)
+        hypothesis = self.finish_sample(sample, trans_indices, alphas, params_prediction=params_prediction)
         generate_sample_end_time = time.time()
-        logger.log(2, 'generate_sample time: %.6f' % (generate_sample_end_time - generate_sample_start_time))
+        log_time('generate_sample', generate_sample_start_time, generate_sample_end_time)
         return hypothesis
 
+    def generate_samples(self, source_sentences, validated_prefixes=None, params_prediction=None, n_best=0):
+        """
+        Generate samples for several source sentences, via a constrained search which decodes all of them at once.
+        A single sentence is translated with the interactive sampler, which reuses the cached states of the source
+        sentence. Without the optimized search, sentences are translated one by one (and n-best lists are not available).
+        :param list source_sentences: Source sentences.
+        :param list validated_prefixes: Prefix to keep in the output of each sentence (or None).
+        :param params_prediction: Search parameters of each sentence (or None for using the default ones). All the
+                                  sentences must share the beam size.
+        :param n_best: Size of the n-best list of each sentence (0 for no n-best list). Either an int or a list.
+        :return: List with a dictionary per sentence, with its best hypothesis ('hypothesis'), its cost ('score', None
+                 if the user validated the whole sentence) and its n-best list ('n_best', a list of (hypothesis, cost)
+                 tuples, or None). For the sentences which could not be translated, the exception raised instead.
+        """
+        n_sentences = len(source_sentences)
+        if validated_prefixes is None:
+            validated_prefixes = [None] * n_sentences
+        if params_prediction is None or isinstance(params_prediction, dict):
+            params_prediction = [params_prediction] * n_sentences
+        params_prediction = [sample_params or self.params_prediction for sample_params in params_prediction]
+        if not isinstance(n_best, list):
+            n_best = [n_best] * n_sentences
+
+        generate_samples_start_time = time.time()
+        samples = [None] * n_sentences
+        translations = [None] * n_sentences
+
+        def fail(i, error):
+            # Only the sentence which raised the error fails
+            logger.error('Error translating the sentence "%s": %s' % (source_sentences[i], str(error)))
+            translations[i] = error
+
+        for i, (source_sentence, validated_prefix) in enumerate(zip(source_sentences, validated_prefixes)):
+            try:
+                samples[i] = self.prepare_sample(source_sentence, validated_prefix=validated_prefix)
+            except Exception as e:
+                fail(i, e)
+            else:
+                translations[i] = {'hypothesis': samples[i].get('hypothesis'), 'score': None, 'n_best': None}
+        to_search = [i for i, sample in enumerate(samples) if sample is not None and 'hypothesis' not in sample]
+        if self.batched_beam_searcher is None or (len(to_search) == 1 and not n_best[to_search[0]]):
+            for i in to_search:
+                try:
+                    trans_indices, costs, alphas = self.interactive_search(samples[i],
+                                                                           params_prediction=params_prediction[i])
+                    translations[i]['hypothesis'] = self.finish_sample(samples[i], trans_indices, alphas,
+                                                                       params_prediction=params_prediction[i])
+                    translations[i]['score'] = float(costs)
+                except Exception as e:
+                    fail(i, e)
+        elif to_search:
+            input_id = self.params['INPUTS_IDS_DATASET'][0]
+            x, x_mask = self.dataset.loadText([samples[i]['tokenized_input'] for i in to_search],
+                                              vocabularies=self.dataset.vocabulary[input_id],
+                                              max_len=self.params['MAX_INPUT_TEXT_LEN'],
+                                              offset=0,
+                                              fill=self.dataset.fill_text[input_id],
+                                              pad_on_batch=True,
+                                              words_so_far=False,
+                                              loading_X=True)
+            fixed_words = []
+            valid_next_words = []
+            for i in to_search:
+                validated_words = []
+                while len(validated_words) in samples[i]['fixed_words']:
+                    validated_words.append(samples[i]['fixed_words'][len(validated_words)])
+                fixed_words.append(validated_words)
+                valid_next_words.append(list(samples[i]['filtered_idx2word'])
+                                        if samples[i]['filtered_idx2word'] else None)
+            search_params = dict(params_prediction[to_search[0]])
+            search_params['pad_on_batch'] = True
+            sample_beam_search_start_time = time.time()
+            results = self.batched_beam_searcher.beam_search_batch({search_params['model_inputs'][0]: x},
+                                                                   x_mask,
+                                                                   search_params,
+                                                                   null_sym=self.dataset.extra_words['<null>'],
+                                                                   fixed_words=fixed_words,
+                                                                   valid_next_words=valid_next_words)
+            sample_beam_search_end_time = time.time()
+            logger.log(2, 'Batched search of %d sentences' % len(to_search))
+            log_time('batched_beam_search', sample_beam_search_start_time, sample_beam_search_end_time)
+            for i, (trans_samples, scores, alphas) in zip(to_search, results):
+                try:
+                    scores = apply_penalties(trans_samples, scores, alphas, params_prediction[i])
+                    ranking = np.argsort(scores)
+                    translations[i]['n_best'] = [(self.finish_sample(samples[i], trans_samples[j],
+                                                                     np.asarray(alphas[j]) if alphas is not None
+                                                                     else None,
+                                                                     params_prediction=params_prediction[i]),
+                                                  float(scores[j]))
+                                                 for j in ranking[:max(1, n_best[i])]]
+                    translations[i]['hypothesis'], translations[i]['score'] = translations[i]['n_best'][0]
+                    if not n_best[i]:
+                        translations[i]['n_best'] = None
+                except Exception as e:
+                    fail(i, e)
+        generate_samples_end_time = time.time()
+        log_time('generate_samples', generate_samples_start_time, generate_samples_end_time)
+        return translations
+
     def learn_from_sample(self, source_sentence, target_sentence):
         """
         Incrementally adapt the model with the validated sample.
@@ -356,23 +1296,39 @@ class NMTSampler:
         :param target_sentence: Target sentence (y).
         :return:
         """
-        # Tokenize input
-        tokenized_input = self.general_tokenize_f(source_sentence, escape=False)
-        tokenized_input = self.model_tokenize_f(tokenized_input)
-        src_seq = self.dataset.loadText([tokenized_input],
+        self.learn_from_samples([(source_sentence, target_sentence)])
+        if self.online_trainer is not None:
+            self.update_serving_weights()
+
+    def learn_from_samples(self, samples):
+        """
+        Incrementally adapt the training models with a mini-batch of validated samples. If the training models are
+        not the serving ones, the new weights are not used for translating until calling update_serving_weights.
+        :param list samples: List of (source sentence, target sentence) tuples.
+        :return:
+        """
+        if self.online_trainer is None:
+            logger.warning('Online learning is disabled.')
+            return
+        # Tokenize input and output
+        tokenized_inputs = []
+        tokenized_references = []
+        for source_sentence, target_sentence in samples:
+            tokenized_input = self.general_tokenize_f(source_sentence, escape=False)
+            tokenized_inputs.append(self.model_tokenize_f(tokenized_input))
+            tokenized_reference = self.general_tokenize_f(target_sentence, escape=False)
+            tokenized_references.append(self.model_tokenize_f(tokenized_reference))
+
+        # Build inputs/outpus of the system
+        src_seq = self.dataset.loadText(tokenized_inputs,
                                         vocabularies=self.dataset.vocabulary[self.params['INPUTS_IDS_DATASET'][0]],
                                         max_len=self.params['MAX_INPUT_TEXT_LEN'],
                                         offset=0,
                                         fill=self.dataset.fill_text[self.params['INPUTS_IDS_DATASET'][0]],
                                         pad_on_batch=self.dataset.pad_on_batch[self.params['INPUTS_IDS_DATASET'][0]],
                                         words_so_far=False,
-                                        loading_X=True)[0][0]
-        # Tokenize output
-        tokenized_reference = self.general_tokenize_f(target_sentence, escape=False)
-        tokenized_reference = self.model_tokenize_f(tokenized_reference)
-
-        # Build inputs/outpus of the system
-        state_below = self.dataset.loadText([tokenized_reference],
+                                        loading_X=True)[0]
+        state_below = self.dataset.loadText(tokenized_references,
                                             vocabularies=self.dataset.vocabulary[self.params['OUTPUTS_IDS_DATASET'][0]],
                                             max_len=self.params['MAX_OUTPUT_TEXT_LEN_TEST'],
                                             offset=1,
@@ -382,28 +1338,319 @@ class NMTSampler:
                                             loading_X=True)[0]
 
         # 4.1.3 Ground truth sample -> Interactively translated sentence
-        # TODO: Load dense-text if necessary
-        trg_seq = self.dataset.loadTextOneHot([tokenized_reference],
-                                              vocabularies=self.dataset.vocabulary[self.params['OUTPUTS_IDS_DATASET'][0]],
-                                              vocabulary_len=self.dataset.vocabulary_len[self.params['OUTPUTS_IDS_DATASET'][0]],
-                                              max_len=self.params['MAX_OUTPUT_TEXT_LEN_TEST'],
-                                              offset=0,
-                                              fill=self.dataset.fill_text[self.params['OUTPUTS_IDS_DATASET'][0]],
-                                              pad_on_batch=self.dataset.pad_on_batch[self.params['OUTPUTS_IDS_DATASET'][0]],
-                                              words_so_far=False,
-                                              sample_weights=self.params['SAMPLE_WEIGHTS'],
-                                              loading_X=False)
+        if self.sparse_targets:
+            # Sparse losses take the indices of the target words (dense-text), instead of one-hot vectors
+            trg_seq, trg_mask = self.dataset.loadText(tokenized_references,
+                                                      vocabularies=self.dataset.vocabulary[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                      max_len=self.params['MAX_OUTPUT_TEXT_LEN_TEST'],
+                                                      offset=0,
+                                                      fill=self.dataset.fill_text[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                      pad_on_batch=self.dataset.pad_on_batch[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                      words_so_far=False,
+                                                      loading_X=False)
+            trg_seq = trg_seq[:, :, None]
+            if self.params['SAMPLE_WEIGHTS']:
+                trg_seq = (trg_seq, trg_mask)
+        else:
+            trg_seq = self.dataset.loadTextOneHot(tokenized_references,
+                                                  vocabularies=self.dataset.vocabulary[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                  vocabulary_len=self.dataset.vocabulary_len[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                  max_len=self.params['MAX_OUTPUT_TEXT_LEN_TEST'],
+                                                  offset=0,
+                                                  fill=self.dataset.fill_text[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                  pad_on_batch=self.dataset.pad_on_batch[self.params['OUTPUTS_IDS_DATASET'][0]],
+                                                  words_so_far=False,
+                                                  sample_weights=self.params['SAMPLE_WEIGHTS'],
+                                                  loading_X=False)
         # 4.2 Train online!
-        if self.online_trainer is not None:
-            self.online_trainer.train_online([np.asarray([src_seq]), state_below], trg_seq, trg_words=[target_sentence])
+        train_start_time = time.time()
+        self.online_trainer.train_online([src_seq, state_below], trg_seq,
+                                         trg_words=[target_sentence for _, target_sentence in samples])
+        log_time('online_training', train_start_time, time.time())
+
+    def get_training_weights(self):
+        """
+        Copies the weights of the training models.
+        :return: List with the weights of each training model.
+        """
+        return [training_model.model.get_weights() for training_model in self.training_models]
+
+    def update_serving_weights(self, weights=None):
+        """
+        Sets the weights of the serving models. Must be called from the thread that translates (e.g. as a job of the
+        BatchScheduler), so no search sees a mix of old and new weights.
+        :param list weights: Weights of each model (as returned by get_training_weights). If None, they are copied
+                             from the training models.
+        """
+        swap_start_time = time.time()
+        if weights is None and self.training_models is not self.models:
+            weights = self.get_training_weights()
+        if weights is not None:
+            for serving_model, model_weights in zip(self.models, weights):
+                serving_model.model.set_weights(model_weights)
+        # The cached encoder states and translations were computed with the old weights
+        self.interactive_beam_searcher.clear_cache()
+        self.result_cache.clear()
+        log_time('weights_swap', swap_start_time, time.time())
+
+    def save_training_models(self, update_num, store_path):
+        """
+        Stores a snapshot of the training models.
+        :param int update_num: Number of updates of the models.
+        :param str store_path: Directory where the models are stored. Each model is stored in store_path/model_<i>.
+        """
+        for i, training_model in enumerate(self.training_models):
+            saveModel(training_model, update_num, path=os.path.join(store_path, 'model_%d' % i), store_iter=True)
+        logger.info('Stored the online models (%d updates) in %s' % (update_num, store_path))
+
+
+class OnlineLearner:
+    """
+    Adapts the models with the validated samples (post-edits) in a background thread, so the translation requests
+    never wait for the training. Samples are queued and trained in mini-batches of batch_size samples, or as soon as
+    the oldest pending sample waited flush_interval seconds.
+    The updates are applied to the training (shadow) models of the sampler. After each update, their weights are
+    copied into the serving models by the scheduler, between two searches. If the sampler trains its serving models,
+    the training itself is executed by the scheduler.
+    """
+
+    def __init__(self, sampler, scheduler, batch_size=8, flush_interval=5., snapshot_interval=0, store_path=None):
+        """
+        :param NMTSampler sampler: Sampler whose models are adapted.
+        :param BatchScheduler scheduler: Scheduler which runs the serving models.
+        :param int batch_size: Number of samples of each mini-batch.
+        :param float flush_interval: Maximum time (in seconds) that a sample waits for completing a mini-batch.
+        :param int snapshot_interval: Store the training models each snapshot_interval updates (0: never).
+        :param str store_path: Directory where the snapshots are stored.
+        """
+        self.sampler = sampler
+        self.scheduler = scheduler
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.store_path = store_path
+        self.n_updates = 0
+        self.queue = queue.Queue()
+        # Held during each update, so the models are not replaced in the middle of it (and by ModelReloader, so no
+        # update is applied to the models being replaced)
+        self.lock = threading.Lock()
+        self.graph = scheduler.graph
+        self.thread = threading.Thread(target=self.serve, name='OnlineLearner')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def push(self, source_sentence, target_sentence):
+        """
+        Queues a validated sample for training. Returns immediately.
+        :param source_sentence: Source sentence (x).
+        :param target_sentence: Target sentence (y).
+        """
+        self.queue.put((source_sentence, target_sentence))
+
+    def serve(self):
+        if self.graph is not None:
+            with self.graph.as_default():
+                self.serve_samples()
         else:
-            logger.warning('Online learning is disabled.')
+            self.serve_samples()
+
+    def serve_samples(self):
+        """
+        Main loop: collects the samples and trains them in mini-batches.
+        """
+        samples = []
+        flush_time = None
+        while True:
+            try:
+                timeout = None if not samples else max(0., flush_time - time.time())
+                samples.append(self.queue.get(timeout=timeout))
+                if flush_time is None:
+                    flush_time = time.time() + self.flush_interval
+            except queue.Empty:
+                pass
+            if samples and (len(samples) >= self.batch_size or time.time() >= flush_time):
+                try:
+                    with self.lock:
+                        self.train(samples)
+                except Exception as e:
+                    logger.error('Error training on %d samples: %s' % (len(samples), str(e)))
+                samples = []
+                flush_time = None
+
+    def train(self, samples):
+        """
+        Trains the models on a mini-batch and updates the serving models.
+        :param list samples: List of (source sentence, target sentence) tuples.
+        """
+        logger.log(2, 'Training online on %d samples' % len(samples))
+        if self.sampler.training_models is self.sampler.models:
+            self.scheduler.run(self.sampler.learn_from_samples, samples)
+            self.scheduler.run(self.sampler.update_serving_weights)
+        else:
+            self.sampler.learn_from_samples(samples)
+            weights = self.sampler.get_training_weights()
+            self.scheduler.run(self.sampler.update_serving_weights, weights)
+        self.n_updates += 1
+        metrics.increment('online_updates_total', 'Number of online learning updates.')
+        if self.snapshot_interval > 0 and self.n_updates % self.snapshot_interval == 0 and self.store_path:
+            if self.sampler.training_models is self.sampler.models:
+                self.scheduler.run(self.sampler.save_training_models, self.n_updates, self.store_path)
+            else:
+                self.sampler.save_training_models(self.n_updates, self.store_path)
+
+
+class ModelReloader:
+    """
+    Replaces the models of the server without restarting it. The new models are loaded and warmed up (on the source
+    sentences recently translated) while the old ones keep serving the requests. Every step runs as a job of the
+    scheduler, which owns the TensorFlow graph and session, so the models are never built nor run concurrently
+    with a search: requests are translated between the steps of the reload. Then, the scheduler swaps the samplers
+    between two batches: the requests queued before the swap are translated with the old models and the following
+    ones, with the new models.
+    With online learning, the updates are paused during the reload: the post-edits received meanwhile are not
+    applied to the old models (which would be discarded), but to the new ones, after the swap.
+    """
+
+    def __init__(self, server, parameters, dataset, online=False, shadow=True, warmup_size=10, warmup_settings=None):
+        """
+        :param server: HTTP server, with the current sampler, scheduler and online learner.
+        :param dict parameters: All hyperparameters of the model.
+        :param dataset: Dataset instance.
+        :param bool online: Whether the models are adapted with online learning.
+        :param bool shadow: With online learning, whether a shadow copy of the models is trained.
+        :param int warmup_size: Number of recent source sentences translated by the new models before the swap.
+        :param dict warmup_settings: Arguments of NMTSampler.warmup for the new models.
+        """
+        self.server = server
+        self.parameters = parameters
+        self.dataset = dataset
+        self.online = online
+        self.shadow = shadow
+        self.warmup_size = warmup_size
+        self.warmup_settings = warmup_settings or {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def reload(self, model_paths):
+        """
+        Starts loading a new set of models in the background.
+        :param list model_paths: Paths to the new models.
+        :return: False if another reload is in progress, True otherwise.
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.thread = threading.Thread(target=self.serve, args=(model_paths,), name='ModelReloader')
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def serve(self, model_paths):
+        try:
+            self.replace_models(model_paths)
+        except Exception as e:
+            logger.error('Error reloading the models from %s: %s. The old models are kept.' % (str(model_paths), str(e)))
+
+    def replace_models(self, model_paths):
+        """
+        Loads and warms up the new models and swaps them in. Online updates wait until the reload is finished.
+        :param list model_paths: Paths to the new models.
+        """
+        learner = self.server.learner
+        if learner is None:
+            self.load_and_swap(model_paths)
+            return
+        with learner.lock:
+            self.load_and_swap(model_paths)
+            logger.info('Online learning resumed: the post-edits received during the reload (%d queued) are '
+                        'applied to the new models' % learner.queue.qsize())
+
+    def load_and_swap(self, model_paths):
+        """
+        Loads and warms up the new models in the thread of the scheduler and swaps them in.
+        :param list model_paths: Paths to the new models.
+        """
+        scheduler = self.server.scheduler
+        model_load_start_time = time.time()
+        sampler = scheduler.run(self.load_sampler, model_paths)
+        metrics.set_gauge('model_load_seconds', 'Time spent loading the models.', time.time() - model_load_start_time)
+        scheduler.run(lambda: sampler.warmup(**self.warmup_settings))
+        warmup_sentences = scheduler.run(self.server.sampler.recent_sources, self.warmup_size)
+        if warmup_sentences:
+            warmup_start_time = time.time()
+            scheduler.run(sampler.generate_samples, warmup_sentences)
+            for source_sentence in warmup_sentences:
+                scheduler.run(sampler.generate_sample, source_sentence)
+            logger.info('Warmed up the new models on %d sentences in %.2f secs' %
+                        (len(warmup_sentences), time.time() - warmup_start_time))
+        scheduler.run(self.swap, sampler, model_paths)
+        metrics.increment('model_reloads_total', 'Number of times that the models were replaced.')
+        logger.info('Serving the models from %s' % str(model_paths))
+
+    def load_sampler(self, model_paths):
+        """
+        Builds a sampler with the new models. Executed by the scheduler.
+        :param list model_paths: Paths to the new models.
+        :return: NMTSampler.
+        """
+        models, training_models = load_models(model_paths, self.parameters, self.dataset, online=self.online,
+                                              shadow=self.shadow)
+        return self.server.sampler.clone(models, training_models)
+
+    def swap(self, sampler, model_paths):
+        """
+        Makes the server use a new sampler. Executed by the scheduler, between two batches.
+        :param NMTSampler sampler: New sampler.
+        :param list model_paths: Paths to the models of the sampler.
+        """
+        self.server.model_paths = model_paths
+        self.server.sampler = sampler
+        self.server.scheduler.sampler = sampler
+        if self.server.learner is not None:
+            self.server.learner.sampler = sampler
+
+
+def load_models(model_paths, parameters, dataset, online=False, shadow=True):
+    """
+    Loads the models of the server.
+    :param list model_paths: Paths to the models.
+    :param dict parameters: All hyperparameters of the model.
+    :param dataset: Dataset instance.
+    :param bool online: Whether the models are adapted with online learning.
+    :param bool shadow: With online learning, whether to load a second copy of the models, which is trained in the
+                        background.
+    :return: Tuple (serving models, training models). The training models are None if the serving models are
+             trained (or without online learning).
+    """
+    logger.info('Loading models from %s' % str(model_paths))
+    if online:
+        def build_online_models():
+            model_instances = [TranslationModel(parameters,
+                                                model_type=parameters['MODEL_TYPE'],
+                                                verbose=parameters['VERBOSE'],
+                                                model_name=parameters['MODEL_NAME'] + '_' + str(i),
+                                                vocabularies=dataset.vocabulary,
+                                                store_path=parameters['STORE_PATH'],
+                                                set_optimizer=False)
+                               for i in range(len(model_paths))]
+            return [updateModel(model, path, -1, full_path=True) for (model, path) in zip(model_instances, model_paths)]
+
+        models = build_online_models()
+        # Shadow copy of the models, trained in the background
+        training_models = build_online_models() if shadow else None
+    else:
+        models = [loadModel(m, -1, full_path=True) for m in model_paths]
+        training_models = None
+
+    for nmt_model in models + (training_models or []):
+        nmt_model.setParams(parameters)
+        nmt_model.setOptimizer()
+    return models, training_models
 
 
 def main():
     args = parse_args()
     server_address = (args.address, args.port)
-    httpd = HTTPServer(server_address, NMTHandler)
     logger.setLevel(args.logging_level)
     parameters = load_parameters()
     if args.config is not None:
@@ -491,9 +1738,9 @@ def main():
         params_prediction['coverage_penalty'] = False
 
     # Training parameters
+    model_load_start_time = time.time()
     parameters_training = dict()
     if args.online:
-        logger.info('Loading models from %s' % str(args.models))
         parameters_training = {  # Traning parameters
             'n_epochs': parameters['MAX_EPOCH'],
             'shuffle': False,
@@ -524,21 +1771,10 @@ def main():
                                              'd': parameters.get('D', 0.5)
                                              }
         }
-        model_instances = [TranslationModel(parameters,
-                                            model_type=parameters['MODEL_TYPE'],
-                                            verbose=parameters['VERBOSE'],
-                                            model_name=parameters['MODEL_NAME'] + '_' + str(i),
-                                            vocabularies=dataset.vocabulary,
-                                            store_path=parameters['STORE_PATH'],
-                                            set_optimizer=False)
-                           for i in range(len(args.models))]
-        models = [updateModel(model, path, -1, full_path=True) for (model, path) in zip(model_instances, args.models)]
-    else:
-        models = [loadModel(m, -1, full_path=True) for m in args.models]
 
-    for nmt_model in models:
-        nmt_model.setParams(parameters)
-        nmt_model.setOptimizer()
+    models, training_models = load_models(args.models, parameters, dataset, online=args.online,
+                                          shadow=not args.no_shadow)
+    metrics.set_gauge('model_load_seconds', 'Time spent loading the models.', time.time() - model_load_start_time)
 
     # Get word2index and index2word dictionaries
     index2word_y = dataset.vocabulary[parameters['OUTPUTS_IDS_DATASET'][0]]['idx2words']
@@ -551,9 +1787,44 @@ def main():
                                            tokenize_general, detokenize_general,
                                            mapping=mapping, word2index_x=word2index_x, word2index_y=word2index_y,
                                            index2word_y=index2word_y, eos_symbol=args.eos_symbol,
-                                           excluded_words=excluded_words, online=args.online, verbose=args.verbose)
+                                           excluded_words=excluded_words, online=args.online,
+                                           cache_size=args.cache_size, training_models=training_models,
+                                           result_cache_bytes=args.result_cache_size * 1024 * 1024,
+                                           verbose=args.verbose)
+
+    # Warm up before binding the port, so the first requests run at full speed
+    warmup_settings = {'lengths': args.warmup_lengths,
+                       'beam_sizes': args.warmup_beam_sizes,
+                       'prefix': not args.no_warmup_prefix,
+                       'batch_size': args.max_batch_size,
+                       'online': args.online}
+    interactive_beam_searcher.warmup(**warmup_settings)
 
+    httpd = ThreadedHTTPServer(server_address, NMTHandler)
     httpd.sampler = interactive_beam_searcher
+    httpd.scheduler = BatchScheduler(interactive_beam_searcher,
+                                     max_batch_size=args.max_batch_size,
+                                     max_wait=args.max_wait / 1000.,
+                                     max_queue_size=args.max_queue_size)
+    httpd.default_deadline_ms = args.deadline
+    httpd.retry_after = args.retry_after
+    if args.online:
+        httpd.learner = OnlineLearner(interactive_beam_searcher, httpd.scheduler,
+                                      batch_size=args.online_batch_size,
+                                      flush_interval=args.online_flush_interval,
+                                      snapshot_interval=args.snapshot_interval,
+                                      store_path=parameters['STORE_PATH'])
+        metrics.add_gauge('online_queue_depth', 'Number of post-edited samples waiting for online learning.',
+                          httpd.learner.queue.qsize)
+    else:
+        httpd.learner = None
+    metrics.add_gauge('queue_depth', 'Number of jobs waiting for the scheduler.', httpd.scheduler.queue.qsize)
+    metrics.add_gauge('cache_hit_ratio', 'Hit ratio of the caches of the sampler.',
+                      lambda: httpd.sampler.cache_hit_ratios())
+    httpd.reloader = ModelReloader(httpd, parameters, dataset, online=args.online, shadow=not args.no_shadow,
+                                   warmup_size=args.reload_warmup_size, warmup_settings=warmup_settings)
+    httpd.admin_token = args.admin_token
+    httpd.model_paths = args.models
 
     logger.info('Server starting at %s' % str(server_address))
     httpd.serve_forever()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict
+
+# Upper bounds (in seconds) of the buckets of the histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+
+class ServerMetrics:
+    """
+    In-process metrics of the server, rendered in the Prometheus text format:
+
+        * <namespace>_stage_duration_seconds: histogram of the duration of each processing stage.
+        * Counters (e.g. number of requests), incremented with increment.
+        * Gauges, either set with set_gauge or computed when rendering (add_gauge).
+
+    All the methods are thread-safe.
+    """
+
+    def __init__(self, namespace='nmt', buckets=DEFAULT_BUCKETS):
+        """
+        :param str namespace: Prefix of the names of the metrics.
+        :param tuple buckets: Upper bounds (in seconds) of the buckets of the stage histograms.
+        """
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # stage -> [count of each bucket (+Inf included), sum of the durations]
+        self.stages = OrderedDict()
+        # name -> (help, OrderedDict(labels -> value))
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+        # name -> (help, function returning a value or a list of (labels, value) tuples)
+        self.gauge_functions = OrderedDict()
+
+    def observe(self, stage, seconds):
+        """
+        Records the duration of a processing stage.
+        :param str stage: Name of the stage.
+        :param float seconds: Duration of the stage.
+        """
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = [[0] * (len(self.buckets) + 1), 0.]
+            bucket_counts, _ = self.stages[stage]
+            bucket = 0
+            while bucket < len(self.buckets) and seconds > self.buckets[bucket]:
+                bucket += 1
+            bucket_counts[bucket] += 1
+            self.stages[stage][1] += seconds
+
+    def increment(self, name, help_text, labels=None, value=1):
+        """
+        Increments a counter.
+        :param str name: Name of the counter (without namespace).
+        :param str help_text: Description of the counter.
+        :param dict labels: Labels of the counter.
+        :param value: Increment.
+        """
+        labels = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            values = self.counters.setdefault(name, (help_text, OrderedDict()))[1]
+            values[labels] = values.get(labels, 0) + value
+
+    def set_gauge(self, name, help_text, value, labels=None):
+        """
+        Sets the value of a gauge.
+        :param str name: Name of the gauge (without namespace).
+        :param str help_text: Description of the gauge.
+        :param value: Value of the gauge.
+        :param dict labels: Labels of the gauge.
+        """
+        labels = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            self.gauges.setdefault(name, (help_text, OrderedDict()))[1][labels] = value
+
+    def add_gauge(self, name, help_text, function):
+        """
+        Adds a gauge whose value is computed each time that the metrics are rendered.
+        :param str name: Name of the gauge (without namespace).
+        :param str help_text: Description of the gauge.
+        :param function: Function without arguments. It returns either the value of the gauge or a list of
+                         (labels, value) tuples, where labels is a dictionary.
+        """
+        with self.lock:
+            self.gauge_functions[name] = (help_text, function)
+
+    def render(self):
+        """
+        Renders the metrics in the Prometheus text format (version 0.0.4).
+        :return: String with the metrics.
+        """
+        lines = []
+        with self.lock:
+            name = self.namespace + '_stage_duration_seconds'
+            if self.stages:
+                lines.append('# HELP %s Duration of each processing stage.' % name)
+                lines.append('# TYPE %s histogram' % name)
+            for stage, (bucket_counts, total) in self.stages.items():
+                cumulative_count = 0
+                for upper_bound, count in zip(self.buckets + (float('inf'),), bucket_counts):
+                    cumulative_count += count
+                    le = '+Inf' if upper_bound == float('inf') else '%g' % upper_bound
+                    lines.append('%s_bucket%s %d' % (name, _format_labels((('stage', stage), ('le', le))),
+                                                     cumulative_count))
+                lines.append('%s_sum%s %.6f' % (name, _format_labels((('stage', stage),)), total))
+                lines.append('%s_count%s %d' % (name, _format_labels((('stage', stage),)), cumulative_count))
+            for metric_type, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, (help_text, values) in metrics.items():
+                    lines.append('# HELP %s_%s %s' % (self.namespace, name, help_text))
+                    lines.append('# TYPE %s_%s %s' % (self.namespace, name, metric_type))
+                    for labels, value in values.items():
+                        lines.append('%s_%s%s %s' % (self.namespace, name, _format_labels(labels), repr(float(value))))
+            gauge_functions = list(self.gauge_functions.items())
+        for name, (help_text, function) in gauge_functions:
+            values = function()
+            if not isinstance(values, list):
+                values = [({}, values)]
+            lines.append('# HELP %s_%s %s' % (self.namespace, name, help_text))
+            lines.append('# TYPE %s_%s gauge' % (self.namespace, name))
+            for labels, value in values:
+                lines.append('%s_%s%s %s' % (self.namespace, name, _format_labels(tuple(sorted(labels.items()))),
+                                             repr(float(value))))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import bisect
+
+import numpy as np
+
+
+class VocabularyPrefixIndex:
+    """
+    Index of the words of a vocabulary (including BPE subword units) by prefix. Words are sorted, so the words
+    starting with a given prefix are a contiguous range, which is found by binary search. Lookups cost
+    O(log(V) + number of matches), instead of scanning the whole vocabulary.
+    """
+
+    def __init__(self, word2index):
+        """
+        :param dict word2index: Mapping from word strings into indices.
+        """
+        self.words = sorted(word2index)
+        self.indices = np.asarray([word2index[word] for word in self.words], dtype='int64')
+
+    def _range(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        # All the words starting with prefix are smaller than prefix followed by the largest code point
+        end = bisect.bisect_left(self.words, prefix + u'\U0010ffff', lo=start)
+        return start, end
+
+    def indices_with_prefix(self, prefix):
+        """
+        Indices of the words starting with a prefix, e.g. for masking the output probabilities.
+        :param prefix: Prefix of the words.
+        :return: Numpy array of word indices (a view: it must not be modified).
+        """
+        start, end = self._range(prefix)
+        return self.indices[start:end]
+
+    def idx2word_with_prefix(self, prefix):
+        """
+        Words starting with a prefix, as required by the valid_next_words option of the interactive search.
+        :param prefix: Prefix of the words.
+        :return: Dictionary mapping the indices of the words starting with prefix into the words.
+        """
+        start, end = self._range(prefix)
+        return dict(zip(self.indices[start:end].tolist(), self.words[start:end]))
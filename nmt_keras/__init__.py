@@ -50,6 +50,35 @@ def check_params(params):
                 'Unknown words replacement requires to use the optimized search ("OPTIMIZED_SEARCH" parameter). Setting "POS_UNK" to False.')
             params['POS_UNK'] = False
 
+    if params.get('INCREMENTAL_DECODING', False):
+        if params['MODEL_TYPE'].lower() != 'transformer':
+            logger.warn('Incremental decoding ("INCREMENTAL_DECODING" parameter) is only implemented for the "Transformer" model. Setting it to False.')
+            params['INCREMENTAL_DECODING'] = False
+        elif not params['OPTIMIZED_SEARCH']:
+            logger.warn('Incremental decoding requires to use the optimized search ("OPTIMIZED_SEARCH" parameter). Setting "INCREMENTAL_DECODING" to False.')
+            params['INCREMENTAL_DECODING'] = False
+
+    if params.get('FOLD_EMBEDDING_PROJECTIONS', False):
+        if params['MODEL_TYPE'] != 'AttentionRNNEncoderDecoder':
+            logger.warn('Folding the embedding projections ("FOLD_EMBEDDING_PROJECTIONS" parameter) is only implemented for the "AttentionRNNEncoderDecoder" model. Setting it to False.')
+            params['FOLD_EMBEDDING_PROJECTIONS'] = False
+        elif not params['OPTIMIZED_SEARCH']:
+            logger.warn('Folding the embedding projections requires to use the optimized search ("OPTIMIZED_SEARCH" parameter). Setting "FOLD_EMBEDDING_PROJECTIONS" to False.')
+            params['FOLD_EMBEDDING_PROJECTIONS'] = False
+
+    if params.get('SEARCH_BATCH_SIZE', 1) > 1:
+        if not params['OPTIMIZED_SEARCH'] or not params['PAD_ON_BATCH']:
+            logger.warn('Decoding several sentences at once ("SEARCH_BATCH_SIZE" parameter) requires to use the optimized search ("OPTIMIZED_SEARCH") and "PAD_ON_BATCH". Setting "SEARCH_BATCH_SIZE" to 1.')
+            params['SEARCH_BATCH_SIZE'] = 1
+
+    if params.get('VOCABULARY_SHORTLIST', False):
+        if not params['OPTIMIZED_SEARCH']:
+            logger.warn('The vocabulary shortlist requires to use the optimized search ("OPTIMIZED_SEARCH" parameter). Setting "VOCABULARY_SHORTLIST" to False.')
+            params['VOCABULARY_SHORTLIST'] = False
+        elif params.get('SHORTLIST_SIZE', 2000) < params['BEAM_SIZE']:
+            logger.warn('"SHORTLIST_SIZE" cannot be smaller than "BEAM_SIZE". Setting it to %d.' % params['BEAM_SIZE'])
+            params['SHORTLIST_SIZE'] = params['BEAM_SIZE']
+
     if params['COVERAGE_PENALTY']:
         assert params['OPTIMIZED_SEARCH'], 'The application of "COVERAGE_PENALTY" requires ' \
                                            'to use the optimized search ("OPTIMIZED_SEARCH" parameter).'
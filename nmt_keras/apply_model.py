@@ -5,7 +5,15 @@ try:
     import itertools.imap as map
 except ImportError:
     pass
+import codecs
+import copy
 import logging
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
 from keras_wrapper.extra.read_write import list2file, nbest2file, list2stdout, numpy2file, pkl2dict
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
@@ -19,7 +27,7 @@ def sample_ensemble(args, params):
     :param argparse.Namespace args: Arguments given to the method:
 
                       * dataset: Dataset instance with data.
-                      * text: Text file with source sentences.
+                      * text: Text file with source sentences ('-' for reading from STDIN in streaming mode).
                       * splits: Splits to sample. Should be already included in the dataset object.
                       * dest: Output file to save scores.
                       * weights: Weight given to each model in the ensemble. You should provide the same number of weights than models. By default, it applies the same weight to each model (1/N).
@@ -27,6 +35,9 @@ def sample_ensemble(args, params):
                       * config: Config .pkl for loading the model configuration. If not specified, hyperparameters are read from config.py.
                       * models: Path to the models.
                       * verbose: Be verbose or not.
+                      * stream: Streaming mode: translate the text in chunks and output each chunk as it is finished.
+                      * chunk_size: Number of sentences per chunk in streaming mode.
+                      * first_index: Index of the first sentence of the text, used in the n-best lists (0 by default).
 
     :param params: parameters of the translation model.
     """
@@ -35,11 +46,19 @@ def sample_ensemble(args, params):
     from keras_wrapper.cnn_model import loadModel
     from keras_wrapper.dataset import loadDataset
     from keras_wrapper.utils import decode_predictions_beam_search
+    from nmt_keras.search import BatchedBeamSearchEnsemble, ShortlistBeamSearchEnsemble, VocabularyShortlist
+    from nmt_keras.translation_cache import TranslationCache, translation_fingerprint
+    from utils.utils import read_chunks
 
     logger.info("Using an ensemble of %d models" % len(args.models))
     models = [loadModel(m, -1, full_path=True) for m in args.models]
+    if params.get('INCREMENTAL_DECODING', False):
+        for model in models:
+            model.setIncrementalDecoding()
+    if params.get('FOLD_EMBEDDING_PROJECTIONS', False):
+        for model in models:
+            model.setFoldedEmbeddingProjections()
     dataset = loadDataset(args.dataset)
-    dataset = update_dataset_from_file(dataset, args.text, params, splits=args.splits, remove_outputs=True)
 
     params['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['INPUTS_IDS_DATASET'][0]]
     params['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['OUTPUTS_IDS_DATASET'][0]]
@@ -75,6 +94,9 @@ def sample_ensemble(args, params):
     params_prediction['output_min_length_depending_on_x_factor'] = params.get('MINLEN_GIVEN_X_FACTOR', 2)
     params_prediction['attend_on_output'] = params.get('ATTEND_ON_OUTPUT',
                                                        'transformer' in params['MODEL_TYPE'].lower())
+    if params.get('INCREMENTAL_DECODING', False):
+        # The incremental model_next only takes the last generated word
+        params_prediction['attend_on_output'] = False
     params_prediction['glossary'] = params.get('GLOSSARY', None)
 
     heuristic = params.get('HEURISTIC', 0)
@@ -88,6 +110,25 @@ def sample_ensemble(args, params):
     else:
         glossary = None
 
+    shortlist = None
+    if params.get('VOCABULARY_SHORTLIST', False):
+        if params.get('SHORTLIST_SIZE', 2000) < params['OUTPUT_VOCABULARY_SIZE']:
+            if params.get('MAPPING') is not None and os.path.isfile(params['MAPPING']):
+                shortlist_mapping = pkl2dict(params['MAPPING'])
+            else:
+                shortlist_mapping = mapping
+            shortlist = VocabularyShortlist(dataset,
+                                            params['INPUTS_IDS_DATASET'][0],
+                                            params['OUTPUTS_IDS_DATASET'][0],
+                                            params.get('SHORTLIST_SIZE', 2000),
+                                            mapping=shortlist_mapping,
+                                            glossary=glossary,
+                                            n_translations=params.get('SHORTLIST_TRANSLATIONS', 10))
+            for model in models:
+                model.setVocabularyShortlist(shortlist.size)
+        else:
+            logger.info('The output vocabulary is not larger than "SHORTLIST_SIZE". Using the whole vocabulary.')
+
     if model_weights:
         assert len(model_weights) == len(
             models), 'You should give a weight to each model. You gave %d models and %d weights.' % (
@@ -96,25 +137,43 @@ def sample_ensemble(args, params):
         if len(model_weights) > 1:
             logger.info('Giving the following weights to each model: %s' % str(model_weights))
 
-    for s in args.splits:
-        # Apply model predictions
-        params_prediction['predict_on_sets'] = [s]
-        beam_searcher = BeamSearchEnsemble(models,
-                                           dataset,
-                                           params_prediction,
-                                           model_weights=model_weights,
-                                           n_best=args.n_best,
-                                           verbose=args.verbose)
-        predictions = beam_searcher.predictBeamSearchNet()[s]
+    def translate(split, sources=None, first_index=0):
+        """
+        Decodes the (already loaded) split of the dataset.
+        :param split: Split to decode
+        :param sources: Source sentences, required for unknown words replacement
+        :param first_index: Index of the first sentence of the split in the whole input (for the n-best lists)
+        :return: Decoded predictions and n-best lists (None if args.n_best is False)
+        """
+        params_prediction['predict_on_sets'] = [split]
+        if params.get('SEARCH_BATCH_SIZE', 1) > 1 and params_prediction['optimized_search']:
+            beam_searcher = BatchedBeamSearchEnsemble(models,
+                                                      dataset,
+                                                      params_prediction,
+                                                      model_weights=model_weights,
+                                                      n_best=args.n_best,
+                                                      verbose=args.verbose,
+                                                      batch_size=params['SEARCH_BATCH_SIZE'],
+                                                      shortlist=shortlist)
+        elif shortlist is not None:
+            beam_searcher = ShortlistBeamSearchEnsemble(models,
+                                                        dataset,
+                                                        params_prediction,
+                                                        model_weights=model_weights,
+                                                        n_best=args.n_best,
+                                                        verbose=args.verbose,
+                                                        shortlist=shortlist)
+        else:
+            beam_searcher = BeamSearchEnsemble(models,
+                                               dataset,
+                                               params_prediction,
+                                               model_weights=model_weights,
+                                               n_best=args.n_best,
+                                               verbose=args.verbose)
+        predictions = beam_searcher.predictBeamSearchNet()[split]
         samples = predictions['samples']
         alphas = predictions['alphas'] if params_prediction['pos_unk'] else None
 
-        if params_prediction['pos_unk']:
-            sources = [x.strip() for x in open(args.text, 'r').read().split('\n')]
-            sources = sources[:-1] if len(sources[-1]) == 0 else sources
-        else:
-            sources = None
-
         decoded_predictions = decode_predictions_beam_search(samples,
                                                              index2word_y,
                                                              glossary=glossary,
@@ -127,6 +186,7 @@ def sample_ensemble(args, params):
         if params.get('APPLY_DETOKENIZATION', False):
             decoded_predictions = list(map(detokenize_function, decoded_predictions))
 
+        n_best_predictions = None
         if args.n_best:
             n_best_predictions = []
             for i, (n_best_preds, n_best_scores, n_best_alphas) in enumerate(predictions['n_best']):
@@ -145,25 +205,262 @@ def sample_ensemble(args, params):
                     if params.get('APPLY_DETOKENIZATION', False):
                         pred = list(map(detokenize_function, pred))
 
-                    n_best_sample_score.append([i, pred, n_best_score])
+                    n_best_sample_score.append([first_index + i, pred, n_best_score])
                 n_best_predictions.append(n_best_sample_score)
+        return decoded_predictions, n_best_predictions
+
+    translation_cache = None
+    if params.get('TRANSLATION_CACHE') is not None:
+        fingerprint = translation_fingerprint(args.models, model_weights, params_prediction, params, glossary=glossary,
+                                              dataset_path=args.dataset)
+        translation_cache = TranslationCache(params['TRANSLATION_CACHE'],
+                                             fingerprint,
+                                             max_size=params.get('TRANSLATION_CACHE_SIZE', 100000))
+        logger.info('Using the translation cache from %s (%d entries)' % (params['TRANSLATION_CACHE'],
+                                                                         translation_cache.size))
+        # Cache keys are computed from the tokenized sentences
+        tokenization = params.get('TOKENIZATION_METHOD', 'tokenize_none')
+        if 'bpe' in tokenization.lower():
+            dataset.build_bpe(params.get('BPE_CODES_PATH', None))
+        tokenize_function = eval('dataset.' + tokenization)
+
+    def translate_sentences(split, sentences, first_index=0):
+        """
+        Translates a list of source sentences. If the translation cache is active, only the sentences missing from
+        the cache are decoded.
+        :param split: Split of the dataset in which the sentences are loaded
+        :param sentences: Source sentences
+        :param first_index: Index of the first sentence in the whole input (for the n-best lists)
+        :return: Decoded predictions and n-best lists (None if args.n_best is False)
+        """
+        if translation_cache is None:
+            update_dataset_from_file(dataset, sentences, params, splits=[split], remove_outputs=True)
+            sources = [x.strip() for x in sentences] if params_prediction['pos_unk'] else None
+            return translate(split, sources=sources, first_index=first_index)
+
+        keys = [translation_cache.key(tokenize_function(sentence)) for sentence in sentences]
+        entries = [translation_cache.get(key) for key in keys]
+        # Entries stored without n-best lists are not valid if we need them
+        misses = [i for i, entry in enumerate(entries) if entry is None or (args.n_best and entry['n_best'] is None)]
+        if misses:
+            miss_sentences = [sentences[i] for i in misses]
+            update_dataset_from_file(dataset, miss_sentences, params, splits=[split], remove_outputs=True)
+            sources = [x.strip() for x in miss_sentences] if params_prediction['pos_unk'] else None
+            miss_predictions, miss_n_best = translate(split, sources=sources)
+            for j, i in enumerate(misses):
+                entries[i] = {'translation': miss_predictions[j],
+                              'n_best': [(pred, score) for _, pred, score in miss_n_best[j]] if args.n_best else None}
+                translation_cache.set(keys[i], entries[i])
+
+        decoded_predictions = [entry['translation'] for entry in entries]
+        n_best_predictions = None
+        if args.n_best:
+            n_best_predictions = [[[first_index + i, pred, score] for pred, score in entry['n_best']]
+                                  for i, entry in enumerate(entries)]
+        return decoded_predictions, n_best_predictions
+
+    if args.dest is not None and not params.get('SAMPLING_SAVE_MODE', 'list'):
+        raise Exception('Only "list" is allowed in "SAMPLING_SAVE_MODE"')
+
+    if getattr(args, 'stream', False):
+        # Streaming mode: read the input in chunks, decode them and flush the translations as soon as each chunk
+        # is finished. Only one chunk is kept in memory at a time.
+        s = args.splits[0]
+        chunk_size = getattr(args, 'chunk_size', 100)
+        nbest_filepath = args.dest + '.nbest' if args.dest is not None else './' + s + '.nbest'
+        if args.n_best:
+            logger.info('Storing n-best sentences in ' + nbest_filepath)
+        input_file = sys.stdin if args.text == '-' else codecs.open(args.text, 'r', encoding='utf-8')
+        n_processed = 0
+        try:
+            for chunk in read_chunks(input_file, chunk_size):
+                decoded_predictions, n_best_predictions = translate_sentences(s, chunk, first_index=n_processed)
+                permission = 'w' if n_processed == 0 else 'a'
+                if args.dest is not None:
+                    list2file(args.dest, decoded_predictions, permission=permission)
+                else:
+                    list2stdout(decoded_predictions)
+                    sys.stdout.flush()
+                if args.n_best:
+                    # nbest2file does not end the file with a newline
+                    nbest2file(nbest_filepath, n_best_predictions, permission=permission)
+                    with open(nbest_filepath, 'a') as nbest_file:
+                        nbest_file.write('\n')
+                n_processed += len(chunk)
+                logger.info('Translated %d sentences' % n_processed)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+        if translation_cache is not None:
+            logger.info('Translation cache: %d hits, %d misses' % (translation_cache.hits, translation_cache.misses))
+        logger.info('Sampling finished')
+        return
+
+    first_index = getattr(args, 'first_index', 0)
+    if translation_cache is None:
+        dataset = update_dataset_from_file(dataset, args.text, params, splits=args.splits, remove_outputs=True)
+    else:
+        with codecs.open(args.text, 'r', encoding='utf-8') as input_file:
+            sentences = [line.rstrip('\n') for line in input_file]
+    for s in args.splits:
+        # Apply model predictions
+        if translation_cache is not None:
+            decoded_predictions, n_best_predictions = translate_sentences(s, sentences, first_index=first_index)
+        else:
+            if params_prediction['pos_unk']:
+                sources = [x.strip() for x in open(args.text, 'r').read().split('\n')]
+                sources = sources[:-1] if len(sources[-1]) == 0 else sources
+            else:
+                sources = None
+            decoded_predictions, n_best_predictions = translate(s, sources=sources, first_index=first_index)
+
         # Store result
         if args.dest is not None:
             filepath = args.dest  # results file
-            if params.get('SAMPLING_SAVE_MODE', 'list'):
-                list2file(filepath, decoded_predictions)
-                if args.n_best:
-                    nbest2file(filepath + '.nbest', n_best_predictions)
-            else:
-                raise Exception('Only "list" is allowed in "SAMPLING_SAVE_MODE"')
+            list2file(filepath, decoded_predictions)
+            if args.n_best:
+                nbest2file(filepath + '.nbest', n_best_predictions)
         else:
             list2stdout(decoded_predictions)
             if args.n_best:
                 logger.info('Storing n-best sentences in ./' + s + '.nbest')
                 nbest2file('./' + s + '.nbest', n_best_predictions)
+        if translation_cache is not None:
+            logger.info('Translation cache: %d hits, %d misses' % (translation_cache.hits, translation_cache.misses))
         logger.info('Sampling finished')
 
 
+# Environment variables with the number of threads of the BLAS/OpenMP libraries. They are read when the libraries are
+# loaded, so they must be set before starting the worker processes
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def _sample_shard(args, params, cpus):
+    """
+    Worker of sample_ensemble_parallel. Pins the process to the given CPUs, limits the number of threads used by
+    the backend accordingly and translates its shard of the text.
+
+    :param argparse.Namespace args: Arguments for sample_ensemble.
+    :param params: parameters of the translation model.
+    :param list cpus: CPUs assigned to this worker.
+    """
+    n_threads = len(cpus)
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    from keras import backend as K
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=n_threads,
+                                                       inter_op_parallelism_threads=1)))
+    sample_ensemble(args, params)
+
+
+def _shard_bounds(n_sentences, n_workers):
+    """
+    Splits a text into contiguous shards of (almost) the same size.
+
+    :param int n_sentences: Number of sentences of the text.
+    :param int n_workers: Maximum number of shards.
+    :return: List with the (first, last + 1) sentence of each shard. There are no empty shards.
+    """
+    n_workers = max(1, min(n_workers, n_sentences))
+    shard_size = max(1, int(math.ceil(n_sentences / float(n_workers))))
+    return [(first, min(first + shard_size, n_sentences)) for first in range(0, n_sentences, shard_size)] or [(0, 0)]
+
+
+def _merge_shards(shard_args_list, n_best=False):
+    """
+    Merges the outputs of the workers of sample_ensemble_parallel, in the order of the shards.
+
+    :param list shard_args_list: Arguments of the workers (the outputs are in shard_args.dest).
+    :param bool n_best: Whether to merge the n-best lists (in shard_args.dest + '.nbest').
+    :return: Tuple (hypotheses, n-best lists of each shard).
+    """
+    decoded_predictions = []
+    n_best_shards = []
+    for shard_args in shard_args_list:
+        with codecs.open(shard_args.dest, 'r', encoding='utf-8') as shard_file:
+            decoded_predictions += [line.rstrip('\n') for line in shard_file]
+        if n_best:
+            with codecs.open(shard_args.dest + '.nbest', 'r', encoding='utf-8') as shard_file:
+                n_best_shards.append(shard_file.read().rstrip('\n'))
+    return decoded_predictions, n_best_shards
+
+
+def sample_ensemble_parallel(args, params):
+    """
+    Splits the source text into args.workers contiguous shards and translates them in parallel with sample_ensemble.
+    Each worker is a process which loads the models once and runs on its own subset of the CPUs. The outputs of the
+    workers are then merged, keeping the order of the source text.
+
+    The models (and Keras) must not be loaded in the calling process before this function.
+
+    :param argparse.Namespace args: Arguments given to sample_ensemble, plus:
+
+                      * workers: Number of worker processes.
+
+    :param params: parameters of the translation model.
+    """
+    with codecs.open(args.text, 'r', encoding='utf-8') as input_file:
+        sentences = [line.rstrip('\n') for line in input_file]
+    shards = _shard_bounds(len(sentences), args.workers)
+    n_workers = len(shards)
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(multiprocessing.cpu_count()))
+    cpus_per_worker = max(1, len(cpus) // n_workers)
+    logger.info('Translating %d sentences with %d workers (%d CPUs each)' % (len(sentences), n_workers,
+                                                                              cpus_per_worker))
+    # The workers are new interpreters (not forks), which inherit the environment when started: the thread limits
+    # are set before they load any library
+    context = multiprocessing.get_context('spawn')
+    environ = dict(os.environ)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        workers = []
+        shard_args_list = []
+        for variable in THREAD_VARIABLES:
+            os.environ[variable] = str(cpus_per_worker)
+        for i, (first_sentence, last_sentence) in enumerate(shards):
+            shard_args = copy.copy(args)
+            shard_args.text = os.path.join(tmp_dir, 'shard_%d' % i)
+            shard_args.dest = shard_args.text + '.hyp'
+            shard_args.first_index = first_sentence
+            shard_args.stream = False
+            shard_args.workers = 1
+            list2file(shard_args.text, sentences[first_sentence:last_sentence])
+            first_cpu = (i * cpus_per_worker) % len(cpus)
+            worker = context.Process(target=_sample_shard,
+                                     args=(shard_args, params, cpus[first_cpu:first_cpu + cpus_per_worker]))
+            worker.start()
+            workers.append(worker)
+            shard_args_list.append(shard_args)
+        for worker in workers:
+            worker.join()
+        failed_workers = [i for i, worker in enumerate(workers) if worker.exitcode != 0]
+        if failed_workers:
+            raise Exception('The following workers failed: %s' % str(failed_workers))
+
+        decoded_predictions, n_best_shards = _merge_shards(shard_args_list, n_best=args.n_best)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmp_dir)
+
+    if args.dest is not None:
+        list2file(args.dest, decoded_predictions)
+        nbest_filepath = args.dest + '.nbest'
+    else:
+        list2stdout(decoded_predictions)
+        nbest_filepath = './' + args.splits[-1] + '.nbest'
+    if args.n_best:
+        logger.info('Storing n-best sentences in ' + nbest_filepath)
+        with codecs.open(nbest_filepath, 'w', encoding='utf-8') as nbest_file:
+            nbest_file.write(u'\n'.join(n_best_shards))
+    logger.info('Sampling finished')
+
+
 def score_corpus(args, params):
     """
     Use one or several translation models for scoring source--target pairs-
@@ -179,6 +476,7 @@ def score_corpus(args, params):
                                 * verbose: Be verbose or not.
                                 * config: Config .pkl for loading the model configuration. If not specified, hyperparameters are read from config.py.
                                 * models: Path to the models.
+                                * word_scores: Also store the score of each target word (in dest + '.words').
     :param dict params: parameters of the translation model.
     """
 
@@ -186,6 +484,7 @@ def score_corpus(args, params):
     from keras_wrapper.dataset import loadDataset
     from keras_wrapper.cnn_model import loadModel
     from keras_wrapper.model_ensemble import BeamSearchEnsemble
+    from nmt_keras.scoring import TeacherForcingScorer
 
     logger.info("Using an ensemble of %d models" % len(args.models))
     models = [loadModel(m, -1, full_path=True) for m in args.models]
@@ -212,13 +511,15 @@ def score_corpus(args, params):
         if len(model_weights) > 1:
             logger.info('Giving the following weights to each model: %s' % str(model_weights))
 
+    word_scores = getattr(args, 'word_scores', False)
     for s in args.splits:
         # Apply model predictions
         params_prediction = {'max_batch_size': params['BATCH_SIZE'],
                              'n_parallel_loaders': params['PARALLEL_LOADERS'],
                              'predict_on_sets': [s]}
 
-        if params['BEAM_SEARCH']:
+        if params['BEAM_SEARCH'] and params.get('COVERAGE_PENALTY', False):
+            # The coverage penalty requires the attention weights, only available from the sampling models
             params_prediction['beam_size'] = params['BEAM_SIZE']
             params_prediction['maxlen'] = params['MAX_OUTPUT_TEXT_LEN_TEST']
             params_prediction['optimized_search'] = params['OPTIMIZED_SEARCH']
@@ -247,15 +548,42 @@ def score_corpus(args, params):
                                                model_weights=model_weights,
                                                verbose=args.verbose)
             scores = beam_searcher.scoreNet()[s]
+            chunks = [(scores, None)]
+        else:
+            # Teacher forcing: a single forward pass of the training model per batch of pairs
+            params_prediction['max_batch_size'] = params.get('SCORING_BATCH_SIZE', params['BATCH_SIZE'])
+            params_prediction['dataset_inputs'] = params['INPUTS_IDS_DATASET']
+            params_prediction['dataset_outputs'] = params['OUTPUTS_IDS_DATASET']
+            params_prediction['normalize_probs'] = params.get('NORMALIZE_SAMPLING', False)
+            params_prediction['alpha_factor'] = params.get('ALPHA_FACTOR', 1.0)
+            params_prediction['length_penalty'] = params.get('LENGTH_PENALTY', False)
+            params_prediction['length_norm_factor'] = params.get('LENGTH_NORM_FACTOR', 0.0)
+            params_prediction['word_scores'] = word_scores
+            scorer = TeacherForcingScorer(models,
+                                          dataset,
+                                          params_prediction,
+                                          model_weights=model_weights,
+                                          verbose=args.verbose)
+            chunks = scorer.score_generator(s)
 
-        # Store result
-        if args.dest is not None:
-            filepath = args.dest  # results file
-            if params['SAMPLING_SAVE_MODE'] == 'list':
-                list2file(filepath, scores)
-            elif params['SAMPLING_SAVE_MODE'] == 'numpy':
-                numpy2file(filepath, scores)
+        # Store result (as soon as each chunk of pairs is scored)
+        if args.dest is not None and params['SAMPLING_SAVE_MODE'] not in ['list', 'numpy']:
+            raise Exception('The sampling mode ' + params['SAMPLING_SAVE_MODE'] + ' is not currently supported.')
+        all_scores = []
+        for n_chunk, (scores, chunk_word_scores) in enumerate(chunks):
+            permission = 'w' if n_chunk == 0 else 'a'
+            if args.dest is not None:
+                filepath = args.dest  # results file
+                if params['SAMPLING_SAVE_MODE'] == 'list':
+                    list2file(filepath, scores, permission=permission)
+                else:
+                    all_scores += list(scores)
+                if chunk_word_scores is not None:
+                    list2file(filepath + '.words',
+                              [' '.join(['%f' % word_score for word_score in sentence_word_scores])
+                               for sentence_word_scores in chunk_word_scores],
+                              permission=permission)
             else:
-                raise Exception('The sampling mode ' + params['SAMPLING_SAVE_MODE'] + ' is not currently supported.')
-        else:
-            print(scores)
+                list2stdout(scores)
+        if args.dest is not None and params['SAMPLING_SAVE_MODE'] == 'numpy':
+            numpy2file(args.dest, all_scores)
@@ -428,6 +428,293 @@ class TranslationModel(Model_Wrapper):
 
         return obj_str
 
+    # ------------------------------------------------------- #
+    #       DECODING OPTIMIZATIONS
+    # ------------------------------------------------------- #
+
+    def setIncrementalDecoding(self):
+        """
+        Rebuilds the sampling models (model_init and model_next) of a Transformer for incremental decoding.
+
+        The original model_next runs every decoder block over the whole prefix at each timestep. Instead, model_init
+        returns, for each decoder block, the input of its self-attention layer (the cache), and model_next only
+        processes the newest word: its query attends to the cache extended with the current position and the
+        extended caches are returned as states. These states are linked through matchings_init_to_next and
+        matchings_next_to_next, so the beam search reorders them along with the hypotheses. The Keras mask of each
+        cache (e.g. the start position, whose word index is 0, is masked by the target embedding) is cached as
+        another state and applied again to the extended cache, so the query ignores the same positions as in the
+        original model_next.
+
+        The multi-head attention layers project their keys and values internally, hence the caches store the block
+        inputs rather than the projected keys and values. For the same reason, the encoder-decoder attention layers
+        still project the encoder output (preprocessed_input) at each timestep: precomputing their keys and values
+        in model_init would require splitting MultiHeadAttention into its projection and attention steps. The
+        rebuilt models reuse the layers (and weights) of the training model. Since model_next only takes the last
+        generated word, the search must be applied with 'attend_on_output' = False.
+
+        :return: None
+        """
+        params = self.params
+        if 'transformer' not in params['MODEL_TYPE'].lower():
+            raise Exception('Incremental decoding is only implemented for the "Transformer" model.')
+        if getattr(self, 'incremental_decoding', False):
+            return
+
+        if self.verbose > 0:
+            logger.info("<<< Building incremental sampling models >>>")
+
+        layers = dict([(layer.name, layer) for layer in self.model.layers])
+        n_blocks = params['N_LAYERS_DECODER']
+        if params.get('TIE_EMBEDDINGS', False):
+            trg_embedding = layers['source_word_embedding']
+        else:
+            trg_embedding = layers['target_word_embedding']
+        positional_embedding_trg = layers.get('positional_trg_word_embedding',
+                                              layers.get('positional_src_word_embedding'))
+
+        def embed_words(words, positions):
+            state_below = trg_embedding(words)
+            if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
+                state_below = SqrtScaling(params['MODEL_SIZE'])(state_below)
+            return Add()([state_below, positional_embedding_trg(positions)])
+
+        def unmasked_future_copy(layer):
+            # Copy of a self-attention layer without mask_future, which shares the weights of the original layer
+            config = layer.get_config()
+            config.update(mask_future=False, name=layer.name + '_incremental')
+            layer_copy = layer.__class__.from_config(config)
+            layer_copy.build(layer.get_input_shape_at(0))
+            shared_weights = dict([(id(copy_weight), weight) for copy_weight, weight in zip(layer_copy.weights,
+                                                                                               layer.weights)])
+            for attribute, value in list(layer_copy.__dict__.items()):
+                if id(value) in shared_weights:
+                    setattr(layer_copy, attribute, shared_weights[id(value)])
+                elif isinstance(value, list):
+                    value[:] = [shared_weights.get(id(item), item) for item in value]
+            return layer_copy
+
+        # Keras mask of a tensor as a float tensor (ones if it has no mask)
+        get_mask = Lambda(lambda x, mask=None: K.cast(mask, 'float32') if mask is not None else K.ones_like(x[:, :, 0]),
+                          output_shape=lambda s: s[:2],
+                          mask=lambda inputs, mask: None)
+        # Tensor (first input) with the mask given by a float tensor (second input)
+        set_mask = Lambda(lambda x: x[0],
+                          output_shape=lambda s: s[0],
+                          mask=lambda inputs, mask: K.cast(inputs[1], 'bool'))
+
+        def apply_decoder(state_below, memory, caches=None, cache_masks=None):
+            # Dropout layers are skipped: they are the identity at inference time.
+            next_caches = []
+            next_cache_masks = []
+            for n_block in range(n_blocks):
+                block = str(n_block)
+                trg_multihead_layer = layers['trg_MultiHeadAttention_' + block]
+                if caches is None:
+                    keys = state_below
+                    keys_mask = get_mask(state_below)
+                    trg_multihead = trg_multihead_layer([state_below, keys])
+                else:
+                    keys = Concatenate(axis=1)([caches[n_block], state_below])
+                    keys_mask = Concatenate(axis=1)([cache_masks[n_block], get_mask(state_below)])
+                    keys = set_mask([keys, keys_mask])
+                    # The query is the newest position, which can attend to every cached position
+                    trg_multihead = unmasked_future_copy(trg_multihead_layer)([state_below, keys])
+                next_caches.append(keys)
+                next_cache_masks.append(keys_mask)
+                trg_multihead_add = layers['trg_Residual_MultiHeadAttention_' + block]([state_below, trg_multihead])
+                trg_multihead_norm = layers['trg_Normalization_MultiHeadAttention_' + block](trg_multihead_add)
+                src_trg_multihead = layers['src_trg_MultiHeadAttention_' + block]([trg_multihead_norm, memory])
+                src_trg_multihead_add = layers['src_trg_Residual_MultiHeadAttention_' + block]([src_trg_multihead,
+                                                                                                trg_multihead_norm])
+                src_trg_multihead_norm = layers['src_trg_Normalization_MultiHeadAttention_' + block](src_trg_multihead_add)
+                ff_src_trg_multihead = layers['src_trg_TimeDistributedPositionwiseFeedForward_' + block](src_trg_multihead_norm)
+                ff_src_trg_multihead_add = layers['src_trg_Residual_FF_' + block]([ff_src_trg_multihead,
+                                                                                   src_trg_multihead_norm])
+                state_below = layers['src_trg_Normalization_FF_' + block](ff_src_trg_multihead_add)
+
+            out_layer = state_below
+            for i, (activation, dimension) in enumerate(params['DEEP_OUTPUT_LAYERS']):
+                out_layer = layers[activation + '_%d' % i](out_layer)
+                reg_name = 'out_layer_' + str(activation) + '_%d' % i
+                for suffix in ['_gaussian_noise', '_batch_normalization', '_PReLU', '_dropout', '_L1_norm', '_L2_norm']:
+                    if reg_name + suffix in layers:
+                        out_layer = layers[reg_name + suffix](out_layer)
+            softout = layers[self.ids_outputs[0]](out_layer)
+            return softout, next_caches, next_cache_masks
+
+        ids_caches = [str(n_block) for n_block in range(n_blocks)]
+
+        # model_init: encodes the source and processes the first word
+        src_text, next_words = self.model.inputs
+        # Keys and values given to the first encoder-decoder attention layer are the encoder output
+        masked_src_multihead = layers['src_trg_MultiHeadAttention_0'].get_input_at(0)[1]
+        next_words_positions = layers['position_layer_next_words'](next_words)
+        softout, caches, cache_masks = apply_decoder(embed_words(next_words, next_words_positions),
+                                                     masked_src_multihead)
+        self.model_init = Model(inputs=[src_text, next_words],
+                                outputs=[softout, masked_src_multihead] + caches + cache_masks,
+                                name=self.name + '_model_init')
+        self.ids_inputs_init = self.ids_inputs
+        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input'] + \
+            ['next_self_attention_cache_' + n_cache for n_cache in ids_caches] + \
+            ['next_self_attention_mask_' + n_cache for n_cache in ids_caches]
+
+        # model_next: processes only the last generated word
+        next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
+        preprocessed_annotations = Input(name='preprocessed_input',
+                                         shape=tuple([None, params['MODEL_SIZE']]),
+                                         dtype='float32')
+        prev_caches = [Input(name='prev_self_attention_cache_' + n_cache,
+                             shape=tuple([None, params['MODEL_SIZE']]),
+                             dtype='float32')
+                       for n_cache in ids_caches]
+        prev_cache_masks = [Input(name='prev_self_attention_mask_' + n_cache,
+                                  shape=tuple([None]),
+                                  dtype='float32')
+                            for n_cache in ids_caches]
+        # The position of the new word is the number of cached positions
+        next_words_positions = Lambda(lambda x: K.cast(K.ones_like(x[:, :1, 0]), 'int32') * K.shape(x)[1],
+                                      output_shape=lambda s: (s[0], 1),
+                                      name='position_next_word')(prev_caches[0])
+        softout, caches, cache_masks = apply_decoder(embed_words(next_words, next_words_positions),
+                                                     preprocessed_annotations,
+                                                     caches=prev_caches,
+                                                     cache_masks=prev_cache_masks)
+        self.model_next = Model(inputs=[next_words, preprocessed_annotations] + prev_caches + prev_cache_masks,
+                                outputs=[softout, preprocessed_annotations] + caches + cache_masks,
+                                name=self.name + '_model_next')
+        self.ids_inputs_next = [self.ids_inputs[1]] + ['preprocessed_input']
+        self.ids_outputs_next = self.ids_outputs + ['preprocessed_input']
+        self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input'}
+        self.matchings_next_to_next = {'preprocessed_input': 'preprocessed_input'}
+        for n_cache in ids_caches:
+            self.ids_inputs_next.append('prev_self_attention_cache_' + n_cache)
+            self.ids_outputs_next.append('next_self_attention_cache_' + n_cache)
+            self.matchings_init_to_next['next_self_attention_cache_' + n_cache] = 'prev_self_attention_cache_' + n_cache
+            self.matchings_next_to_next['next_self_attention_cache_' + n_cache] = 'prev_self_attention_cache_' + n_cache
+        for n_cache in ids_caches:
+            self.ids_inputs_next.append('prev_self_attention_mask_' + n_cache)
+            self.ids_outputs_next.append('next_self_attention_mask_' + n_cache)
+            self.matchings_init_to_next['next_self_attention_mask_' + n_cache] = 'prev_self_attention_mask_' + n_cache
+            self.matchings_next_to_next['next_self_attention_mask_' + n_cache] = 'prev_self_attention_mask_' + n_cache
+        self.incremental_decoding = True
+
+    def setFoldedEmbeddingProjections(self):
+        """
+        Folds the projection of the target word embeddings to the output layer into a lookup table, in the model_next
+        of the AttentionRNNEncoderDecoder model.
+
+        In model_next, the previous word goes through the embedding, its regularizers, the 'logit_emb' layer and the
+        regularizers of its output before being merged with the other skip connections. Since all of them are
+        applied word by word, their composition is precomputed for the whole target vocabulary and replaced by a
+        single Embedding layer, which saves a matrix product per hypothesis and timestep. The table is computed
+        from the current weights: if they are modified afterwards (e.g. by online learning), this method must be
+        applied again on a freshly built model_next.
+
+        :return: None
+        """
+        if getattr(self, 'folded_embedding_projections', False):
+            return
+        if 'logit_emb' not in [layer.name for layer in self.model_next.layers]:
+            raise Exception('Folding the embedding projections requires a model with a "logit_emb" layer '
+                            '(e.g. "AttentionRNNEncoderDecoder").')
+        if self.verbose > 0:
+            logger.info("<<< Folding the target embedding projections of model_next >>>")
+
+        merge_layer = self.model_next.get_layer('additional_input')
+        # Layers applied (in reverse order) from the merge of the skip connections to the output of model_next
+        output_layers = []
+        layer, node_index, _ = self.model_next.outputs[0]._keras_history
+        while layer is not merge_layer:
+            output_layers.append(layer)
+            layer, node_index, _ = layer.get_input_at(node_index)._keras_history
+        out_layer_mlp, out_layer_ctx, out_layer_emb = merge_layer.get_input_at(node_index)
+
+        next_words = self.model_next.inputs[self.model_next.input_names.index(self.ids_inputs[1])]
+        vocabulary_size = self.params['OUTPUT_VOCABULARY_SIZE']
+        projections = Model(inputs=next_words, outputs=out_layer_emb).predict(np.arange(vocabulary_size)[:, None],
+                                                                              batch_size=self.params.get('BATCH_SIZE', 50))
+        folded_out_layer_emb = Embedding(vocabulary_size, projections.shape[-1],
+                                         weights=[projections.reshape((vocabulary_size, -1))],
+                                         trainable=False,
+                                         name='logit_emb_folded')(next_words)
+        out_layer = merge_layer([out_layer_mlp, out_layer_ctx, folded_out_layer_emb])
+        for layer in reversed(output_layers):
+            out_layer = layer(out_layer)
+        self.model_next = Model(inputs=self.model_next.inputs,
+                                outputs=[out_layer] + self.model_next.outputs[1:],
+                                name=self.model_next.name)
+        self.folded_embedding_projections = True
+
+    def setVocabularyShortlist(self, shortlist_size):
+        """
+        Rebuilds the sampling models (model_init and model_next) so that the output layer is only computed for a
+        shortlist of target words: the output weights are sliced to the words of the shortlist, the softmax is
+        normalized over them and the resulting probabilities are scattered into a vector of the whole vocabulary.
+        Words outside the shortlist get a probability of 0, so the beam search is not modified.
+
+        The shortlist is stored in a backend variable of shortlist_size word indices, which must be set (e.g. for
+        each sentence or batch) with setShortlist. Until then, it contains the shortlist_size most frequent words.
+
+        :param int shortlist_size: Number of words of the shortlist.
+        :return: None
+        """
+        if getattr(self, 'vocabulary_shortlist', None) is not None:
+            return
+        if self.verbose > 0:
+            logger.info("<<< Restricting the output layer of the sampling models to a shortlist of %d words >>>"
+                        % shortlist_size)
+        shortlist = K.variable(np.arange(shortlist_size), dtype='int32', name='vocabulary_shortlist')
+
+        def shortlist_softmax(model):
+            fc_soft = model.get_layer(self.ids_outputs[0])
+            dense = fc_soft.layer
+            vocabulary_size = dense.units
+            softout = model.outputs[0]
+            out_layer = [fc_soft.get_input_at(node_index) for node_index in range(len(fc_soft._inbound_nodes))
+                         if fc_soft.get_output_at(node_index) is softout][0]
+
+            def restricted_dense(x):
+                if K.backend() == 'tensorflow':
+                    import tensorflow as tf
+                    kernel = tf.gather(dense.kernel, shortlist, axis=1)
+                else:
+                    kernel = dense.kernel[:, shortlist]
+                output = K.dot(x, kernel)
+                if dense.use_bias:
+                    output = K.bias_add(output, K.gather(dense.bias, shortlist))
+                output = K.reshape(dense.activation(output), (-1, shortlist_size))
+                # Scatter the probabilities of the shortlist into the whole vocabulary
+                if K.backend() == 'tensorflow':
+                    output = tf.transpose(tf.scatter_nd(K.expand_dims(shortlist, -1),
+                                                        tf.transpose(output),
+                                                        K.stack([vocabulary_size, K.shape(output)[0]])))
+                else:
+                    import theano.tensor as T
+                    output = T.set_subtensor(T.zeros((output.shape[0], vocabulary_size))[:, shortlist], output)
+                return K.reshape(output, K.concatenate([K.shape(x)[:-1], K.constant([vocabulary_size], dtype='int32')]))
+
+            return Lambda(restricted_dense,
+                          output_shape=lambda s: s[:-1] + (vocabulary_size,),
+                          name=self.ids_outputs[0] + '_shortlist')(out_layer)
+
+        self.model_init = Model(inputs=self.model_init.inputs,
+                                outputs=[shortlist_softmax(self.model_init)] + self.model_init.outputs[1:],
+                                name=self.model_init.name)
+        self.model_next = Model(inputs=self.model_next.inputs,
+                                outputs=[shortlist_softmax(self.model_next)] + self.model_next.outputs[1:],
+                                name=self.model_next.name)
+        self.vocabulary_shortlist = shortlist
+
+    def setShortlist(self, shortlist):
+        """
+        Sets the target words of the shortlist used by the sampling models (see setVocabularyShortlist).
+
+        :param shortlist: Indices of the target words. Its length must be the shortlist size.
+        :return: None
+        """
+        K.set_value(self.vocabulary_shortlist, np.asarray(shortlist, dtype='int32'))
+
     # ------------------------------------------------------- #
     #       PREDEFINED MODELS
     # ------------------------------------------------------- #
@@ -801,6 +1088,9 @@ class TranslationModel(Model_Wrapper):
             (params['BIDIRECTIONAL_ENCODER'] and params['N_LAYERS_ENCODER'] == 1) or (params['BIDIRECTIONAL_DEEP_ENCODER'] and params['N_LAYERS_ENCODER'] > 1) \
             else params['ENCODER_HIDDEN_SIZE']
         # Define inputs
+        # Note that the attentional decoder layer computes the projection of the annotations inside its call, so
+        # model_next (one timestep per call) projects them at each timestep. This state cannot be replaced by the
+        # projected annotations unless the Att*Cond layers accept a precomputed context projection.
         n_deep_decoder_layer_idx = 0
         preprocessed_annotations = Input(name='preprocessed_input', shape=tuple([None, preprocessed_size]))
         prev_h_states_list = [Input(name='prev_state_' + str(i),
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import logging
+import time
+
+import numpy as np
+from keras_wrapper.utils import checkParameters
+
+from nmt_keras.search import apply_penalties
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+class TeacherForcingScorer:
+    """
+    Scores source--target pairs with one or more translation models, feeding the reference target (teacher forcing)
+    to the training model (model.model). Each batch of pairs requires a single forward pass, instead of a pass per
+    target word. The pairs are grouped in batches of similar lengths, in order to minimize padding, but the scores
+    are returned in the original order.
+
+    As in BeamSearchEnsemble, the probabilities of the models of the ensemble are linearly combined. Scores are
+    negative log-probabilities (costs).
+    """
+
+    def __init__(self,
+                 models,
+                 dataset,
+                 params_prediction,
+                 model_weights=None,
+                 verbose=0):
+        """
+        Initialize the models, dataset and params of the method.
+
+        :param models: Models for provide the probabilities.
+        :param dataset: Dataset instance for the model.
+        :param params_prediction: Prediction parameters.
+        :param model_weights: Weight given to each model in the ensemble.
+        :param verbose: Be verbose or not.
+        """
+        self.models = models
+        self.dataset = dataset
+        self.params = params_prediction
+        self.verbose = verbose
+        if model_weights is None or len(model_weights) == 0:
+            model_weights = [1. / len(models)] * len(models)
+        self.model_weights = np.asarray(model_weights, dtype='float32')
+
+    def score_batch(self, x, y, y_mask):
+        """
+        Scores a batch of padded pairs.
+
+        :param x: Source word indices (n_sentences, source length).
+        :param y: Target word indices (n_sentences, target length).
+        :param y_mask: Mask of the target words (1 for words and <eos>).
+        :return: Cost of each target word (n_sentences, target length). Padded positions have a cost of 0.
+        """
+        state_below = np.hstack((np.zeros((y.shape[0], 1), dtype='int64') + self.dataset.extra_words['<null>'],
+                                 y[:, :-1]))
+        rows = np.arange(y.shape[0])[:, None]
+        columns = np.arange(y.shape[1])[None, :]
+        word_probs = np.zeros(y.shape, dtype='float32')
+        for model, weight in zip(self.models, self.model_weights):
+            probs = model.model.predict_on_batch({model.ids_inputs[0]: x, model.ids_inputs[1]: state_below})
+            if model.params.get('CLASSIFIER_ACTIVATION', 'softmax') is None:
+                # The model outputs logits
+                probs = np.exp(probs - np.max(probs, axis=-1, keepdims=True))
+                probs /= np.sum(probs, axis=-1, keepdims=True)
+            word_probs += weight * probs[rows, columns, y]
+        return -np.log(np.maximum(word_probs, 1e-30)) * y_mask
+
+    def score_generator(self, split):
+        """
+        Scores the pairs of a split of the dataset. Pairs are processed in chunks of params['chunk_size'] pairs:
+        each chunk is sorted by length, split into batches of params['max_batch_size'] pairs and its scores are
+        yielded as soon as it is finished.
+
+        :param split: Split to score.
+        :return: Generator of (scores, word_scores) tuples, one per chunk and in the original order. word_scores
+                 contains the cost of each target word of each pair (None if not params['word_scores']).
+        """
+        default_params = {'max_batch_size': 50,
+                          'chunk_size': 10000,
+                          'dataset_inputs': ['source_text', 'state_below'],
+                          'dataset_outputs': ['target_text'],
+                          'normalize_probs': False,
+                          'alpha_factor': 0.0,
+                          'coverage_penalty': False,
+                          'length_penalty': False,
+                          'length_norm_factor': 0.0,
+                          'coverage_norm_factor': 0.0,
+                          'word_scores': False
+                          }
+        params = checkParameters(self.params, default_params)
+        if params['coverage_penalty']:
+            raise AssertionError('The coverage penalty is not available when scoring with teacher forcing.')
+        input_id = params['dataset_inputs'][0]
+        output_id = params['dataset_outputs'][0]
+        sources = getattr(self.dataset, 'X_' + split)[input_id]
+        targets = getattr(self.dataset, 'Y_' + split)[output_id]
+        n_samples = len(sources)
+        scored = 0
+        start_time = time.time()
+        for chunk_start in range(0, n_samples, params['chunk_size']):
+            chunk_indices = np.arange(chunk_start, min(chunk_start + params['chunk_size'], n_samples))
+            # Sort pairs by length to minimize padding on each batch (stable, for reproducibility)
+            order = np.argsort([len(targets[i].split()) * 10000 + len(sources[i].split()) for i in chunk_indices],
+                               kind='mergesort')
+            scores = np.zeros(len(chunk_indices), dtype='float32')
+            word_scores = [None] * len(chunk_indices)
+            for batch_start in range(0, len(chunk_indices), params['max_batch_size']):
+                batch = order[batch_start:batch_start + params['max_batch_size']]
+                x, _ = self.dataset.loadText([sources[chunk_indices[i]] for i in batch],
+                                             self.dataset.vocabulary[input_id],
+                                             self.dataset.max_text_len[input_id][split],
+                                             self.dataset.text_offset[input_id],
+                                             fill=self.dataset.fill_text[input_id],
+                                             pad_on_batch=True,
+                                             words_so_far=False,
+                                             loading_X=True)
+                y, y_mask = self.dataset.loadText([targets[chunk_indices[i]] for i in batch],
+                                                  self.dataset.vocabulary[output_id],
+                                                  self.dataset.max_text_len[output_id][split],
+                                                  0,
+                                                  fill='end',
+                                                  pad_on_batch=True,
+                                                  words_so_far=False,
+                                                  loading_X=True)
+                batch_word_scores = self.score_batch(x, y, y_mask)
+                lengths = np.sum(y_mask, axis=1)
+                scores[batch] = apply_penalties([y_row[:length] for y_row, length in zip(y, lengths)],
+                                                np.sum(batch_word_scores, axis=1),
+                                                None,
+                                                params)
+                if params['word_scores']:
+                    for i, row_word_scores, length in zip(batch, batch_word_scores, lengths):
+                        word_scores[i] = row_word_scores[:length]
+            scored += len(chunk_indices)
+            if self.verbose > 0:
+                logger.info('Scored %d/%d pairs (%f sec/pair)' % (scored, n_samples,
+                                                                  (time.time() - start_time) / scored))
+            yield scores, word_scores if params['word_scores'] else None
+
+        if self.verbose > 0:
+            logger.info('The scoring took: %f secs (Speed: %f sec/sample)' %
+                        ((time.time() - start_time), (time.time() - start_time) / max(n_samples, 1)))
+
+    def scoreNet(self):
+        """
+        Scores the pairs of the dataset splits chosen (params['predict_on_sets']), as BeamSearchEnsemble.scoreNet.
+
+        :returns scores: dictionary with set splits as keys and lists of scores as values.
+        """
+        scores_dict = dict()
+        for s in self.params.get('predict_on_sets', ['val']):
+            logger.info("<<< Scoring outputs of " + s + " set >>>")
+            scores_dict[s] = [score for scores, _ in self.score_generator(s) for score in scores]
+        return scores_dict
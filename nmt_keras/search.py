@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import logging
+import sys
+import time
+
+import numpy as np
+from six import iteritems
+from keras_wrapper.model_ensemble import BeamSearchEnsemble
+from keras_wrapper.utils import checkParameters
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def to_numpy(array):
+    """
+    Moves an array (possibly from cupy) to numpy.
+
+    :param array: Array to convert.
+    :return: Numpy array.
+    """
+    if hasattr(array, 'get'):
+        return array.get()
+    return np.asarray(array)
+
+
+def apply_penalties(samples, scores, alphas, params):
+    """
+    Rescores the hypotheses of a sentence according to the length/coverage penalties or to the (simple) length
+    normalization, as in BeamSearchEnsemble.predictBeamSearchNet.
+
+    :param list samples: Hypotheses (list of word indices).
+    :param scores: Cost of each hypothesis.
+    :param list alphas: Attention weights of each hypothesis (shape: (len(sample), len(source))). Only required for
+                        the coverage penalty.
+    :param dict params: Search parameters.
+    :return: List with the rescored costs.
+    """
+    if params['length_penalty'] or params['coverage_penalty']:
+        if params['length_penalty']:
+            # this 5 is a magic number by Google...
+            length_penalties = [((5 + len(sample)) ** params['length_norm_factor'] /
+                                 (5 + 1) ** params['length_norm_factor']) for sample in samples]
+        else:
+            length_penalties = [1.0 for _ in samples]
+
+        if params['coverage_penalty']:
+            coverage_penalties = []
+            for sample, alpha in zip(samples, alphas):
+                att_weights = np.sum(np.asarray(alpha)[:len(sample)], axis=0)
+                cp_penalty = np.sum(np.log(np.minimum(att_weights, 1.0)))
+                coverage_penalties.append(params['coverage_norm_factor'] * cp_penalty)
+        else:
+            coverage_penalties = [0.0 for _ in samples]
+        scores = [co / lp + cov_p for co, lp, cov_p in zip(scores, length_penalties, coverage_penalties)]
+
+    elif params['normalize_probs']:
+        counts = [len(sample) ** params['alpha_factor'] for sample in samples]
+        scores = [co / cn for co, cn in zip(scores, counts)]
+    return list(scores)
+
+
+class VocabularyShortlist:
+    """
+    Builds the shortlists of target words used for restricting the output layer of the models at decoding time
+    (see TranslationModel.setVocabularyShortlist). The shortlist of a batch of source sentences contains the special
+    words, the candidate translations of each source word and, up to the shortlist size, the most frequent target
+    words. Candidate translations are taken from a source--target mapping (see utils/build_mapping_file.sh) and from
+    the glossary.
+    """
+
+    def __init__(self, dataset, input_id, output_id, size, mapping=None, glossary=None, n_translations=10):
+        """
+        :param dataset: Dataset instance with the vocabularies.
+        :param input_id: Id of the source text in the dataset.
+        :param output_id: Id of the target text in the dataset.
+        :param int size: Number of words of each shortlist.
+        :param dict mapping: Source--target mapping. Maps each source word either to a target word or to a dictionary
+                             of target words and their probabilities.
+        :param dict glossary: Glossary for overwriting translations.
+        :param int n_translations: Maximum number of candidate translations taken from the mapping for each source word.
+        """
+        self.vocabulary_size = dataset.vocabulary_len[output_id]
+        self.size = min(size, self.vocabulary_size)
+        self.n_special_words = len(dataset.extra_words)
+        trg_words2idx = dataset.vocabulary[output_id]['words2idx']
+        # Candidate target word indices for each source word index
+        self.translations = dict()
+        for src_idx, src_word in iteritems(dataset.vocabulary[input_id]['idx2words']):
+            candidates = []
+            if mapping is not None and src_word in mapping:
+                translations = mapping[src_word]
+                if isinstance(translations, dict):
+                    candidates += sorted(translations, key=translations.get, reverse=True)[:n_translations]
+                else:
+                    candidates.append(translations)
+            if glossary is not None and src_word in glossary:
+                candidates += glossary[src_word].split()
+            candidates = [trg_words2idx[word] for word in candidates if word in trg_words2idx]
+            if candidates:
+                self.translations[src_idx] = candidates
+
+    def __call__(self, x):
+        """
+        Builds the shortlist of a batch of sentences.
+
+        :param x: Source word indices of the batch.
+        :return: Numpy array with the sorted indices of the shortlist (always of length self.size).
+        """
+        shortlist = set(range(self.n_special_words))
+        for src_idx in np.unique(x):
+            shortlist.update(self.translations.get(int(src_idx), []))
+        if len(shortlist) > self.size:
+            # Keep the most frequent candidates (target vocabularies are sorted by frequency)
+            return np.asarray(sorted(shortlist)[:self.size], dtype='int32')
+        # Fill with the most frequent words
+        trg_idx = 0
+        while len(shortlist) < self.size:
+            shortlist.add(trg_idx)
+            trg_idx += 1
+        return np.asarray(sorted(shortlist), dtype='int32')
+
+
+class ShortlistBeamSearchEnsemble(BeamSearchEnsemble):
+    """
+    Beam search with one or more autoregressive models, which restricts the output layer of the models to a
+    shortlist of target words built for each sentence (see VocabularyShortlist). The models must have been prepared
+    with TranslationModel.setVocabularyShortlist.
+    """
+
+    def __init__(self,
+                 models,
+                 dataset,
+                 params_prediction,
+                 model_weights=None,
+                 n_best=False,
+                 verbose=0,
+                 shortlist=None):
+        """
+        Initialize the models, dataset and params of the method.
+
+        :param models: Models for provide the probabilities.
+        :param dataset: Dataset instance for the model.
+        :param params_prediction: Prediction parameters.
+        :param model_weights: Weight given to each model in the ensemble.
+        :param n_best: Return the n-best lists.
+        :param verbose: Be verbose or not.
+        :param shortlist: VocabularyShortlist instance. If None, the whole vocabulary is used.
+        """
+        BeamSearchEnsemble.__init__(self,
+                                    models,
+                                    dataset,
+                                    params_prediction,
+                                    model_weights=model_weights,
+                                    n_best=n_best,
+                                    verbose=verbose)
+        self.shortlist = shortlist
+
+    def predict_cond_optimized(self, X, states_below, params, ii, prev_outs):
+        """
+        Call the prediction functions of all models, according to their inputs. At the first timestep, it sets
+        the shortlist of the models for the sentences in X.
+
+        :param X: Input data
+        :param states_below: Previously generated words (in case of conditional models)
+        :param params: Model parameters
+        :param ii: Decoding time-step
+        :param prev_outs: Only for optimized models. Outputs from the previous time-step.
+        :return: Combined outputs from the ensemble
+        """
+        if ii == 0 and self.shortlist is not None:
+            shortlist = self.shortlist(X[params['model_inputs'][0]])
+            for model in self.models:
+                model.setShortlist(shortlist)
+        return BeamSearchEnsemble.predict_cond_optimized(self, X, states_below, params, ii, prev_outs)
+
+
+class BatchedBeamSearchEnsemble(ShortlistBeamSearchEnsemble):
+    """
+    Beam search with one or more autoregressive models, which decodes several sentences at once.
+
+    The hypotheses of all the sentences from a batch are stacked into a single (sentences x beam) batch, so each call
+    to model_init/model_next processes the beams of many sentences. Finished hypotheses are tracked per sentence and a
+    sentence leaves the batch when its search ends. Sentences are sorted by length before building the batches, in
+    order to minimize padding, and the results are returned in the original order.
+    Requires the optimized search (model_init and model_next).
+    """
+
+    def __init__(self,
+                 models,
+                 dataset,
+                 params_prediction,
+                 model_weights=None,
+                 n_best=False,
+                 verbose=0,
+                 batch_size=16,
+                 shortlist=None):
+        """
+        Initialize the models, dataset and params of the method.
+
+        :param models: Models for provide the probabilities.
+        :param dataset: Dataset instance for the model.
+        :param params_prediction: Prediction parameters.
+        :param model_weights: Weight given to each model in the ensemble.
+        :param n_best: Return the n-best lists.
+        :param verbose: Be verbose or not.
+        :param batch_size: Number of sentences decoded at once.
+        :param shortlist: VocabularyShortlist instance. If None, the whole vocabulary is used. The shortlist of each
+                          batch is built from all its sentences.
+        """
+        ShortlistBeamSearchEnsemble.__init__(self,
+                                             models,
+                                             dataset,
+                                             params_prediction,
+                                             model_weights=model_weights,
+                                             n_best=n_best,
+                                             verbose=verbose,
+                                             shortlist=shortlist)
+        self.batch_size = max(1, int(batch_size))
+
+    def predictBeamSearchNet(self):
+        """
+        Approximates by beam search the best predictions of the net on the dataset splits chosen.
+        The search parameters are the same than in BeamSearchEnsemble.predictBeamSearchNet.
+
+        :returns predictions: dictionary with set splits as keys and dictionaries with the 'samples', 'alphas',
+                              'sources', 'costs' and 'n_best' of the split as values.
+        """
+        default_params = {'max_batch_size': 50,
+                          'beam_size': 5,
+                          'predict_on_sets': ['val'],
+                          'maxlen': 20,
+                          'model_inputs': ['source_text', 'state_below'],
+                          'model_outputs': ['description'],
+                          'dataset_inputs': ['source_text', 'state_below'],
+                          'dataset_outputs': ['description'],
+                          'words_so_far': False,
+                          'optimized_search': False,
+                          'pos_unk': False,
+                          'state_below_index': -1,
+                          'state_below_maxlen': -1,
+                          'search_pruning': False,
+                          'normalize_probs': False,
+                          'alpha_factor': 0.0,
+                          'coverage_penalty': False,
+                          'length_penalty': False,
+                          'length_norm_factor': 0.0,
+                          'coverage_norm_factor': 0.0,
+                          'output_max_length_depending_on_x': False,
+                          'output_max_length_depending_on_x_factor': 3,
+                          'output_min_length_depending_on_x': False,
+                          'output_min_length_depending_on_x_factor': 2,
+                          'attend_on_output': False
+                          }
+        params = checkParameters(self.params, default_params)
+        if not params['optimized_search']:
+            raise AssertionError('The batched beam search requires the optimized search ("optimized_search").')
+        if params['words_so_far']:
+            raise AssertionError('The batched beam search does not support "words_so_far".')
+
+        input_id = params['dataset_inputs'][0]
+        predictions = dict()
+        for s in params['predict_on_sets']:
+            logger.info("\n <<< Predicting outputs of " + s + " set >>>")
+            params['pad_on_batch'] = self.dataset.pad_on_batch[params['dataset_inputs'][-1]]
+            if not params['pad_on_batch']:
+                raise AssertionError('The batched beam search requires "PAD_ON_BATCH".')
+            sentences = getattr(self.dataset, 'X_' + s)[input_id]
+            n_samples = len(sentences)
+
+            # Sort sentences by length to minimize padding on each batch (stable, for reproducibility)
+            order = np.argsort([len(sentence.split()) for sentence in sentences], kind='mergesort')
+
+            best_samples = [None] * n_samples
+            best_scores = np.zeros(n_samples, dtype='float32')
+            best_alphas = [None] * n_samples
+            sources = [None] * n_samples if params['pos_unk'] else []
+            n_best_list = [None] * n_samples
+            sampled = 0
+            start_time = time.time()
+            eta = -1
+            for start in range(0, n_samples, self.batch_size):
+                indices = order[start:start + self.batch_size]
+                # Progress goes to stderr, in order not to mix it with the translations written to stdout
+                if self.verbose > 0:
+                    sys.stderr.write("Sampling %d/%d  -  ETA: %ds " % (sampled, n_samples, int(eta)))
+                    if not hasattr(self, '_dynamic_display') or self._dynamic_display:
+                        sys.stderr.write('\r')
+                    else:
+                        sys.stderr.write('\n')
+                    sys.stderr.flush()
+
+                x, x_mask = self.dataset.loadText([sentences[i] for i in indices],
+                                                  self.dataset.vocabulary[input_id],
+                                                  self.dataset.max_text_len[input_id][s],
+                                                  self.dataset.text_offset[input_id],
+                                                  fill=self.dataset.fill_text[input_id],
+                                                  pad_on_batch=params['pad_on_batch'],
+                                                  words_so_far=False,
+                                                  loading_X=True)
+                hypotheses = self.beam_search_batch({params['model_inputs'][0]: x},
+                                                    x_mask,
+                                                    params,
+                                                    null_sym=self.dataset.extra_words['<null>'])
+
+                for i, x_row, (samples, scores, alphas) in zip(indices, x, hypotheses):
+                    scores = apply_penalties(samples, scores, alphas, params)
+                    if self.n_best:
+                        n_best_indices = np.argsort(scores)
+                        n_best_list[i] = [[samples[j] for j in n_best_indices],
+                                          np.asarray(scores)[n_best_indices],
+                                          [alphas[j] for j in n_best_indices] if alphas is not None
+                                          else [None] * len(n_best_indices)]
+                    best_score_idx = int(np.argmin(scores))
+                    best_samples[i] = samples[best_score_idx]
+                    best_scores[i] = scores[best_score_idx]
+                    if params['pos_unk']:
+                        best_alphas[i] = alphas[best_score_idx]
+                        sources[i] = {params['model_inputs'][0]: x_row}
+                sampled += len(indices)
+                eta = (n_samples - sampled) * (time.time() - start_time) / sampled
+
+            if self.verbose > 0:
+                sys.stderr.write('\n Total cost: %f \t'
+                                 ' Average cost: %f\n' % (float(np.sum(best_scores, axis=None)),
+                                                          float(np.average(best_scores, axis=None))))
+                sys.stderr.write('The sampling took: %f secs (Speed: %f sec/sample)\n' %
+                                 ((time.time() - start_time), (time.time() - start_time) / max(n_samples, 1)))
+                sys.stderr.flush()
+            predictions[s] = {
+                'samples': best_samples,
+                'alphas': best_alphas if params['pos_unk'] else [],
+                'sources': sources,
+                'costs': best_scores,
+                'n_best': n_best_list if self.n_best else []
+            }
+        return predictions
+
+    def beam_search_batch(self,
+                          X,
+                          x_mask,
+                          params,
+                          eos_sym=0,
+                          null_sym=2,
+                          fixed_words=None,
+                          valid_next_words=None):
+        """
+        Beam search over a batch of sentences. The live hypotheses of all sentences are stacked (sentence by
+        sentence) as the rows of the model inputs. After each timestep, the states from model_init/model_next are
+        reordered according to the surviving hypotheses, and the sentences whose search ended are removed.
+
+        As in the interactive-predictive search, the hypotheses of each sentence can be constrained to start with a
+        prefix (fixed_words) and to continue with one of a set of words (valid_next_words).
+
+        :param dict X: Model inputs. X[params['model_inputs'][0]] are the (padded) source sentences.
+        :param x_mask: Mask of the source sentences (1 for words and <eos>).
+        :param dict params: Search parameters.
+        :param int eos_sym: End-of-sentence index.
+        :param int null_sym: Null (start of sentence) index.
+        :param list fixed_words: For each sentence, list of word indices which the hypotheses must start with
+                                 (or None).
+        :param list valid_next_words: For each sentence, array of the word indices allowed after the fixed words
+                                      (or None, for allowing any word).
+        :return: For each sentence, a tuple with its hypotheses, their costs and their attention weights (None if not
+                 required). The attention weights are restricted to the actual source positions.
+        """
+        k = params['beam_size']
+        n_sentences = x_mask.shape[0]
+        x_lengths = np.sum(x_mask, axis=1)
+        if params['output_max_length_depending_on_x']:
+            maxlen = [max(1, int(x_len * params['output_max_length_depending_on_x_factor'])) for x_len in x_lengths]
+        else:
+            maxlen = [max(1, params['maxlen'])] * n_sentences
+        if params['output_min_length_depending_on_x']:
+            minlen = [int(x_len / params['output_min_length_depending_on_x_factor'] + 1e-7) for x_len in x_lengths]
+        else:
+            minlen = [0] * n_sentences
+        if fixed_words is None:
+            fixed_words = [None] * n_sentences
+        fixed_words = [list(words) if words is not None else [] for words in fixed_words]
+        if valid_next_words is None:
+            valid_next_words = [None] * n_sentences
+        # The hypotheses must have room for the fixed words
+        maxlen = [max(s_maxlen, len(s_fixed_words) + 1) for s_maxlen, s_fixed_words in zip(maxlen, fixed_words)]
+        ret_alphas = self.return_alphas
+
+        hyp_samples = [[[]] for _ in range(n_sentences)]
+        hyp_scores = [np.zeros(1, dtype='float32') for _ in range(n_sentences)]
+        hyp_alphas = [[[]] for _ in range(n_sentences)]
+        dead_k = [0] * n_sentences
+        samples = [[] for _ in range(n_sentences)]
+        sample_scores = [[] for _ in range(n_sentences)]
+        sample_alphas = [[] for _ in range(n_sentences)]
+
+        # Sentences still being decoded; their live hypotheses are the rows of the model inputs, in this order
+        active = list(range(n_sentences))
+        state_below = np.asarray([[null_sym]] * n_sentences)
+        X = dict(X)
+        X[params['model_inputs'][params['state_below_index']]] = state_below
+        params = dict(params)
+        params['max_batch_size'] = n_sentences * k  # Batches are already controlled by the number of sentences
+        prev_out = [None] * len(self.models)
+        for ii in range(max(maxlen)):
+            probs, prev_out, alphas = self.predict_cond_optimized(X, state_below, params, ii, prev_out)
+            log_probs = np.log(to_numpy(probs))
+            if ret_alphas:
+                alphas = to_numpy(alphas)
+            next_active = []
+            rows_alive = []
+            row_start = 0
+            for s in active:
+                n_live = len(hyp_samples[s])
+                s_log_probs = log_probs[row_start:row_start + n_live]
+                if minlen[s] > 0 and ii < minlen[s]:
+                    s_log_probs[:, eos_sym] = -np.inf
+                # Words allowed at this timestep (None: all of them)
+                if ii < len(fixed_words[s]):
+                    allowed_words = np.asarray(fixed_words[s][ii:ii + 1])
+                elif ii == len(fixed_words[s]) and valid_next_words[s] is not None and len(valid_next_words[s]) > 0:
+                    allowed_words = np.asarray(valid_next_words[s])
+                else:
+                    allowed_words = None
+                # total score for every sample is sum of -log of word prb
+                cand_scores = hyp_scores[s][:, None] - s_log_probs
+                if allowed_words is not None:
+                    cand_scores = cand_scores[:, allowed_words]
+                cand_flat = cand_scores.flatten()
+                ranks_flat = np.argsort(cand_flat)[:(k - dead_k[s])]
+                voc_size = cand_scores.shape[1]
+                trans_indices = ranks_flat // voc_size  # index of row
+                word_indices = ranks_flat % voc_size  # index of col
+                if allowed_words is not None:
+                    word_indices = allowed_words[word_indices]
+                costs = cand_flat[ranks_flat]
+
+                live_samples = []
+                live_scores = []
+                live_alphas = []
+                for idx, (ti, wi) in enumerate(zip(trans_indices, word_indices)):
+                    if params['search_pruning'] and costs[idx] >= k * costs[0]:
+                        dead_k[s] += 1
+                        continue
+                    new_sample = hyp_samples[s][ti] + [wi]
+                    new_alphas = hyp_alphas[s][ti] + [alphas[row_start + ti]] if ret_alphas else None
+                    if wi == eos_sym:  # finished sample
+                        samples[s].append(new_sample)
+                        sample_scores[s].append(costs[idx])
+                        sample_alphas[s].append(new_alphas)
+                        dead_k[s] += 1
+                    else:
+                        live_samples.append(new_sample)
+                        live_scores.append(costs[idx])
+                        live_alphas.append(new_alphas)
+                        rows_alive.append(row_start + ti)
+                row_start += n_live
+
+                if len(live_samples) == 0 or dead_k[s] >= k or ii + 1 >= maxlen[s]:
+                    # The search of this sentence ended: dump every remaining hypothesis
+                    samples[s] += live_samples
+                    sample_scores[s] += live_scores
+                    sample_alphas[s] += live_alphas
+                    if live_samples:
+                        del rows_alive[-len(live_samples):]
+                else:
+                    hyp_samples[s] = live_samples
+                    hyp_scores[s] = np.asarray(live_scores, dtype='float32')
+                    hyp_alphas[s] = live_alphas
+                    next_active.append(s)
+
+            active = next_active
+            if not active:
+                break
+            state_below = np.asarray([sample for s in active for sample in hyp_samples[s]], dtype='int64')
+            state_below = np.hstack((np.zeros((state_below.shape[0], 1), dtype='int64') + null_sym, state_below))
+            # filter next search inputs w.r.t. remaining samples
+            for n_model in range(len(self.models)):
+                for idx_vars in range(len(prev_out[n_model])):
+                    prev_out[n_model][idx_vars] = prev_out[n_model][idx_vars][rows_alive]
+
+        results = []
+        for s in range(n_sentences):
+            if ret_alphas:
+                valid_positions = x_mask[s] > 0
+                s_alphas = [np.asarray(alpha)[:, valid_positions] for alpha in sample_alphas[s]]
+            else:
+                s_alphas = None
+            results.append((samples[s], np.asarray(sample_scores[s], dtype='float32'), s_alphas))
+        return results
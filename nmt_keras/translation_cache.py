@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+
+from six.moves import cPickle as pk
+
+from utils.utils import update_hash_from_file
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Prediction parameters that do not change the translations
+UNHASHED_PREDICTION_PARAMS = ['predict_on_sets', 'max_batch_size', 'n_parallel_loaders']
+# Files whose contents change the output strings
+HASHED_FILE_PARAMS = ['BPE_CODES_PATH', 'MAPPING']
+# Parameters that change the output strings, but are not part of the prediction parameters
+HASHED_PARAMS = ['TOKENIZATION_METHOD', 'BPE_CODES_PATH', 'APPLY_DETOKENIZATION', 'DETOKENIZATION_METHOD',
+                 'HEURISTIC', 'MAPPING', 'VOCABULARY_SHORTLIST', 'SHORTLIST_SIZE', 'SHORTLIST_TRANSLATIONS']
+
+
+def translation_fingerprint(model_paths, model_weights, params_prediction, params, glossary=None, dataset_path=None):
+    """
+    Computes a fingerprint of everything that determines the translation of a sentence, except the sentence itself:
+    the model files, the dataset (with the vocabularies), the ensemble weights, the search parameters and the
+    (de)tokenization options, including the contents of the BPE codes and of the mapping.
+
+    :param list model_paths: Paths to the models (as given to loadModel).
+    :param list model_weights: Weight given to each model of the ensemble.
+    :param dict params_prediction: Parameters of the beam search.
+    :param dict params: Parameters of the translation model.
+    :param dict glossary: Glossary for overwriting translations.
+    :param str dataset_path: Dataset instance used for translating (as given to loadDataset).
+    :return: Hexadecimal digest.
+    """
+    fingerprint = hashlib.sha1()
+    for model_path in model_paths:
+        for model_file in sorted(glob.glob(model_path + '_*')):
+            fingerprint.update(os.path.basename(model_file).encode('utf-8'))
+            update_hash_from_file(fingerprint, model_file)
+    # The mapping between words and indices may change when the dataset is rebuilt
+    for hashed_file in [dataset_path] + [params.get(k) for k in HASHED_FILE_PARAMS]:
+        if hashed_file is not None and os.path.isfile(hashed_file):
+            update_hash_from_file(fingerprint, hashed_file)
+    fingerprint.update(repr(list(map(float, model_weights or []))).encode('utf-8'))
+    fingerprint.update(repr(sorted((k, v) for k, v in params_prediction.items()
+                                   if k not in UNHASHED_PREDICTION_PARAMS)).encode('utf-8'))
+    fingerprint.update(repr([(k, params.get(k)) for k in HASHED_PARAMS]).encode('utf-8'))
+    fingerprint.update(repr(sorted(glossary.items()) if glossary is not None else None).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+class TranslationCache:
+    """
+    On-disk, content-addressed cache of translations. Each entry is stored in its own file, named after the hash of
+    the fingerprint of the models and the tokenized source sentence. Hence, entries computed with other models or
+    search parameters are never returned.
+
+    The cache is bounded to max_size entries: when it grows larger, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, fingerprint, max_size=100000):
+        """
+        :param path: Directory where the cache is stored. Created if it does not exist.
+        :param fingerprint: Fingerprint of the models and search parameters (see translation_fingerprint).
+        :param max_size: Maximum number of entries stored in the cache.
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.size = len(self._entries())
+
+    def key(self, tokenized_source):
+        """
+        Computes the key of a sentence.
+        :param tokenized_source: Tokenized source sentence.
+        :return: Key of the sentence.
+        """
+        return hashlib.sha1((self.fingerprint + u'\n' + tokenized_source).encode('utf-8')).hexdigest()
+
+    def _filepath(self, key):
+        return os.path.join(self.path, key[:2], key + '.pkl')
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.path, '*', '*.pkl'))
+
+    def get(self, key):
+        """
+        Retrieves an entry from the cache.
+        :param key: Key of the sentence.
+        :return: The stored entry or None if the key is not in the cache.
+        """
+        filepath = self._filepath(key)
+        try:
+            with open(filepath, 'rb') as f:
+                entry = pk.load(f)
+            # Touch the entry: its modification time is used for the LRU eviction
+            os.utime(filepath, None)
+        except (IOError, OSError, EOFError, pk.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def set(self, key, entry):
+        """
+        Stores an entry in the cache. The entry is written to a temporary file and then moved, so concurrent
+        readers never see partial entries.
+        :param key: Key of the sentence.
+        :param entry: Object to store.
+        """
+        filepath = self._filepath(key)
+        dirname = os.path.dirname(filepath)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:  # Created by another process
+                pass
+        exists = os.path.isfile(filepath)
+        fd, tmp_filepath = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pk.dump(entry, f, protocol=2)
+        os.rename(tmp_filepath, filepath)
+        if not exists:
+            self.size += 1
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries, until the cache is 10% below its maximum size. Evicting several
+        entries at once amortizes the cost of scanning the cache directory.
+        """
+        entries = self._entries()
+        n_evict = len(entries) - int(self.max_size * 0.9)
+        if n_evict > 0:
+            entries.sort(key=lambda entry_path: os.path.getmtime(entry_path))
+            for entry_path in entries[:n_evict]:
+                try:
+                    os.remove(entry_path)
+                except OSError:  # Removed by another process
+                    pass
+            logger.info('Evicted %d entries from the translation cache' % n_evict)
+        self.size = len(entries) - max(n_evict, 0)
@@ -5,7 +5,7 @@ import logging
 import ast
 from keras_wrapper.extra.read_write import pkl2dict
 from nmt_keras import check_params
-from nmt_keras.apply_model import sample_ensemble
+from nmt_keras.apply_model import sample_ensemble, sample_ensemble_parallel
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger(__name__)
@@ -14,7 +14,8 @@ logger = logging.getLogger(__name__)
 def parse_args():
     parser = argparse.ArgumentParser("Use several translation models for obtaining predictions from a source text file.")
     parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with data")
-    parser.add_argument("-t", "--text", required=True, help="Text file with source sentences")
+    parser.add_argument("-t", "--text", required=True, help="Text file with source sentences. "
+                                                            "In streaming mode, '-' reads from STDIN.")
     parser.add_argument("-s", "--splits", nargs='+', required=False, default=['val'], help="Splits to sample. "
                                                                                            "Should be already included"
                                                                                            "into the dataset object.")
@@ -29,6 +30,16 @@ def parse_args():
                                                            "By default, it applies the same weight to each model (1/N).", default=[])
     parser.add_argument("-g", "--glossary", required=False, help="Glossary file for overwriting translations.")
     parser.add_argument("-m", "--models", nargs="+", required=True, help="Path to the models")
+    parser.add_argument("--stream", action="store_true", default=False, help="Streaming mode: read the text in chunks "
+                                                                             "and output the translations of each "
+                                                                             "chunk as soon as it is finished. Only "
+                                                                             "the first split is used.")
+    parser.add_argument("--chunk-size", required=False, default=100, type=int, help="Number of sentences per chunk "
+                                                                                    "in streaming mode.")
+    parser.add_argument("--workers", required=False, default=1, type=int, help="Number of processes translating "
+                                                                                "contiguous shards of the text in "
+                                                                                "parallel. Each one loads the models "
+                                                                                "and uses its own subset of CPUs.")
     parser.add_argument("-ch", "--changes", nargs="*", help="Changes to the config. Following the syntax Key=Value",
                         default="")
     return parser.parse_args()
@@ -59,4 +70,12 @@ if __name__ == "__main__":
         print ('Error processing arguments: (', k, ",", v, ")")
         exit(2)
     params = check_params(params)
-    sample_ensemble(args, params)
+    if args.workers > 1:
+        if args.stream or args.text == '-':
+            logger.warning('Parallel decoding ("--workers") is incompatible with the streaming mode and with reading '
+                           'from STDIN. Using a single process.')
+            sample_ensemble(args, params)
+        else:
+            sample_ensemble_parallel(args, params)
+    else:
+        sample_ensemble(args, params)
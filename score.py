@@ -28,6 +28,8 @@ def parse_args():
                                                                "If not specified, hyperparameters "
                                                                "are read from config.py")
     parser.add_argument("--models", nargs='+', required=True, help="path to the models")
+    parser.add_argument("--word-scores", action='store_true', default=False, help="Also store the score of each "
+                                                                                  "target word (in DEST.words)")
     parser.add_argument("-ch", "--changes", nargs="*", help="Changes to the config. Following the syntax Key=Value",
                         default="")
     return parser.parse_args()
@@ -1,5 +1,8 @@
 import argparse
+import codecs
 import os
+
+import numpy as np
 import pytest
 from tests.test_config import load_tests_params, clean_dirs
 from data_engine.prepare_data import build_dataset
@@ -63,6 +66,28 @@ def test_transformer():
         sample_ensemble(parser, params)
         print("Done")
 
+    print("Sampling with incremental decoding")
+    # Both sampling models must give the same hypotheses and costs
+    parser.n_best = True
+    outputs = []
+    for incremental_decoding in [False, True]:
+        params['INCREMENTAL_DECODING'] = incremental_decoding
+        parser.dest = os.path.join(params['STORE_PATH'], 'incremental_decoding_%s.hyp' % str(incremental_decoding))
+        sample_ensemble(parser, params)
+        with codecs.open(parser.dest, 'r', encoding='utf-8') as hypotheses_file:
+            hypotheses = hypotheses_file.read().splitlines()
+        with codecs.open(parser.dest + '.nbest', 'r', encoding='utf-8') as nbest_file:
+            n_best = [[field.strip() for field in line.split(u'|||')] for line in nbest_file.read().splitlines()]
+        outputs.append((hypotheses, n_best))
+    params['INCREMENTAL_DECODING'] = False
+    parser.dest = None
+    (hypotheses, n_best), (incremental_hypotheses, incremental_n_best) = outputs
+    assert incremental_hypotheses == hypotheses
+    assert [line[:2] for line in incremental_n_best] == [line[:2] for line in n_best]
+    assert np.allclose([float(line[2]) for line in incremental_n_best], [float(line[2]) for line in n_best],
+                       atol=1e-4)
+    print("Done")
+
     print("Scoring corpus")
     score_corpus(parser, params)
     print("Done")
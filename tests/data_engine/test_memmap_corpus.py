@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from config import load_parameters
+from data_engine.memmap_corpus import MemmapTextSplit, memmap_splits
+from data_engine.prepare_data import build_dataset
+from keras_wrapper.dataset import Dataset, loadDataset
+
+
+def test_memmap_splits():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    ds = build_dataset(params)
+    params['MEMMAP_SPLITS'] = ['train']
+    memmap_ds = build_dataset(params)
+    assert isinstance(memmap_ds, Dataset)
+    assert memmap_splits(memmap_ds, 'train')
+    assert not memmap_splits(memmap_ds, 'val')
+
+    source_id = params['INPUTS_IDS_DATASET'][0]
+    words2idx = ds.vocabulary[source_id]['words2idx']
+    sentences = memmap_ds.X_train[source_id]
+    assert isinstance(sentences, MemmapTextSplit)
+    assert len(sentences) == ds.len_train == memmap_ds.len_train
+    for i in [0, 1, -1]:
+        assert sentences[i].split() == [word if word in words2idx else '<unk>'
+                                        for word in ds.X_train[source_id][i].split()]
+    assert sentences[:3] == [sentences[0], sentences[1], sentences[2]]
+
+    # The Dataset instance only keeps the location of the memory-mapped data
+    stored_ds = loadDataset(os.path.join(params['DATASET_STORE_PATH'], 'Dataset_' + memmap_ds.name + '.pkl'))
+    assert stored_ds.X_train[source_id][:10] == sentences[:10]
+
+    # The shuffling of the Dataset (also after loading it) keeps the memory-mapped data; sources and targets are
+    # shuffled in the same way
+    target_id = params['OUTPUTS_IDS_DATASET'][0]
+    pairs = set(zip(sentences[:], memmap_ds.Y_train[target_id][:]))
+    for shuffled_ds in [memmap_ds, stored_ds]:
+        shuffled_ds.shuffleTraining()
+        assert isinstance(shuffled_ds.X_train[source_id], MemmapTextSplit)
+        assert set(zip(shuffled_ds.X_train[source_id][:], shuffled_ds.Y_train[target_id][:])) == pairs
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -1,9 +1,11 @@
 import pytest
 import os
 
+import codecs
 import copy
 from config import load_parameters
-from data_engine.prepare_data import build_dataset, update_dataset_from_file, prepare_references
+from data_engine.parallel_tokenization import PARALLEL_TOKENIZATIONS
+from data_engine.prepare_data import build_dataset, dataset_fingerprint, update_dataset_from_file, prepare_references
 from keras_wrapper.dataset import Dataset, loadDataset
 
 
@@ -22,6 +24,48 @@ def test_build_datset():
             assert len(eval('ds.Y_' + split + str([params['OUTPUTS_IDS_DATASET'][0]]))) == len_split
 
 
+def test_dataset_cache(tmpdir):
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_CACHE_PATH'] = os.path.join(str(tmpdir), 'cache')
+    fingerprint = dataset_fingerprint(params)
+    # Parameters which do not change the dataset do not change the fingerprint
+    assert fingerprint == dataset_fingerprint(dict(params, BATCH_SIZE=params['BATCH_SIZE'] + 1))
+    assert fingerprint != dataset_fingerprint(dict(params, INPUT_VOCABULARY_SIZE=params['INPUT_VOCABULARY_SIZE'] + 1))
+    ds = build_dataset(params)
+    assert os.path.isfile(os.path.join(params['DATASET_CACHE_PATH'], fingerprint, 'Dataset_' + ds.name + '.pkl'))
+    cached_ds = build_dataset(params)
+    assert isinstance(cached_ds, Dataset)
+    assert cached_ds.len_train == ds.len_train
+    assert cached_ds.vocabulary == ds.vocabulary
+
+
+@pytest.mark.parametrize('tokenization', PARALLEL_TOKENIZATIONS)
+def test_build_dataset_parallel_tokenization(tokenization, tmpdir):
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['TOKENIZATION_METHOD'] = tokenization
+    if 'bpe' in tokenization:
+        from subword_nmt.learn_bpe import learn_bpe
+        params['BPE_CODES_PATH'] = os.path.join(str(tmpdir), 'training_codes.joint')
+        training_sentences = []
+        for lang in [params['SRC_LAN'], params['TRG_LAN']]:
+            with codecs.open(os.path.join(params['DATA_ROOT_PATH'], params['TEXT_FILES']['train'] + lang),
+                             'r', encoding='utf-8') as f:
+                training_sentences.extend(f.readlines())
+        with codecs.open(params['BPE_CODES_PATH'], 'w', encoding='utf-8') as codes:
+            learn_bpe(training_sentences, codes, 500)
+    ds = build_dataset(params)
+    params['PREPROCESSING_WORKERS'] = 2
+    parallel_ds = build_dataset(params)
+    assert parallel_ds.vocabulary == ds.vocabulary
+    for split in ['train', 'val', 'test']:
+        for data_id in params['INPUTS_IDS_DATASET'][:1]:
+            assert getattr(parallel_ds, 'X_' + split)[data_id] == getattr(ds, 'X_' + split)[data_id]
+        for data_id in params['OUTPUTS_IDS_DATASET']:
+            assert getattr(parallel_ds, 'Y_' + split)[data_id] == getattr(ds, 'Y_' + split)[data_id]
+
+
 def test_load_dataset():
     params = load_parameters()
     ds = loadDataset(os.path.join('datasets',
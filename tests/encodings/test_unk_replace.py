@@ -1,10 +1,56 @@
 import argparse
 import os
+import numpy as np
 import pytest
+from keras_wrapper.cnn_model import loadModel
+from keras_wrapper.dataset import loadDataset
+from keras_wrapper.model_ensemble import BeamSearchEnsemble
 from tests.test_config import load_tests_params, clean_dirs
-from data_engine.prepare_data import build_dataset
+from data_engine.prepare_data import build_dataset, update_dataset_from_file
 from nmt_keras.training import train_model
 from nmt_keras.apply_model import sample_ensemble, score_corpus
+from nmt_keras.scoring import TeacherForcingScorer
+
+
+def check_scoring_parity(parser, params, model_weights):
+    """
+    Checks that the teacher forcing scores match the ones of BeamSearchEnsemble.scoreNet (one forward pass of the
+    sampling models per target word, <eos> included), for an ensemble of two different models.
+    """
+    models = [loadModel(parser.models[0], -1, full_path=True) for _ in range(2)]
+    # Perturb the second model, so the ensemble members give different probabilities
+    rng = np.random.RandomState(1)
+    models[1].model.set_weights([w + rng.normal(scale=0.1, size=w.shape).astype(w.dtype)
+                                 for w in models[1].model.get_weights()])
+    dataset = update_dataset_from_file(loadDataset(parser.dataset),
+                                       parser.source,
+                                       params,
+                                       splits=parser.splits,
+                                       output_text_filename=parser.target,
+                                       compute_state_below=True)
+    params_prediction = {'max_batch_size': params['BATCH_SIZE'],
+                         'n_parallel_loaders': params['PARALLEL_LOADERS'],
+                         'predict_on_sets': parser.splits,
+                         'beam_size': params['BEAM_SIZE'],
+                         'maxlen': params['MAX_OUTPUT_TEXT_LEN_TEST'],
+                         'optimized_search': params['OPTIMIZED_SEARCH'],
+                         'model_inputs': params['INPUTS_IDS_MODEL'],
+                         'model_outputs': params['OUTPUTS_IDS_MODEL'],
+                         'dataset_inputs': params['INPUTS_IDS_DATASET'],
+                         'dataset_outputs': params['OUTPUTS_IDS_DATASET'],
+                         'state_below_maxlen': -1 if params.get('PAD_ON_BATCH', True)
+                         else params.get('MAX_OUTPUT_TEXT_LEN', 50)}
+    beam_scores = BeamSearchEnsemble(models,
+                                     dataset,
+                                     params_prediction,
+                                     model_weights=model_weights).scoreNet()
+    teacher_forcing_scores = TeacherForcingScorer(models,
+                                                  dataset,
+                                                  params_prediction,
+                                                  model_weights=model_weights).scoreNet()
+    for s in parser.splits:
+        assert len(beam_scores[s]) == len(teacher_forcing_scores[s]) == eval('dataset.len_' + s)
+        assert np.allclose(beam_scores[s], teacher_forcing_scores[s], rtol=1e-3, atol=1e-3)
 
 
 def test_unk_replace_0():
@@ -62,9 +108,30 @@ def test_unk_replace_0():
         sample_ensemble(parser, params)
         print("Done")
 
+    params['SEARCH_BATCH_SIZE'] = 4
+    for n_best in [True, False]:
+        parser.n_best = n_best
+        print("Sampling in batches with n_best = %s " % str(n_best))
+        sample_ensemble(parser, params)
+        print("Done")
+    params['SEARCH_BATCH_SIZE'] = 1
+
+    params['FOLD_EMBEDDING_PROJECTIONS'] = True
+    for n_best in [True, False]:
+        parser.n_best = n_best
+        print("Sampling with folded embedding projections and n_best = %s " % str(n_best))
+        sample_ensemble(parser, params)
+        print("Done")
+    params['FOLD_EMBEDDING_PROJECTIONS'] = False
+
     print("Scoring corpus")
     score_corpus(parser, params)
     print("Done")
+
+    print("Checking the teacher forcing scores")
+    for model_weights in [None, [0.3, 0.7]]:
+        check_scoring_parity(parser, params, model_weights)
+    print("Done")
     clean_dirs(params)
 
 
@@ -124,6 +191,15 @@ def test_unk_replace_1():
         sample_ensemble(parser, params)
         print("Done")
 
+    params['VOCABULARY_SHORTLIST'] = True
+    params['SHORTLIST_SIZE'] = 20
+    for n_best in [True, False]:
+        parser.n_best = n_best
+        print("Sampling with a vocabulary shortlist and n_best = %s " % str(n_best))
+        sample_ensemble(parser, params)
+        print("Done")
+    params['VOCABULARY_SHORTLIST'] = False
+
     print("Scoring corpus")
     score_corpus(parser, params)
     print("Done")
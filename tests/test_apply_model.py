@@ -0,0 +1,43 @@
+import argparse
+import codecs
+import os
+
+import pytest
+from nmt_keras.apply_model import _merge_shards, _shard_bounds
+
+
+def test_shard_bounds():
+    for n_sentences in [1, 2, 7, 10, 11]:
+        for n_workers in [1, 2, 3, 4, 20]:
+            shards = _shard_bounds(n_sentences, n_workers)
+            assert 0 < len(shards) <= min(n_workers, n_sentences)
+            # Contiguous, non-empty shards which cover the whole text
+            assert shards[0][0] == 0 and shards[-1][1] == n_sentences
+            for (first, last), (next_first, _) in zip(shards[:-1], shards[1:]):
+                assert first < last == next_first
+            # Only the last shard may be smaller
+            sizes = [last - first for first, last in shards]
+            assert all(size == sizes[0] for size in sizes[:-1]) and sizes[-1] <= sizes[0]
+    assert _shard_bounds(10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert _shard_bounds(0, 4) == [(0, 0)]
+
+
+def test_merge_shards(tmpdir):
+    sentences = [u'sentence %d' % i for i in range(10)]
+    shard_args_list = []
+    # The shards are written in reverse order, as workers may finish in any order
+    for i, (first, last) in reversed(list(enumerate(_shard_bounds(len(sentences), 3)))):
+        shard_args = argparse.Namespace(dest=os.path.join(str(tmpdir), 'shard_%d.hyp' % i))
+        with codecs.open(shard_args.dest, 'w', encoding='utf-8') as shard_file:
+            shard_file.write(u'\n'.join(sentences[first:last]) + u'\n')
+        with codecs.open(shard_args.dest + '.nbest', 'w', encoding='utf-8') as shard_file:
+            shard_file.write(u'\n'.join(u'%d ||| %s ||| 0.0' % (j, sentences[j]) for j in range(first, last)) + u'\n')
+        shard_args_list.insert(0, shard_args)
+    decoded_predictions, n_best_shards = _merge_shards(shard_args_list, n_best=True)
+    assert decoded_predictions == sentences
+    assert [int(line.split(u' ||| ')[0]) for line in u'\n'.join(n_best_shards).split(u'\n')] == list(range(10))
+    assert _merge_shards(shard_args_list)[1] == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
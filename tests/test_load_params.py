@@ -28,6 +28,15 @@ def test_params_exist():
     assert 'BEAM_SEARCH' in list(params)
     assert 'BEAM_SIZE' in list(params)
     assert 'OPTIMIZED_SEARCH' in list(params)
+    assert 'INCREMENTAL_DECODING' in list(params)
+    assert 'SEARCH_BATCH_SIZE' in list(params)
+    assert 'FOLD_EMBEDDING_PROJECTIONS' in list(params)
+    assert 'TRANSLATION_CACHE' in list(params)
+    assert 'TRANSLATION_CACHE_SIZE' in list(params)
+    assert 'VOCABULARY_SHORTLIST' in list(params)
+    assert 'SHORTLIST_SIZE' in list(params)
+    assert 'SHORTLIST_TRANSLATIONS' in list(params)
+    assert 'SCORING_BATCH_SIZE' in list(params)
     assert 'LENGTH_PENALTY' in list(params)
     assert 'LENGTH_NORM_FACTOR' in list(params)
     assert 'COVERAGE_PENALTY' in list(params)
@@ -119,6 +128,9 @@ def test_params_exist():
     assert 'RELOAD' in list(params)
     assert 'RELOAD_EPOCH' in list(params)
     assert 'REBUILD_DATASET' in list(params)
+    assert 'DATASET_CACHE_PATH' in list(params)
+    assert 'MEMMAP_SPLITS' in list(params)
+    assert 'PREPROCESSING_WORKERS' in list(params)
     assert 'MODE' in list(params)
     assert 'TRAIN_ON_TRAINVAL' in list(params)
     assert 'FORCE_RELOAD_VOCABULARY' in list(params)
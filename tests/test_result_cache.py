@@ -0,0 +1,72 @@
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo-web'))
+from result_cache import ResultCache, _estimate_size
+
+Request = namedtuple('Request', ['source_sentence', 'validated_prefix', 'params_prediction', 'n_best'])
+DEFAULT_PARAMS = {'beam_size': 6, 'length_norm_factor': 0., 'coverage_norm_factor': 0., 'alpha_factor': 0.,
+                  'max_batch_size': 20}
+
+
+def translation(hypothesis):
+    return {'hypothesis': hypothesis, 'score': 1., 'n_best': None}
+
+
+def test_result_cache_key():
+    cache = ResultCache()
+    key = cache.key(Request(u'la  casa ', None, None, 0), DEFAULT_PARAMS)
+    # Whitespace is normalized and the search parameters which do not change the translation are ignored
+    assert key == cache.key(Request(u'la casa', None, dict(DEFAULT_PARAMS, max_batch_size=1), 0), DEFAULT_PARAMS)
+    assert key != cache.key(Request(u'la casa', u'the ', None, 0), DEFAULT_PARAMS)
+    assert key != cache.key(Request(u'la casa', None, dict(DEFAULT_PARAMS, beam_size=12), 0), DEFAULT_PARAMS)
+    assert key != cache.key(Request(u'la casa', None, None, 5), DEFAULT_PARAMS)
+
+
+def test_result_cache_eviction():
+    cache = ResultCache(log_every=0)
+    keys = [cache.key(Request(u'sentence %d' % i, None, None, 0), DEFAULT_PARAMS) for i in range(4)]
+    entry_size = _estimate_size(keys[0]) + _estimate_size(translation(u'sentence 0'))
+    # Room for three entries
+    cache.max_bytes = 3 * entry_size + entry_size // 2
+    for i, key in enumerate(keys[:3]):
+        cache.put(key, translation(u'sentence %d' % i), cache.generation)
+    assert cache.n_bytes <= cache.max_bytes
+    # The least recently used entry is evicted
+    assert cache.get(keys[0])['hypothesis'] == u'sentence 0'
+    cache.put(keys[3], translation(u'sentence 3'), cache.generation)
+    assert cache.n_bytes <= cache.max_bytes
+    assert cache.get(keys[1]) is None
+    assert [cache.get(key)['hypothesis'] for key in [keys[0], keys[2], keys[3]]] == \
+        [u'sentence 0', u'sentence 2', u'sentence 3']
+    assert cache.hits == 4 and cache.misses == 1
+    assert cache.hit_ratio() == 0.8
+    # Entries larger than the cache are not stored
+    cache.put(keys[1], translation(u'sentence 1' * 1000), cache.generation)
+    assert cache.get(keys[1]) is None
+
+    disabled_cache = ResultCache(max_bytes=0)
+    disabled_cache.put(keys[0], translation(u'sentence 0'), disabled_cache.generation)
+    assert disabled_cache.get(keys[0]) is None
+
+
+def test_result_cache_clear():
+    cache = ResultCache(log_every=0)
+    key = cache.key(Request(u'la casa', None, None, 0), DEFAULT_PARAMS)
+    cache.put(key, translation(u'the house'), cache.generation)
+    generation = cache.generation
+    cache.clear()
+    assert cache.get(key) is None
+    assert cache.n_bytes == 0
+    # Translations requested before clearing the cache (e.g. with the old weights) are discarded
+    cache.put(key, translation(u'the house'), generation)
+    assert cache.get(key) is None
+    cache.put(key, translation(u'the home'), cache.generation)
+    assert cache.get(key)['hypothesis'] == u'the home'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo-web'))
+from server_metrics import ServerMetrics
+
+
+def test_render_histograms():
+    metrics = ServerMetrics(namespace='test', buckets=(0.1, 1.))
+    assert metrics.render() == '\n'
+    metrics.observe('parse_input', 0.05)
+    metrics.observe('parse_input', 0.5)
+    metrics.observe('parse_input', 2.)
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ['# HELP test_stage_duration_seconds Duration of each processing stage.',
+                         '# TYPE test_stage_duration_seconds histogram']
+    # Buckets are cumulative
+    assert lines[2:] == ['test_stage_duration_seconds_bucket{stage="parse_input",le="0.1"} 1',
+                         'test_stage_duration_seconds_bucket{stage="parse_input",le="1"} 2',
+                         'test_stage_duration_seconds_bucket{stage="parse_input",le="+Inf"} 3',
+                         'test_stage_duration_seconds_sum{stage="parse_input"} 2.550000',
+                         'test_stage_duration_seconds_count{stage="parse_input"} 3']
+
+
+def test_render_counters_and_gauges():
+    metrics = ServerMetrics(namespace='test')
+    metrics.increment('requests_total', 'Number of requests.', labels={'path': '/translate'})
+    metrics.increment('requests_total', 'Number of requests.', labels={'path': '/translate'}, value=2)
+    metrics.increment('requests_total', 'Number of requests.', labels={'path': 'a"b\\c'})
+    metrics.set_gauge('queue_size', 'Number of queued requests.', 4)
+    metrics.set_gauge('queue_size', 'Number of queued requests.', 2)
+    metrics.add_gauge('hit_ratio', 'Hit ratio of each cache.', lambda: [({'cache': 'source'}, 0.5)])
+    metrics.add_gauge('uptime_seconds', 'Time since the server started.', lambda: 10)
+    assert metrics.render().splitlines() == ['# HELP test_requests_total Number of requests.',
+                                             '# TYPE test_requests_total counter',
+                                             'test_requests_total{path="/translate"} 3.0',
+                                             'test_requests_total{path="a\\"b\\\\c"} 1.0',
+                                             '# HELP test_queue_size Number of queued requests.',
+                                             '# TYPE test_queue_size gauge',
+                                             'test_queue_size 2.0',
+                                             '# HELP test_hit_ratio Hit ratio of each cache.',
+                                             '# TYPE test_hit_ratio gauge',
+                                             'test_hit_ratio{cache="source"} 0.5',
+                                             '# HELP test_uptime_seconds Time since the server started.',
+                                             '# TYPE test_uptime_seconds gauge',
+                                             'test_uptime_seconds 10.0']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from config import load_parameters
+from nmt_keras.translation_cache import TranslationCache, translation_fingerprint
+
+
+def test_translation_fingerprint():
+    params = load_parameters()
+    params_prediction = {'beam_size': 6, 'max_batch_size': 20}
+    fingerprint = translation_fingerprint([], [], params_prediction, params)
+    # Parameters which do not change the translations do not change the fingerprint
+    assert fingerprint == translation_fingerprint([], [], {'beam_size': 6, 'max_batch_size': 50}, params)
+    assert fingerprint != translation_fingerprint([], [], {'beam_size': 12, 'max_batch_size': 20}, params)
+    assert fingerprint != translation_fingerprint([], [], params_prediction, params, glossary={u'casa': u'house'})
+
+
+def test_translation_fingerprint_files(tmpdir):
+    params = load_parameters()
+    params_prediction = {'beam_size': 6}
+    dataset_path = os.path.join(str(tmpdir), 'Dataset.pkl')
+    params['MAPPING'] = os.path.join(str(tmpdir), 'mapping.pkl')
+    fingerprints = []
+    # Files modified in place change the fingerprint
+    for contents in [b'vocabulary', b'new vocabulary']:
+        with open(dataset_path, 'wb') as f:
+            f.write(contents)
+        fingerprints.append(translation_fingerprint([], [], params_prediction, params, dataset_path=dataset_path))
+    for contents in [b'mapping', b'new mapping']:
+        with open(params['MAPPING'], 'wb') as f:
+            f.write(contents)
+        fingerprints.append(translation_fingerprint([], [], params_prediction, params, dataset_path=dataset_path))
+    assert len(set(fingerprints)) == len(fingerprints)
+
+
+def test_translation_cache(tmpdir):
+    cache_path = os.path.join(str(tmpdir), 'cache')
+    cache = TranslationCache(cache_path, 'fingerprint', max_size=10)
+    key = cache.key(u'la casa')
+    assert cache.get(key) is None
+    cache.set(key, {'translation': u'the house', 'n_best': None})
+    assert cache.get(key)['translation'] == u'the house'
+    assert cache.hits == 1 and cache.misses == 1
+    # Entries computed with other models are not shared
+    other_cache = TranslationCache(cache_path, 'other_fingerprint', max_size=10)
+    assert other_cache.get(other_cache.key(u'la casa')) is None
+
+    # Eviction
+    for i in range(20):
+        cache.set(cache.key(u'sentence %d' % i), {'translation': u'%d' % i, 'n_best': None})
+    assert cache.size <= 10
+    assert TranslationCache(cache_path, 'fingerprint').size == cache.size
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo-web'))
+from vocabulary_prefix_index import VocabularyPrefixIndex
+
+WORD2INDEX = {u'<pad>': 0, u'<unk>': 1, u'the': 2, u'then': 3, u'there': 4, u'them@@': 5, u'a': 6,
+              u'año': 7, u'años': 8, u'añadir': 9, u'ábaco': 10, u'über': 11, u'日本': 12, u'日本語': 13}
+
+
+def test_empty_prefix():
+    index = VocabularyPrefixIndex(WORD2INDEX)
+    assert sorted(index.indices_with_prefix(u'').tolist()) == sorted(WORD2INDEX.values())
+    assert index.idx2word_with_prefix(u'') == dict((i, word) for word, i in WORD2INDEX.items())
+
+
+def test_no_match():
+    index = VocabularyPrefixIndex(WORD2INDEX)
+    for prefix in [u'x', u'thex', u'zzz', u'\U0010ffff']:
+        assert len(index.indices_with_prefix(prefix)) == 0
+        assert index.idx2word_with_prefix(prefix) == {}
+    assert len(VocabularyPrefixIndex({}).indices_with_prefix(u'the')) == 0
+
+
+def test_whole_word_prefix():
+    index = VocabularyPrefixIndex(WORD2INDEX)
+    # The word itself and the longer words (and subword units) which start with it
+    assert index.idx2word_with_prefix(u'the') == {2: u'the', 3: u'then', 4: u'there', 5: u'them@@'}
+    assert index.idx2word_with_prefix(u'there') == {4: u'there'}
+    assert index.idx2word_with_prefix(u'a') == {6: u'a', 7: u'año', 8: u'años', 9: u'añadir'}
+    assert sorted(index.indices_with_prefix(u'then').tolist()) == [3]
+
+
+def test_non_ascii_prefix():
+    index = VocabularyPrefixIndex(WORD2INDEX)
+    assert index.idx2word_with_prefix(u'añ') == {7: u'año', 8: u'años', 9: u'añadir'}
+    assert index.idx2word_with_prefix(u'año') == {7: u'año', 8: u'años'}
+    assert index.idx2word_with_prefix(u'á') == {10: u'ábaco'}
+    assert index.idx2word_with_prefix(u'ü') == {11: u'über'}
+    assert index.idx2word_with_prefix(u'日本') == {12: u'日本', 13: u'日本語'}
+    # Accented characters are not confused with their unaccented forms
+    assert index.idx2word_with_prefix(u'u') == {}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
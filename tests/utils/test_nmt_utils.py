@@ -1,7 +1,7 @@
 import pytest
 from six import iteritems
 from config import load_parameters
-from utils.utils import update_parameters
+from utils.utils import update_parameters, read_chunks
 
 
 def test_update_parameters():
@@ -22,5 +22,13 @@ def test_update_parameters():
     assert new_params['NEW_PARAMETER'] == updates['NEW_PARAMETER']
 
 
+def test_read_chunks():
+    lines = ['sentence %d\n' % i for i in range(7)]
+    chunks = list(read_chunks(lines, 3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert sum(chunks, []) == [line.rstrip('\n') for line in lines]
+    assert list(read_chunks([], 3)) == []
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
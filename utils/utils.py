@@ -16,3 +16,34 @@ def update_parameters(params, updates, restrict=False):
             params[new_param_key] = new_param_value
 
     return params
+
+
+def read_chunks(file_object, chunk_size):
+    """
+    Reads the lines of a file object in chunks of (at most) chunk_size lines. Lines are returned without the trailing
+    newline. The file is never fully loaded in memory.
+    :param file_object: Opened file object (or any iterable of lines, e.g. sys.stdin)
+    :param chunk_size: Maximum number of lines per chunk
+    :return: Generator of lists of lines
+    """
+    assert chunk_size > 0, 'chunk_size must be a positive number. Currently it is: %s' % str(chunk_size)
+    chunk = []
+    for line in file_object:
+        chunk.append(line.rstrip('\n'))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def update_hash_from_file(hash_object, filepath, block_size=2 ** 20):
+    """
+    Updates a hash object with the contents of a file, read in blocks.
+    :param hash_object: Hash object to update
+    :param filepath: File to hash
+    :param block_size: Size (in bytes) of the blocks
+    """
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hash_object.update(block)